@@ -3,6 +3,7 @@
 import argparse
 import datetime as dt
 import platform
+from dataclasses import replace
 from functools import partial
 from typing import Any, Callable
 
@@ -39,7 +40,8 @@ def add_gbp_process(gbp: GBP) -> ProcessAdder:
 
 def add_local_process(database: str) -> ProcessAdder:
     """Return a function that can use SqliteRepository to add/update a given BuildProcess"""
-    repo = Repo(Settings(STORAGE_BACKEND="sqlite", SQLITE_DATABASE=database))
+    settings = Settings.from_environ()
+    repo = Repo(replace(settings, STORAGE_BACKEND="sqlite", SQLITE_DATABASE=database))
 
     def add_process(process: BuildProcess) -> None:
         add_or_update_process(repo, process)
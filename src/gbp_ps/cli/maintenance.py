@@ -0,0 +1,48 @@
+"""Prune and compact the local process database"""
+
+import argparse
+from dataclasses import replace
+
+from gbpcli.gbp import GBP
+from gbpcli.types import Console
+
+from gbp_ps.repository.sqlite import SqliteRepository
+from gbp_ps.settings import Settings
+
+
+def handler(args: argparse.Namespace, _gbp: GBP, console: Console) -> int:
+    """Prune and compact the local process database"""
+    settings = replace(Settings.from_environ(), SQLITE_DATABASE=args.local)
+    retention: int = (
+        settings.SQLITE_RETENTION if args.retention is None else args.retention
+    )
+    repo = SqliteRepository(settings)
+
+    pruned = repo.prune(retention)
+    repo.vacuum(full=args.full)
+    console.out.print(f"Pruned {pruned} process{'' if pruned == 1 else 'es'}")
+
+    return 0
+
+
+def parse_args(parser: argparse.ArgumentParser) -> None:
+    """Set subcommand arguments"""
+    parser.add_argument(
+        "-l", "--local", required=True, help="Where the local process database is"
+    )
+    parser.add_argument(
+        "-r",
+        "--retention",
+        type=int,
+        default=None,
+        help=(
+            "Prune processes that started more than this many seconds ago "
+            "(default: $GBP_PS_SQLITE_RETENTION). 0 prunes nothing"
+        ),
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        default=False,
+        help="Rebuild the database rather than incrementally vacuum it",
+    )
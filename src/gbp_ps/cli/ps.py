@@ -3,6 +3,7 @@
 import argparse
 import datetime as dt
 import time
+from dataclasses import replace
 from typing import Any, Callable, NoReturn
 
 from gbpcli import render
@@ -17,7 +18,8 @@ from rich.table import Table
 
 from gbp_ps import utils
 from gbp_ps.exceptions import swallow_exception
-from gbp_ps.repository import Repo
+from gbp_ps.inotify import Watcher
+from gbp_ps.repository.sqlite import SqliteRepository
 from gbp_ps.settings import Settings
 from gbp_ps.types import BuildProcess
 
@@ -33,6 +35,11 @@ def handler(args: argparse.Namespace, gbp: GBP, console: Console) -> int:
     """Show currently building packages"""
     continuous: bool = args.continuous
     a = args
+
+    if a.local and continuous:
+        status: int = local_continuous_handler(args, console)
+        return status
+
     proc_getter = (
         get_local_processes(a.local) if a.local else get_gbp_processes(gbp, a.machine)
     )
@@ -62,7 +69,10 @@ def parse_args(parser: argparse.ArgumentParser) -> None:
         "--update-interval",
         type=float,
         default=1,
-        help="In continuous mode, the interval, in seconds, between updates",
+        help=(
+            "In continuous mode, the interval, in seconds, between updates. "
+            "With --local, the longest to wait for the database to change"
+        ),
     )
     parser.add_argument(
         "-p",
@@ -109,9 +119,21 @@ def get_gbp_processes(gbp: GBP, machine: str | None) -> ProcessGetter:
     return get_processes
 
 
+def local_repo(database: str) -> SqliteRepository:
+    """Return the repository for the local process database
+
+    The other (GBP_PS_SQLITE_*) settings come from the environment.
+    """
+    settings = Settings.from_environ()
+
+    return SqliteRepository(
+        replace(settings, STORAGE_BACKEND="sqlite", SQLITE_DATABASE=database)
+    )
+
+
 def get_local_processes(database: str) -> ProcessGetter:
     """Return a list of processes given the database path"""
-    repo = Repo(Settings(STORAGE_BACKEND="sqlite", SQLITE_DATABASE=database))
+    repo = local_repo(database)
 
     def get_processes() -> ProcessList:
         return list(repo.get_processes())
@@ -137,6 +159,36 @@ def continuous_handler(
             live.update(update())
 
 
+@swallow_exception(KeyboardInterrupt, returns=0)
+def local_continuous_handler(args: argparse.Namespace, console: Console) -> int:
+    """Handler for the continuous-mode run of `gbp ps --local`
+
+    Rather than re-query on a timer, wait for the database (or its write-ahead log) to
+    be written to and re-query only if its data version says something was committed.
+    args.update_interval is the longest to wait. When showing elapsed times the table
+    is re-rendered at least that often regardless.
+    """
+    repo = local_repo(args.local)
+    watcher = Watcher(args.local)
+
+    def update() -> Table:
+        return create_table(list(repo.get_processes()), args)
+
+    version = repo.data_version()
+    out = console.out
+    ctx = Live(update(), console=out, screen=out.is_terminal, auto_refresh=False)
+    with ctx as live:
+        try:
+            while True:
+                watcher.wait(args.update_interval)
+
+                if (current := repo.data_version()) != version or args.elapsed:
+                    version = current
+                    live.update(update(), refresh=True)
+        finally:
+            watcher.close()
+
+
 def graphql_to_process(result: dict[str, Any]) -> BuildProcess:
     """Return GraphQL build process output as BuildProcess object"""
     return BuildProcess(
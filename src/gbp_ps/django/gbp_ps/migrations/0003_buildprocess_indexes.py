@@ -0,0 +1,55 @@
+# Generated by Django 6.1.2 on 2026-10-17 02:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [("gbp_ps", "0002_alter_buildprocess_phase")]
+
+    operations = [
+        # Superseded by the composite indexes below
+        migrations.AlterField(
+            model_name="buildprocess",
+            name="machine",
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AlterField(
+            model_name="buildprocess",
+            name="phase",
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name="buildprocess",
+            index=models.Index(
+                fields=["machine", "build_id", "package"], name="gbp_ps_process_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="buildprocess",
+            index=models.Index(
+                fields=["machine", "package", "phase"],
+                name="gbp_ps_machine_package_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="buildprocess",
+            index=models.Index(
+                fields=["machine", "start_time"], name="gbp_ps_machine_start_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="buildprocess",
+            index=models.Index(fields=["start_time"], name="gbp_ps_start_time_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="buildprocess",
+            index=models.Index(
+                condition=models.Q(
+                    ("phase__in", ["", "clean", "cleanrm", "postrm", "prerm"]),
+                    _negated=True,
+                ),
+                fields=["start_time"],
+                name="gbp_ps_live_start_time_idx",
+            ),
+        ),
+    ]
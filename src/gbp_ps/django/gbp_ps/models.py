@@ -3,24 +3,64 @@
 from typing import TypeVar
 
 from django.db import models
+from django.db.models.expressions import RawSQL
 
 from gbp_ps.types import BuildProcess as BuildProcessDataClass
 
 T = TypeVar("T", bound="BuildProcess")
+FINAL_PHASES = sorted(BuildProcessDataClass.final_phases)
+FINAL_PHASES_SQL = ", ".join(f"'{phase}'" for phase in FINAL_PHASES)
 
 
 class BuildProcess(models.Model):
     """A BuildProcess record in the database"""
 
-    machine = models.CharField(max_length=255, db_index=True)
+    machine = models.CharField(max_length=255)
     build_id = models.CharField(max_length=255)
     build_host = models.CharField(max_length=255)
     package = models.CharField(max_length=255)
-    phase = models.CharField(max_length=255, db_index=True)
+    phase = models.CharField(max_length=255)
     start_time = models.DateTimeField()
 
     class Meta:
         unique_together = [["machine", "build_id", "build_host", "package"]]
+        indexes = [
+            # Looking up a process by (machine, build_id, package)
+            models.Index(
+                fields=["machine", "build_id", "package"], name="gbp_ps_process_idx"
+            ),
+            # Finding processes of other builds of a package
+            models.Index(
+                fields=["machine", "package", "phase"],
+                name="gbp_ps_machine_package_idx",
+            ),
+            # Listing processes by start time
+            models.Index(
+                fields=["machine", "start_time"], name="gbp_ps_machine_start_idx"
+            ),
+            models.Index(fields=["start_time"], name="gbp_ps_start_time_idx"),
+            # The (default) listing of processes not in a final phase. Only on databases
+            # that support partial indexes
+            models.Index(
+                fields=["start_time"],
+                name="gbp_ps_live_start_time_idx",
+                condition=~models.Q(phase__in=FINAL_PHASES),
+            ),
+        ]
+
+    @staticmethod
+    def live() -> RawSQL:
+        """Return the filter for processes that are not in a final phase
+
+        This is the condition of the gbp_ps_live_start_time_idx index but with the
+        phases as literals, rather than query parameters, so that the database can tell
+        that the (partial) index applies.
+        """
+        return RawSQL(
+            f"NOT (phase IN ({FINAL_PHASES_SQL}))",
+            (),
+            output_field=models.BooleanField(),
+        )
 
     def to_dataclass(self) -> BuildProcessDataClass:
         """Convert to the non-ORM object"""
@@ -5,8 +5,7 @@ from typing import Any
 from ariadne import ObjectType
 from graphql import GraphQLResolveInfo
 
-from gbp_ps.repository import Repo, add_or_update_process
-from gbp_ps.settings import Settings
+from gbp_ps.repository import add_or_update_process, get_repo
 from gbp_ps.types import BuildProcess
 
 type Info = GraphQLResolveInfo
@@ -26,4 +25,4 @@ def add_build_process(_obj: Any, _info: Info, process: dict[str, Any]) -> None:
         return
 
     process["build_id"] = process.pop("id")
-    add_or_update_process(Repo(Settings.from_environ()), BuildProcess(**process))
+    add_or_update_process(get_repo(), BuildProcess(**process))
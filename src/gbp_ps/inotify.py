@@ -0,0 +1,110 @@
+"""Wait for changes to a SQLite database file using inotify
+
+Only Linux has inotify. Elsewhere, or if inotify cannot be initialized, Watcher.wait()
+simply sleeps for the timeout, which is no worse than polling.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from pathlib import Path
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# struct inotify_event { int wd; uint32_t mask; uint32_t cookie; uint32_t len; ... }
+EVENT = struct.Struct("iIII")
+BUFFER_SIZE = 64 * 1024
+
+# Files SQLite writes for a database. Writes to the -shm file are through mmap and so
+# are invisible to inotify, but every commit also writes to the -wal (or -journal) file
+SUFFIXES = ("", "-wal", "-journal")
+
+
+class Watcher:
+    """Wait for writes to a SQLite database file or its write-ahead log
+
+    The directory is watched, rather than the files, because the -wal file comes and
+    goes.
+    """
+
+    def __init__(self, database: str) -> None:
+        path = Path(database).absolute()
+        self.names = {os.fsencode(f"{path.name}{suffix}") for suffix in SUFFIXES}
+        self.fd = inotify_watch(path.parent)
+
+    def wait(self, timeout: float) -> bool:
+        """Wait up to timeout seconds for the database to be written to
+
+        Return True if it was (or might have been) written to and False if the timeout
+        expired without a write.
+        """
+        if self.fd is None:
+            time.sleep(timeout)
+            return True
+
+        deadline = time.monotonic() + timeout
+
+        while True:
+            remaining = max(deadline - time.monotonic(), 0.0)
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+
+            if ready and self.names.intersection(read_names(self.fd)):
+                return True
+
+            if not remaining:
+                return False
+
+    def close(self) -> None:
+        """Stop watching"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def inotify_watch(path: Path) -> int | None:
+    """Return a non-blocking inotify file descriptor watching path
+
+    If inotify is not available return None.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+    except (AttributeError, OSError):
+        return None
+
+    if (fd := init(os.O_NONBLOCK | os.O_CLOEXEC)) < 0:
+        return None
+
+    if add_watch(fd, os.fsencode(path), WATCH_MASK) < 0:
+        os.close(fd)
+        return None
+
+    return int(fd)
+
+
+def read_names(fd: int) -> set[bytes]:
+    """Drain the pending events from the inotify fd and return the file names"""
+    names: set[bytes] = set()
+
+    while True:
+        try:
+            data = os.read(fd, BUFFER_SIZE)
+        except BlockingIOError:
+            return names
+
+        if not data:
+            return names
+
+        offset = 0
+        while offset < len(data):
+            *_, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            names.add(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
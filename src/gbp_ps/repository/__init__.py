@@ -3,6 +3,7 @@
 from __future__ import annotations
 
 import importlib.metadata
+import threading
 from collections.abc import Iterable
 from typing import Any, Protocol
 
@@ -19,6 +20,9 @@ else:
 
 BACKENDS = {ep.name: ep for ep in importlib.metadata.entry_points(group="gbp_ps.repos")}
 
+_repos: dict[Settings, RepositoryType] = {}
+_repos_lock = threading.Lock()
+
 
 class RepositoryType(Protocol):
     """BuildProcess Repository"""
@@ -63,6 +67,34 @@ def Repo(settings: Settings) -> RepositoryType:  # pylint: disable=invalid-name
     raise ValueError(f"Invalid storage backend: {settings.STORAGE_BACKEND!r}")
 
 
+def get_repo(settings: Settings | None = None) -> RepositoryType:
+    """Return the shared Repository for the given settings
+
+    If settings is not given, the settings are taken from the environment.
+
+    Creating a Repository can be expensive (e.g. connection pools, schema creation) so
+    rather than creating one per request, a Repository is created the first time it is
+    asked for and shared (across threads) for the life of the process.
+    """
+    settings = Settings.from_environ() if settings is None else settings
+
+    if (repo := _repos.get(settings)) is None:
+        with _repos_lock:
+            if (repo := _repos.get(settings)) is None:
+                repo = _repos[settings] = Repo(settings)
+
+    return repo
+
+
+def clear_repos() -> None:
+    """Forget the shared Repositories
+
+    Subsequent calls to get_repo() will create new ones.
+    """
+    with _repos_lock:
+        _repos.clear()
+
+
 def add_or_update_process(repo: RepositoryType, process: BuildProcess) -> None:
     """Add or update the process
 
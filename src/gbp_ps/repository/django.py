@@ -1,20 +1,23 @@
 """Django RepositoryType"""
 
-from typing import Iterable
+from typing import Any, Iterable
 
 from gbp_ps.exceptions import RecordAlreadyExists, RecordNotFoundError
 from gbp_ps.settings import Settings
 from gbp_ps.types import BuildProcess
 
+FIELDS = ("machine", "build_id", "build_host", "package", "phase", "start_time")
+
 
 class DjangoRepository:
     """Django ORM-based BuildProcess repository"""
 
-    def __init__(self, _settings: Settings) -> None:
+    def __init__(self, settings: Settings) -> None:
         # pylint: disable=import-outside-toplevel
         from gbp_ps.django.gbp_ps.models import BuildProcess as BuildProcessModel
 
         self.model: type[BuildProcessModel] = BuildProcessModel
+        self.chunk_size = settings.DJANGO_FETCH_CHUNK_SIZE
 
     def add_process(self, process: BuildProcess) -> None:
         """Add the given BuildProcess to the repository
@@ -48,20 +51,27 @@ class DjangoRepository:
 
         If the build process doesn't exist in the repo, RecordNotFoundError is raised.
         """
-        try:
-            build_process_model = self.model.objects.get(
-                machine=process.machine,
-                build_id=process.build_id,
-                package=process.package,
-            )
-        except self.model.DoesNotExist:
-            raise RecordNotFoundError(process) from None
+        query = self.model.objects.filter(
+            machine=process.machine, build_id=process.build_id, package=process.package
+        )
+        # The conditions under which BuildProcess.ensure_updateable() allows the update
+        allowed = (
+            query.filter(build_host=process.build_host)
+            if process.phase in BuildProcess.final_phases
+            else query
+        )
+
+        if allowed.update(phase=process.phase, build_host=process.build_host):
+            return
+
+        # Either there is no such process or the update is not allowed. Find out which
+        if not (rows := [*query.values_list(*FIELDS)[:1]]):
+            raise RecordNotFoundError(process)
 
-        build_process_model.to_dataclass().ensure_updateable(process)
+        row_to_process(rows[0]).ensure_updateable(process)
 
-        build_process_model.phase = process.phase
-        build_process_model.build_host = process.build_host
-        build_process_model.save()
+        # The process was added after we tried to update it
+        query.update(phase=process.phase, build_host=process.build_host)
 
     def get_processes(
         self, include_final: bool = False, machine: str | None = None
@@ -74,9 +84,16 @@ class DjangoRepository:
         query = self.model.objects.order_by("start_time")
 
         if not include_final:
-            query = query.exclude(phase__in=BuildProcess.final_phases)
+            query = query.filter(self.model.live())
 
         if machine:
             query = query.filter(machine=machine)
 
-        return (model.to_dataclass() for model in query)
+        rows = query.values_list(*FIELDS).iterator(chunk_size=self.chunk_size)
+
+        return (row_to_process(row) for row in rows)
+
+
+def row_to_process(row: tuple[Any, ...]) -> BuildProcess:
+    """Return a BuildProcess given the values_list() row of FIELDS"""
+    return BuildProcess(**dict(zip(FIELDS, row)))
@@ -0,0 +1,57 @@
+-- Add a process
+--
+-- KEYS: process key, machine index, package index[, machines index[, stream]]
+-- ARGV: process value, expiration, machine, start time, channel, stream maxlen, now,
+--       build phases...
+--
+-- Processes for the same machine and package but a different build that are still in
+-- one of the build phases are deleted (the other build presumably failed).
+--
+-- Return {1, deleted} if the process was added or {0, deleted} if it already exists,
+-- where deleted is the number of processes from other builds that were deleted.
+--
+-- The deletions and the addition are published on the channel. The addition is also
+-- appended to the stream.
+local key, stream = KEYS[1], KEYS[5]
+local indexes = {machine = KEYS[2], package = KEYS[3], machines = KEYS[4]}
+local value, expiration, machine = ARGV[1], ARGV[2], ARGV[3]
+local start_time, channel, maxlen, now = ARGV[4], ARGV[5], ARGV[6], ARGV[7]
+local build_phases = set_of(ARGV, 8)
+local package, build_id = key_ids(key)
+local deleted = 0
+
+indexes.machine_name = machine
+
+for _, other in ipairs(redis.call("SMEMBERS", indexes.package)) do
+    if other ~= key then
+        local other_value = redis.call("GET", other)
+        local remove = not other_value
+
+        if other_value then
+            local _, phase = unpack_value(other_value)
+            if build_phases[phase] then
+                redis.call("DEL", other)
+                deleted = deleted + 1
+                remove = true
+                publish(channel, "delete", machine, key_ids(other))
+            end
+        end
+
+        if remove then
+            redis.call("SREM", indexes.package, other)
+            redis.call("ZREM", indexes.machine, other)
+        end
+    end
+end
+
+if redis.call("EXISTS", key) == 1 then
+    return {0, deleted}
+end
+
+set_process(key, value, expiration, indexes, start_time, false)
+
+local build_host, phase = unpack_value(value)
+publish(channel, "add", machine, package, build_id, build_host, phase)
+append_to_stream(stream, maxlen, now, machine, package, build_id, build_host, phase)
+
+return {1, deleted}
@@ -0,0 +1,70 @@
+-- Add a process to a machine's process hash
+--
+-- KEYS: machine hash, machine packages hash[, machines index[, stream]]
+-- ARGV: package, package id, build id, process value, expiration, machine, now,
+--       channel, stream maxlen, build phases...
+--
+-- Hash fields are "<package id>:<build id>" and values are (build_host, phase,
+-- start_time, expires). The packages hash maps each package to the (space-separated)
+-- build ids it has fields for, so only the package's own fields are looked at: those
+-- which have expired are deleted as are those of a different build that are still in
+-- one of the build phases (the other build presumably failed).
+--
+-- Return {1, deleted} if the process was added or {0, deleted} if it already exists,
+-- where deleted is the number of processes from other builds that were deleted.
+--
+-- The deletions of processes from other builds and the addition are published on the
+-- channel. The addition is also appended to the stream.
+local hash, packages, machines, stream = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local package, id, build_id, value = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+local expiration, machine, now, channel = ARGV[5], ARGV[6], tonumber(ARGV[7]), ARGV[8]
+local maxlen = ARGV[9]
+local build_phases = set_of(ARGV, 10)
+local builds = {}
+local deleted, exists = 0, false
+
+for other in string.gmatch(redis.call("HGET", packages, package) or "", "%S+") do
+    local field = id .. ":" .. other
+    local other_value = redis.call("HGET", hash, field)
+
+    if other_value then
+        local _, phase = unpack_value(other_value)
+
+        if value_expires(other_value) <= now then
+            redis.call("HDEL", hash, field)
+        elseif other == build_id then
+            exists = true
+            table.insert(builds, other)
+        elseif build_phases[phase] then
+            redis.call("HDEL", hash, field)
+            deleted = deleted + 1
+            publish(channel, "delete", machine, package, other)
+        else
+            table.insert(builds, other)
+        end
+    end
+end
+
+if not exists then
+    redis.call("HSET", hash, id .. ":" .. build_id, value)
+    table.insert(builds, build_id)
+end
+
+redis.call("HSET", packages, package, table.concat(builds, " "))
+
+if machines then
+    redis.call("SADD", machines, machine)
+end
+for _, key in ipairs({hash, packages, machines}) do
+    redis.call("EXPIRE", key, expiration)
+end
+
+if exists then
+    return {0, deleted}
+end
+
+local build_host, phase = unpack_value(value)
+publish(channel, "add", machine, package, build_id, build_host, phase)
+append_to_stream(stream, maxlen, ARGV[7], machine, package, build_id, build_host, phase)
+
+return {1, deleted}
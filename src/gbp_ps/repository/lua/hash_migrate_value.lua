@@ -0,0 +1,15 @@
+-- Replace a process value in a machine hash with the same value in the current format
+--
+-- KEYS: machine hash
+-- ARGV: field, current value, new value
+--
+-- The value is only replaced if it hasn't changed since it was read.
+--
+-- Return 1 if the value was replaced, otherwise 0
+if redis.call("HGET", KEYS[1], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+
+redis.call("HSET", KEYS[1], ARGV[1], ARGV[3])
+
+return 1
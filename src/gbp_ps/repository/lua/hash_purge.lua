@@ -0,0 +1,40 @@
+-- Delete expired processes from a machine's process hash
+--
+-- KEYS: machine hash, machine packages hash
+-- ARGV: now, package, package id, build id[, package, package id, build id...]
+--
+-- The processes were found to be expired when listing, possibly on a replica, so they
+-- are checked again here: only those which have expired (or are gone) are deleted,
+-- along with their build ids in the packages hash.
+--
+-- Return the number of processes deleted
+local hash, packages, now = KEYS[1], KEYS[2], tonumber(ARGV[1])
+local deleted = 0
+
+for i = 2, #ARGV, 3 do
+    local package, build_id = ARGV[i], ARGV[i + 2]
+    local field = ARGV[i + 1] .. ":" .. build_id
+    local value = redis.call("HGET", hash, field)
+
+    if not value or value_expires(value) <= now then
+        if value then
+            redis.call("HDEL", hash, field)
+            deleted = deleted + 1
+        end
+
+        local builds = {}
+        for other in string.gmatch(redis.call("HGET", packages, package) or "", "%S+") do
+            if other ~= build_id then
+                table.insert(builds, other)
+            end
+        end
+
+        if #builds > 0 then
+            redis.call("HSET", packages, package, table.concat(builds, " "))
+        else
+            redis.call("HDEL", packages, package)
+        end
+    end
+end
+
+return deleted
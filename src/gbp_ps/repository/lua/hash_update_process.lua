@@ -0,0 +1,59 @@
+-- Update a process's build host and phase in a machine's process hash
+--
+-- KEYS: machine hash, machine packages hash[, machines index[, stream]]
+-- ARGV: package, package id, build id, packed build host, packed phase,
+--       packed expires, build host, phase, expiration, machine, now, channel,
+--       stream maxlen, final phases...
+--
+-- Like BuildProcess.ensure_updateable(), a build host may not put a process owned by
+-- another build host into a final phase. The update is published on the channel and
+-- appended to the stream.
+--
+-- Return {1} if the process was updated, {0} if it does not exist or {-1, previous}
+-- if the update is not allowed, where previous is the existing process value.
+local hash, packages, machines, stream = KEYS[1], KEYS[2], KEYS[3], KEYS[4]
+local package, id, build_id = ARGV[1], ARGV[2], ARGV[3]
+local packed_build_host, packed_phase, packed_expires = ARGV[4], ARGV[5], ARGV[6]
+local build_host, phase, expiration = ARGV[7], ARGV[8], ARGV[9]
+local machine, now, channel = ARGV[10], tonumber(ARGV[11]), ARGV[12]
+local maxlen = ARGV[13]
+local final_phases = set_of(ARGV, 14)
+local field = id .. ":" .. build_id
+local previous = redis.call("HGET", hash, field)
+
+if not previous then
+    return {0}
+end
+
+local previous_build_host, _, pos, header = unpack_value(previous)
+local expires_pos = skip(previous, pos)
+
+if unpack_uint(previous, expires_pos) <= now then
+    redis.call("HDEL", hash, field)
+    return {0}
+end
+
+if previous_build_host ~= build_host and final_phases[phase] then
+    return {-1, previous}
+end
+
+-- Keep the array header (and version) and start_time of the previous value
+local value = header
+    .. packed_build_host
+    .. packed_phase
+    .. string.sub(previous, pos, expires_pos - 1)
+    .. packed_expires
+
+redis.call("HSET", hash, field, value)
+
+if machines then
+    redis.call("SADD", machines, machine)
+end
+for _, key in ipairs({hash, packages, machines}) do
+    redis.call("EXPIRE", key, expiration)
+end
+
+publish(channel, "update", machine, package, build_id, build_host, phase)
+append_to_stream(stream, maxlen, ARGV[11], machine, package, build_id, build_host, phase)
+
+return {1}
@@ -0,0 +1,164 @@
+-- Helpers shared by the gbp-ps Redis scripts.
+--
+-- Process values are msgpack-encoded arrays of the form
+-- (version, build_host, phase, start_time, ...) where start_time is an epoch
+-- timestamp. Version 1 values have no version and start_time is an ISO string. The
+-- scripts mostly need the build host and phase so these functions only know how to
+-- decode the few msgpack types that appear in process values.
+
+-- Return the msgpack string at position pos of value and the position following it
+local function unpack_str(value, pos)
+    local byte = string.byte(value, pos)
+    local len
+
+    if byte >= 0xa0 and byte <= 0xbf then
+        len = byte - 0xa0
+        pos = pos + 1
+    elseif byte == 0xd9 then
+        len = string.byte(value, pos + 1)
+        pos = pos + 2
+    elseif byte == 0xda then
+        len = string.byte(value, pos + 1) * 256 + string.byte(value, pos + 2)
+        pos = pos + 3
+    else
+        error("gbp-ps: unsupported process value")
+    end
+
+    return string.sub(value, pos, pos + len - 1), pos + len
+end
+
+-- Return the msgpack unsigned integer at position pos of value and the next position
+local function unpack_uint(value, pos)
+    local byte = string.byte(value, pos)
+    local size
+
+    if byte <= 0x7f then
+        return byte, pos + 1
+    elseif byte == 0xcc then
+        size = 1
+    elseif byte == 0xcd then
+        size = 2
+    elseif byte == 0xce then
+        size = 4
+    elseif byte == 0xcf then
+        size = 8
+    else
+        error("gbp-ps: unsupported process value")
+    end
+
+    local number = 0
+    for i = 1, size do
+        number = number * 256 + string.byte(value, pos + i)
+    end
+
+    return number, pos + size + 1
+end
+
+-- Return the position following the msgpack string or number at position pos
+local function skip(value, pos)
+    local byte = string.byte(value, pos)
+
+    if byte == 0xca then
+        return pos + 5
+    elseif byte == 0xcb then
+        return pos + 9
+    elseif byte <= 0x7f or (byte >= 0xcc and byte <= 0xcf) then
+        local _, next_pos = unpack_uint(value, pos)
+        return next_pos
+    end
+
+    local _, next_pos = unpack_str(value, pos)
+    return next_pos
+end
+
+-- Return the build host and phase of the process value, the position following them
+-- and the array header (including the version, if any) preceding them
+local function unpack_value(value)
+    local pos = 2
+
+    if string.byte(value, pos) <= 0x7f then
+        pos = pos + 1
+    end
+
+    local header = string.sub(value, 1, pos - 1)
+    local build_host, phase
+    build_host, pos = unpack_str(value, pos)
+    phase, pos = unpack_str(value, pos)
+
+    return build_host, phase, pos, header
+end
+
+-- Return the package and build id of the given process key (or hash field)
+local function key_ids(key)
+    return string.match(key, "([^:]*):([^:]*)$")
+end
+
+-- Return the expiration time of the given process hash value
+local function value_expires(value)
+    local _, _, pos = unpack_value(value)
+
+    return unpack_uint(value, skip(value, pos))
+end
+
+-- Publish a change message on the channel, unless the channel is empty
+--
+-- The message is the given words separated by spaces:
+-- <action> <machine> <package> <build_id> [<build_host> <phase>]
+local function publish(channel, ...)
+    if channel ~= "" then
+        redis.call("PUBLISH", channel, table.concat({...}, " "))
+    end
+end
+
+-- Append a change to the stream, unless there is no stream key
+--
+-- The stream is capped at about maxlen entries. The fields are those of
+-- gbp_ps.repository.redis.RedisRepository.written().
+local function append_to_stream(
+    stream, maxlen, timestamp, machine, package, build_id, build_host, phase
+)
+    if stream then
+        redis.call(
+            "XADD", stream, "MAXLEN", "~", maxlen, "*",
+            "machine", machine,
+            "build_id", build_id,
+            "package", package,
+            "build_host", build_host,
+            "phase", phase,
+            "timestamp", timestamp
+        )
+    end
+end
+
+-- Return a table whose keys are the given values
+local function set_of(values, first)
+    local set = {}
+    for i = first, #values do
+        set[values[i]] = true
+    end
+
+    return set
+end
+
+-- Write the process key and add it to the index sets
+--
+-- The machine index is a sorted set of process keys scored by start time. If
+-- keep_score is true and the key is already in the machine index its score is kept.
+-- The machines index is optional (it is maintained by the client in cluster mode).
+local function set_process(key, value, expiration, indexes, score, keep_score)
+    redis.call("SET", key, value, "EX", expiration)
+
+    if keep_score then
+        redis.call("ZADD", indexes.machine, "NX", score, key)
+    else
+        redis.call("ZADD", indexes.machine, score, key)
+    end
+    redis.call("SADD", indexes.package, key)
+    if indexes.machines then
+        redis.call("SADD", indexes.machines, indexes.machine_name)
+    end
+
+    for _, index in ipairs({indexes.machine, indexes.package, indexes.machines}) do
+        redis.call("EXPIRE", index, expiration)
+    end
+end
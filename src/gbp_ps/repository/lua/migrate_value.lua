@@ -0,0 +1,16 @@
+-- Replace a process value with the same value in the current format
+--
+-- KEYS: process key
+-- ARGV: current value, new value
+--
+-- The value is only replaced if it hasn't changed since it was read. The key's
+-- expiration is kept.
+--
+-- Return 1 if the value was replaced, otherwise 0
+if redis.call("GET", KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+
+redis.call("SET", KEYS[1], ARGV[2], "KEEPTTL")
+
+return 1
@@ -0,0 +1,19 @@
+-- Remove machines, found to be empty, from the machines index
+--
+-- KEYS: machines index, machine key[, machine key...]
+-- ARGV: machine[, machine...]
+--
+-- The machines were found to be empty when listing, possibly on a replica or just
+-- before a process was added, so each is checked again here: a machine is only
+-- removed if its key (see RedisRepository.machine_key()) does not exist.
+--
+-- Return the number of machines removed
+local removed = 0
+
+for i, machine in ipairs(ARGV) do
+    if redis.call("EXISTS", KEYS[i + 1]) == 0 then
+        removed = removed + redis.call("SREM", KEYS[1], machine)
+    end
+end
+
+return removed
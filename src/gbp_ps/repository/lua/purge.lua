@@ -0,0 +1,17 @@
+-- Remove an expired process key from its machine's indexes
+--
+-- KEYS: process key, machine time index, machine package index
+--
+-- The key was found to be missing when listing, possibly on a replica which has yet
+-- to receive it, so it is checked again here: it is only removed from the indexes if
+-- it does not exist.
+--
+-- Return 1 if the key was removed from the indexes, otherwise 0
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    return 0
+end
+
+redis.call("ZREM", KEYS[2], KEYS[1])
+redis.call("SREM", KEYS[3], KEYS[1])
+
+return 1
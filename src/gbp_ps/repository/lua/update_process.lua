@@ -0,0 +1,47 @@
+-- Update a process's build host and phase
+--
+-- KEYS: process key, machine index, package index[, machines index[, stream]]
+-- ARGV: packed build host, packed phase, build host, phase, expiration, machine,
+--       start time, channel, stream maxlen, now, final phases...
+--
+-- Like BuildProcess.ensure_updateable(), a build host may not put a process owned by
+-- another build host into a final phase.
+--
+-- The start time is only used to index the process if it is not already indexed. The
+-- update is published on the channel and appended to the stream.
+--
+-- Return {1} if the process was updated, {0} if it does not exist or {-1, previous}
+-- if the update is not allowed, where previous is the existing process value.
+local key, stream = KEYS[1], KEYS[5]
+local indexes = {machine = KEYS[2], package = KEYS[3], machines = KEYS[4]}
+local packed_build_host, packed_phase = ARGV[1], ARGV[2]
+local build_host, phase, expiration, machine = ARGV[3], ARGV[4], ARGV[5], ARGV[6]
+local start_time, channel, maxlen, now = ARGV[7], ARGV[8], ARGV[9], ARGV[10]
+local final_phases = set_of(ARGV, 11)
+local previous = redis.call("GET", key)
+
+indexes.machine_name = machine
+
+if not previous then
+    return {0}
+end
+
+local previous_build_host, _, pos, header = unpack_value(previous)
+
+if previous_build_host ~= build_host and final_phases[phase] then
+    return {-1, previous}
+end
+
+-- Keep the array header (and version) and start_time of the previous value
+local value = header
+    .. packed_build_host
+    .. packed_phase
+    .. string.sub(previous, pos)
+
+set_process(key, value, expiration, indexes, start_time, true)
+
+local package, build_id = key_ids(key)
+publish(channel, "update", machine, package, build_id, build_host, phase)
+append_to_stream(stream, maxlen, now, machine, package, build_id, build_host, phase)
+
+return {1}
@@ -1,18 +1,36 @@
 """Redis RepositoryType"""
 
+# pylint: disable=too-many-lines
+
+import contextlib
 import datetime as dt
 import functools
+import hashlib
+import heapq
+import itertools
+import time
 from dataclasses import dataclass
-from typing import Any, Callable, Iterable, Self
+from importlib import resources
+from typing import Any, Callable, Iterable, Iterator, Self, TypeVar, cast
 
 import ormsgpack
 import redis
+from redis.cache import CacheConfig
+from redis.crc import key_slot
 
-from gbp_ps.exceptions import RecordAlreadyExists, RecordNotFoundError
+from gbp_ps.exceptions import (
+    RecordAlreadyExists,
+    RecordNotFoundError,
+    UpdateNotAllowedError,
+)
 from gbp_ps.settings import Settings
 from gbp_ps.types import BuildProcess
 
 ENCODING = "ascii"
+VALUE_VERSION = 2
+REPLICA_CHECK_INTERVAL = 5.0
+now = time.time
+T = TypeVar("T")
 
 dumps: Callable[[Any], bytes] = functools.partial(
     ormsgpack.packb, option=ormsgpack.OPT_NAIVE_UTC
@@ -20,6 +38,199 @@ dumps: Callable[[Any], bytes] = functools.partial(
 loads: Callable[[bytes], Any] = ormsgpack.unpackb  # pylint: disable=no-member
 
 
+def pack_value(
+    build_host: str, phase: str, start_time: dt.datetime, *rest: Any
+) -> bytes:
+    """Return the (current version) redis value for the given process fields"""
+    return dumps((VALUE_VERSION, build_host, phase, start_time.timestamp(), *rest))
+
+
+def unpack_value(value: bytes) -> tuple[str, str, dt.datetime, list[Any]]:
+    """Return the build host, phase, start time and any remaining fields of the value
+
+    Version 1 values are (build_host, phase, start_time, ...) where start_time is an
+    ISO string. Version 2 values are (2, build_host, phase, start_time, ...) where
+    start_time is an epoch timestamp.
+    """
+    data = loads(value)
+
+    if value_version(value) == 1:
+        build_host, phase, start_time, *rest = data
+        return build_host, phase, dt.datetime.fromisoformat(start_time), rest
+
+    _, build_host, phase, timestamp, *rest = data
+    return build_host, phase, dt.datetime.fromtimestamp(timestamp, tz=dt.UTC), rest
+
+
+def value_version(value: bytes) -> int:
+    """Return the format version of the given redis value"""
+    # The byte following the array header is either a (fixint) version or, for version
+    # 1, the header of the build_host string
+    return value[1] if value[1] <= 0x7F else 1
+
+
+def lua_script(name: str) -> str:
+    """Return the source of the given Lua script, including the common library"""
+    package = "gbp_ps.repository.lua"
+
+    return resources.read_text(package, "lib.lua") + resources.read_text(
+        package, f"{name}.lua"
+    )
+
+
+ADD_PROCESS_SCRIPT = lua_script("add_process")
+UPDATE_PROCESS_SCRIPT = lua_script("update_process")
+HASH_ADD_PROCESS_SCRIPT = lua_script("hash_add_process")
+HASH_UPDATE_PROCESS_SCRIPT = lua_script("hash_update_process")
+MIGRATE_VALUE_SCRIPT = lua_script("migrate_value")
+PURGE_SCRIPT = lua_script("purge")
+PRUNE_MACHINES_SCRIPT = lua_script("prune_machines")
+HASH_MIGRATE_VALUE_SCRIPT = lua_script("hash_migrate_value")
+HASH_PURGE_SCRIPT = lua_script("hash_purge")
+
+
+def connect(url: str, settings: Settings) -> "redis.Redis[bytes]":
+    """Return a Redis client for the given url
+
+    If settings.REDIS_CLIENT_CACHE_SIZE is non-zero, the client uses RESP3
+    server-assisted client-side caching. Read results are then cached in this process
+    (up to that many entries) and Redis notifies the client when keys it has read
+    change, invalidating them.
+
+    If settings.REDIS_CLUSTER is true, the client is a Redis Cluster client. It
+    presents (mostly) the same interface as the single-node client.
+    """
+    options: dict[str, Any] = {}
+
+    if size := settings.REDIS_CLIENT_CACHE_SIZE:
+        options.update(protocol=3, cache_config=CacheConfig(max_size=size))
+
+    if settings.REDIS_CLUSTER:
+        # The cluster client is not a subclass of redis.Redis but it quacks like one
+        return cast("redis.Redis[bytes]", redis.RedisCluster.from_url(url, **options))
+
+    return redis.Redis.from_url(url, **options)
+
+
+def hash_tag(machine: str) -> str:
+    """Return the machine name as a Redis Cluster hash tag
+
+    Keys containing the same hash tag are stored in the same cluster slot, so
+    multi-key commands and scripts can operate on them.
+    """
+    return f"{{{machine}}}"
+
+
+@dataclass
+class Replica:
+    """A replica client and its availability"""
+
+    client: "redis.Redis[bytes]"
+
+    # Time (epoch) until which the replica is skipped
+    skip_until: float = 0.0
+
+    # Time (epoch) the replica's lag was last checked
+    checked: float = 0.0
+
+
+class Replicas:
+    """The replicas that reads are sent to
+
+    Replicas are read from in turn. A replica which fails is skipped for
+    REPLICA_CHECK_INTERVAL seconds. If max_lag is non-zero, replicas are also skipped
+    when their link to the primary is down or they have not heard from the primary in
+    more than max_lag seconds. Lag is checked at most every REPLICA_CHECK_INTERVAL
+    seconds.
+    """
+
+    def __init__(self, replicas: list[Replica], max_lag: int = 0) -> None:
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.turn = 0
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> Self:
+        """Return the replicas given in the settings
+
+        Replicas are not used in cluster mode.
+        """
+        urls = settings.REDIS_READ_URL.replace(",", " ").split()
+
+        if settings.REDIS_CLUSTER:
+            urls = []
+
+        return cls(
+            [Replica(connect(url, settings)) for url in urls],
+            max_lag=settings.REDIS_READ_MAX_LAG,
+        )
+
+    def __len__(self) -> int:
+        return len(self.replicas)
+
+    def __iter__(self) -> Iterator["redis.Redis[bytes]"]:
+        """Iterate over the available replicas' clients, starting with the next in turn"""
+        count = len(self.replicas)
+        start = self.turn
+        self.turn = (start + 1) % max(count, 1)
+
+        for i in range(count):
+            replica = self.replicas[(start + i) % count]
+
+            if self.available(replica):
+                yield replica.client
+
+    def available(self, replica: Replica) -> bool:
+        """Return True if the replica can be read from"""
+        current_time = now()
+
+        if replica.skip_until > current_time:
+            return False
+
+        if self.max_lag and replica.checked + REPLICA_CHECK_INTERVAL <= current_time:
+            replica.checked = current_time
+            try:
+                lagging = self.lagging(replica.client)
+            except (redis.ConnectionError, redis.TimeoutError):
+                lagging = True
+
+            if lagging:
+                replica.skip_until = current_time + REPLICA_CHECK_INTERVAL
+                return False
+
+        return True
+
+    def lagging(self, client: "redis.Redis[bytes]") -> bool:
+        """Return True if the replica's replication lag is more than max_lag"""
+        info = client.info("replication")
+
+        return (
+            info.get("master_link_status") != "up"
+            or info.get("master_last_io_seconds_ago", 0) > self.max_lag
+        )
+
+    def failed(self, client: "redis.Redis[bytes]") -> None:
+        """Skip the replica with the given client for a while"""
+        for replica in self.replicas:
+            if replica.client is client:
+                replica.skip_until = now() + REPLICA_CHECK_INTERVAL
+
+
+@dataclass(frozen=True, slots=True)
+class Cursor:
+    """A position in a listing of processes, for paging through it
+
+    Processes are listed in order of start time and, among those with the same start
+    time, of key.
+    """
+
+    # start time (epoch) of the last process listed
+    start_time: float
+
+    # redis key of the last process listed
+    key: bytes
+
+
 @dataclass(kw_only=True, frozen=True, slots=True)
 class Key:
     """Redis key bytes parsed"""
@@ -28,48 +239,82 @@ class Key:
     machine: str
     build_id: str
     package: str
+    tagged: bool = False
 
     def __bytes__(self) -> bytes:
-        return (
-            f"{self.redis_key}:{self.machine}:{self.package}:{self.build_id}"
-        ).encode(ENCODING)
+        machine = hash_tag(self.machine) if self.tagged else self.machine
+
+        return f"{self.redis_key}:{machine}:{self.package}:{self.build_id}".encode(
+            ENCODING
+        )
 
     @classmethod
     def from_bytes(cls, b: bytes) -> Self:
         """Return the redis key from bytes"""
         string = b.decode(ENCODING)
         redis_key, machine, package, build_id = string.split(":")
+        tagged = machine.startswith("{")
 
         return cls(
-            redis_key=redis_key, machine=machine, build_id=build_id, package=package
+            redis_key=redis_key,
+            machine=machine[1:-1] if tagged else machine,
+            build_id=build_id,
+            package=package,
+            tagged=tagged,
         )
 
     @classmethod
-    def from_process(cls, process: BuildProcess, redis_key: str) -> Self:
-        """Return Key given BuildProcess and redis_key"""
+    def from_process(
+        cls, process: BuildProcess, redis_key: str, tagged: bool = False
+    ) -> Self:
+        """Return Key given BuildProcess and redis_key
+
+        If tagged is True, the machine name in the key is a (cluster) hash tag.
+        """
         return cls(
             redis_key=redis_key,
             machine=process.machine,
             build_id=process.build_id,
             package=process.package,
+            tagged=tagged,
         )
 
 
 class RedisRepository:
     """Redis backend for the process table"""
 
+    # pylint: disable=too-many-instance-attributes,too-many-public-methods
+
+    add_process_script = ADD_PROCESS_SCRIPT
+    update_process_script = UPDATE_PROCESS_SCRIPT
+    migrate_value_script = MIGRATE_VALUE_SCRIPT
+    purge_script = PURGE_SCRIPT
+
     def __init__(self, settings: Settings) -> None:
-        self._redis = redis.Redis.from_url(settings.REDIS_URL)
+        self.client_cache = settings.REDIS_CLIENT_CACHE_SIZE > 0
+        self.cluster = settings.REDIS_CLUSTER
+        self._redis = connect(settings.REDIS_URL, settings)
+        self.replicas = Replicas.from_settings(settings)
         self._key = settings.REDIS_KEY
         self.time = settings.REDIS_KEY_EXPIRATION
+        self.batch_size = settings.REDIS_FETCH_BATCH_SIZE
+        self.channel = settings.REDIS_CHANNEL
+        self.stream = settings.REDIS_STREAM
+        self.stream_maxlen = settings.REDIS_STREAM_MAXLEN
+        self.indexed = False
+        self._add_process = self._redis.register_script(self.add_process_script)
+        self._update_process = self._redis.register_script(self.update_process_script)
+        self._migrate_value = self._redis.register_script(self.migrate_value_script)
+        self._purge = self._redis.register_script(self.purge_script)
+        self._prune_machines = self._redis.register_script(PRUNE_MACHINES_SCRIPT)
 
     def key(self, process: BuildProcess) -> bytes:
         """Return the redis key for the given BuildProcess"""
-        return bytes(Key.from_process(process, self._key))
+        return bytes(Key.from_process(process, self._key, self.cluster))
 
     def value(self, process: BuildProcess) -> bytes:
         """Return the redis value for the given BuildProcess"""
-        return dumps((process.build_host, process.phase, process.start_time))
+        return pack_value(process.build_host, process.phase, process.start_time)
 
     def process_to_redis(self, process: BuildProcess) -> tuple[bytes, bytes]:
         """Return the redis key and value for the given BuildProcess"""
@@ -78,54 +323,656 @@ class RedisRepository:
     def redis_to_process(self, key_bytes: bytes, value: bytes) -> BuildProcess:
         """Convert the given key and value to a BuildProcess"""
         key = Key.from_bytes(key_bytes)
-        data = loads(value)
+        build_host, phase, start_time, _ = unpack_value(value)
 
         return BuildProcess(
-            build_host=data[0],
+            build_host=build_host,
             build_id=key.build_id,
             machine=key.machine,
             package=key.package,
-            phase=data[1],
-            start_time=dt.datetime.fromisoformat(data[2]),
+            phase=phase,
+            start_time=start_time,
         )
 
+    @staticmethod
+    def migrated_value(value: bytes) -> bytes:
+        """Return the given redis value converted to the current version"""
+        build_host, phase, start_time, rest = unpack_value(value)
+
+        return pack_value(build_host, phase, start_time, *rest)
+
+    def tag(self, machine: str) -> str:
+        """Return the machine name as it appears in per-machine keys
+
+        In cluster mode this is a hash tag so that all of a machine's keys are stored
+        in the same slot.
+        """
+        return hash_tag(machine) if self.cluster else machine
+
+    def machine_key(self, machine: str) -> bytes:
+        """Return the redis key which exists as long as the machine has processes"""
+        return self.machine_index(machine)
+
+    def machines_index(self) -> bytes:
+        """Return the redis key of the set of machines having processes"""
+        return f"{self._key}.index:machines".encode(ENCODING)
+
+    def machine_index(self, machine: str) -> bytes:
+        """Return the redis key of the machine's process keys sorted by start time"""
+        return f"{self._key}.started:{self.tag(machine)}".encode(ENCODING)
+
+    def package_index(self, machine: str, package: str) -> bytes:
+        """Return the redis key of the set of process keys for the machine/package"""
+        return f"{self._key}.index:{self.tag(machine)}:{package}".encode(ENCODING)
+
+    def indexed_key(self) -> bytes:
+        """Return the redis key which exists once the process keys have been indexed"""
+        return f"{self._key}.index:indexed".encode(ENCODING)
+
+    def script_keys(self, process: BuildProcess) -> list[bytes]:
+        """Return the redis keys the add/update scripts operate on for the process
+
+        In cluster mode the machines index and the stream are (likely) in a different
+        slot than the machine's keys so they are left out and updated separately.
+        """
+        keys = [
+            self.key(process),
+            self.machine_index(process.machine),
+            self.package_index(process.machine, process.package),
+        ]
+        return keys if self.cluster else [*keys, *self.shared_keys()]
+
+    def shared_keys(self) -> list[bytes]:
+        """Return the keys, shared by all machines, that the scripts also write to
+
+        These are the machines index and, if settings.REDIS_STREAM is set, the stream.
+        """
+        keys = [self.machines_index()]
+
+        return [*keys, self.stream.encode(ENCODING)] if self.stream else keys
+
+    def written(self, process: BuildProcess) -> None:
+        """Record the given process, which was just added or updated
+
+        In cluster mode the process' machine is added to the machines index and, if
+        settings.REDIS_STREAM is set, the process is appended to the stream. Otherwise
+        the scripts do this themselves.
+        """
+        if not self.cluster:
+            return
+
+        with self._redis.pipeline(transaction=False) as pipe:
+            pipe.sadd(self.machines_index(), process.machine)
+            pipe.expire(self.machines_index(), self.time)
+
+            if self.stream:
+                pipe.xadd(
+                    self.stream,
+                    {
+                        "machine": process.machine,
+                        "build_id": process.build_id,
+                        "package": process.package,
+                        "build_host": process.build_host,
+                        "phase": process.phase,
+                        "timestamp": now(),
+                    },
+                    maxlen=self.stream_maxlen,
+                    approximate=True,
+                )
+            pipe.execute()
+
     def add_process(self, process: BuildProcess) -> None:
         """Add the given BuildProcess to the repository
 
         If the process already exists in the repo, RecordAlreadyExists is raised
         """
-        # If this package exists in another build, remove it. This (usually) means the
-        # other build failed
-        self.delete_existing_processes(process)
-        key, value = self.process_to_redis(process)
-        previous = self._redis.get(key)
+        # If this package exists in another build, the script removes it. This
+        # (usually) means the other build failed
+        added, _ = self._add_process(
+            keys=self.script_keys(process),
+            args=[
+                self.value(process),
+                self.time,
+                process.machine,
+                process.start_time.timestamp(),
+                self.channel,
+                self.stream_maxlen,
+                now(),
+                *BuildProcess.build_phases,
+            ],
+        )
 
-        if previous and self.redis_to_process(key, previous).is_same_as(process):
+        if not added:
             raise RecordAlreadyExists(process)
 
-        self._redis.setex(key, self.time, value)
+        self.written(process)
+
+    def update_process(self, process: BuildProcess) -> None:
+        """Update the given build process
+
+        Only updates the phase field
+
+        If the build process doesn't exist in the repo, RecordNotFoundError is raised.
+        """
+        status, *previous = self._update_process(
+            keys=self.script_keys(process),
+            args=[
+                dumps(process.build_host),
+                dumps(process.phase),
+                process.build_host,
+                process.phase,
+                self.time,
+                process.machine,
+                process.start_time.timestamp(),
+                self.channel,
+                self.stream_maxlen,
+                now(),
+                *BuildProcess.final_phases,
+            ],
+        )
+
+        if status == 0:
+            raise RecordNotFoundError(process)
+
+        if status < 0:
+            previous_process = self.redis_to_process(self.key(process), previous[0])
+            raise UpdateNotAllowedError(previous_process, process)
+
+        self.written(process)
+
+    def get_processes(  # pylint: disable=too-many-arguments,too-many-locals
+        self,
+        include_final: bool = False,
+        machine: str | None = None,
+        *,
+        after: dt.datetime | Cursor | None = None,
+        limit: int | None = None,
+        newest_first: bool = False,
+    ) -> Iterable[BuildProcess]:
+        """Return the process records from the repository
+
+        If include_final is True also include processes in their "final" phase. The
+        default value is False.
+
+        Processes are returned in order of start_time or, if newest_first is True, in
+        reverse order. If after is given, only processes after it (in that order) are
+        returned. after is either a start time or, to page through the processes, the
+        cursor() of the last process of the previous page. If limit is given, at most
+        that many processes are returned.
+        """
+        if limit == 0:
+            return []
+
+        if not self.indexed:
+            self.backfill_indexes()
+            self.indexed = True
+
+        # All of the reads are done on the same client so that they see the same data
+        machines, found, live, expired, outdated = self.from_replica(
+            lambda client: self.read_processes(
+                client,
+                machine,
+                include_final=include_final,
+                after=after,
+                limit=limit,
+                newest_first=newest_first,
+            )
+        )
+
+        if expired:
+            self.purge_index(expired)
+
+        if outdated:
+            self.migrate_values(outdated)
+
+        if not after and (empty := [name for name in machines if name not in live]):
+            self.prune_machines(empty)
 
-    def delete_existing_processes(self, process: BuildProcess) -> int:
-        """Delete existing processes like process
+        entries = heapq.merge(
+            *found.values(), key=lambda entry: entry[:2], reverse=newest_first
+        )
+        return [process for _, _, process in itertools.islice(entries, limit)]
+
+    def read_processes(  # pylint: disable=too-many-arguments,too-many-locals
+        self,
+        client: "redis.Redis[bytes]",
+        machine: str | None,
+        *,
+        include_final: bool,
+        after: dt.datetime | Cursor | None,
+        limit: int | None,
+        newest_first: bool,
+    ) -> tuple[
+        list[str],
+        dict[str, list[tuple[float, bytes, BuildProcess]]],
+        set[str],
+        list[bytes],
+        list[tuple[bytes, bytes]],
+    ]:
+        """Read the processes for get_processes() using the given client
+
+        Return the machines read, the (score, key, process) entries found for each
+        machine, the machines with live processes, the expired keys and the
+        (key, value)s of the outdated values.
+        """
+        machines = [machine] if machine else self.machines(client)
+        found: dict[str, list[tuple[float, bytes, BuildProcess]]] = {
+            name: [] for name in machines
+        }
+        live: set[str] = set()
+        expired: list[bytes] = []
+        outdated: list[tuple[bytes, bytes]] = []
+        pending = machines
+        offset = 0
+
+        # Each round reads the next window of each machine's time index. A machine
+        # needs another round only if its window was full but, because of final or
+        # expired processes (or those at the cursor), did not yield enough processes
+        while pending:
+            windows = self.time_index_windows(
+                pending, after, offset, limit, newest_first, client=client
+            )
+            values = iter(
+                self.mget(
+                    [key for window in windows for key, _ in window], client=client
+                )
+            )
+            next_pending = []
+
+            for name, window in zip(pending, windows):
+                for key_bytes, score in window:
+                    if (value := next(values)) is None:
+                        expired.append(key_bytes)
+                        continue
+                    process = self.redis_to_process(key_bytes, value)
+                    live.add(name)
+
+                    if value_version(value) < VALUE_VERSION:
+                        outdated.append((key_bytes, value))
+
+                    if (include_final or not process.is_finished()) and is_after(
+                        (score, key_bytes), after, newest_first
+                    ):
+                        found[name].append((score, key_bytes, process))
+
+                if limit and len(window) == limit:
+                    if len(found[name]) < limit:
+                        next_pending.append(name)
+
+            pending = next_pending
+            offset += limit or 0
+
+        return machines, found, live, expired, outdated
+
+    def cursor(self, process: BuildProcess) -> Cursor:
+        """Return the cursor for listing the processes after the given process"""
+        return Cursor(process.start_time.timestamp(), self.key(process))
+
+    def backfill_indexes(self) -> None:
+        """Add process keys written before the index sets existed to the indexes
+
+        This is done once per Redis database, the first time processes are listed,
+        after which the scripts maintain the indexes. The process keys are found with
+        SCAN, in batches of settings.REDIS_FETCH_BATCH_SIZE, and indexed as the scripts
+        would index them. Keys that are already indexed keep their score.
+
+        Cluster mode came after the indexes so there is nothing to backfill.
+        """
+        if self.cluster or self._redis.exists(self.indexed_key()):
+            return
+
+        keys = self._redis.scan_iter(
+            match=f"{self._key}:*", count=self.batch_size, _type="STRING"
+        )
+        for batch in itertools.batched(keys, self.batch_size):
+            values = self._redis.mget(batch)
+
+            with self._redis.pipeline(transaction=False) as pipe:
+                for key_bytes, value in zip(batch, values):
+                    if value is not None:
+                        self.index_key(pipe, key_bytes, value)
+                pipe.execute()
+
+        self._redis.set(self.indexed_key(), 1)
+
+    def index_key(self, pipe: Any, key_bytes: bytes, value: bytes) -> None:
+        """Add the commands to index the given process key/value to the pipeline"""
+        key = Key.from_bytes(key_bytes)
+        _, _, start_time, _ = unpack_value(value)
+        indexes = [
+            self.machine_index(key.machine),
+            self.package_index(key.machine, key.package),
+            self.machines_index(),
+        ]
+        pipe.zadd(indexes[0], {key_bytes: start_time.timestamp()}, nx=True)
+        pipe.sadd(indexes[1], key_bytes)
+        pipe.sadd(indexes[2], key.machine)
+
+        for index in indexes:
+            pipe.expire(index, self.time)
+
+    def machines(self, client: "redis.Redis[bytes] | None" = None) -> list[str]:
+        """Return the machines in the machines index
+
+        The index is read using the given client, or the primary if not given.
+        """
+        members = (client or self._redis).smembers(self.machines_index())
+
+        return sorted(machine.decode(ENCODING) for machine in members)
+
+    def prune_machines(self, machines: list[str]) -> None:
+        """Remove the given machines, which were found to be empty, from the index
+
+        A machine may have had a process added since it was read, or a (lagging)
+        replica may not yet have its processes, so a machine is only removed if its
+        machine_key() does not exist on the primary. The script checks and removes
+        atomically. In cluster mode the machine keys are in other slots than the index,
+        so the client checks them first.
+        """
+        if not self.cluster:
+            self._prune_machines(
+                keys=[self.machines_index(), *map(self.machine_key, machines)],
+                args=machines,
+            )
+            return
+
+        with self._redis.pipeline(transaction=False) as pipe:
+            for machine in machines:
+                pipe.exists(self.machine_key(machine))
+            exists = pipe.execute()
+
+        if machines := [machine for machine, e in zip(machines, exists) if not e]:
+            self._redis.srem(self.machines_index(), *machines)
+
+    def time_index_windows(  # pylint: disable=too-many-arguments
+        self,
+        machines: list[str],
+        after: dt.datetime | Cursor | None,
+        offset: int,
+        count: int | None,
+        newest_first: bool = False,
+        *,
+        client: "redis.Redis[bytes] | None" = None,
+    ) -> list[list[tuple[bytes, float]]]:
+        """Return the process keys, and their scores, for each machine's time index
+
+        Keys are in order of start time (or reverse order if newest_first is True).
+        Only processes started after `after` (if given) are included, starting at
+        offset and (if given) limited to count keys. For a cursor the processes with
+        the cursor's start time are included. It is up to the caller to skip those
+        before the cursor's key.
+        """
+        match after:
+            case None:
+                bound = "-inf" if not newest_first else "+inf"
+            case Cursor():
+                bound = repr(after.start_time)
+            case _:
+                bound = f"({after.timestamp()!r}"
+
+        offset_or_none = offset if count is not None else None
+        command, args = (
+            ("zrevrangebyscore", (bound, "-inf"))
+            if newest_first
+            else ("zrangebyscore", (bound, "+inf"))
+        )
+
+        windows: list[list[tuple[bytes, float]]] = self.read(
+            command,
+            [
+                (self.machine_index(machine), *args, offset_or_none, count, True)
+                for machine in machines
+            ],
+            client,
+        )
+        return windows
+
+    def mget(
+        self, keys: list[bytes], client: "redis.Redis[bytes] | None" = None
+    ) -> list[bytes | None]:
+        """Return the values for the given keys
+
+        The values are fetched in one round trip using a pipeline of MGETs of at most
+        settings.REDIS_FETCH_BATCH_SIZE keys each so as not to block the Redis server
+        for too long on a single command. In cluster mode an MGET may only contain keys
+        from one slot, so the batches are also split where the slot changes.
+        """
+        size = self.batch_size
+        groups = (
+            [list(group) for _, group in itertools.groupby(keys, key=key_slot)]
+            if self.cluster
+            else [keys]
+        )
+        batches: list[list[bytes | None]] = self.read(
+            "mget",
+            [
+                (group[i : i + size],)
+                for group in groups
+                for i in range(0, len(group), size)
+            ],
+            client,
+        )
+        return [value for batch in batches for value in batch]
+
+    def read(
+        self,
+        command: str,
+        args_list: list[tuple[Any, ...]],
+        client: "redis.Redis[bytes] | None" = None,
+    ) -> list[Any]:
+        """Run the given (read-only) command for each of the given arguments
+
+        Return the list of results. The commands are sent in a single pipeline except
+        when client-side caching is enabled. Pipelined commands bypass the client-side
+        cache so, in that case, they are sent individually and most are served from
+        the cache without a round trip to Redis.
+
+        In cluster mode the pipeline fans out to the primaries owning the keys, sending
+        each its commands before reading any of the replies.
+
+        The commands are sent using the given client, or the primary if not given.
+        """
+        client = client or self._redis
+
+        if self.client_cache:
+            method = getattr(client, command)
+            return [method(*args) for args in args_list]
+
+        with client.pipeline(transaction=False) as pipe:
+            for args in args_list:
+                getattr(pipe, command)(*args)
+            results: list[Any] = pipe.execute()
+
+        return results
+
+    def from_replica(self, func: Callable[["redis.Redis[bytes]"], T]) -> T:
+        """Return func(client) for the next available replica's client
+
+        If there are no replicas available, or they fail, use the primary. func should
+        do all of its reads with the client, so that they see the same data.
+        """
+        for client in self.replicas:
+            try:
+                return func(client)
+            except (redis.ConnectionError, redis.TimeoutError):
+                self.replicas.failed(client)
+
+        return func(self._redis)
+
+    def migrate_values(self, items: list[tuple[bytes, bytes]]) -> None:
+        """Rewrite the given (key, value) pairs in the current value format
+
+        Values that have changed since they were read are left alone.
+        """
+        with self.script_pipeline() as pipe:
+            for key_bytes, value in items:
+                self._migrate_value(
+                    keys=[key_bytes],
+                    args=[value, self.migrated_value(value)],
+                    client=pipe,
+                )
+            if pipe is not None:
+                pipe.execute()
+
+    @contextlib.contextmanager
+    def script_pipeline(self) -> Iterator[Any]:
+        """Context manager for a pipeline to run scripts in
 
-        By "existing" we mean processes in Redis that have the same machine and package
-        but different build_id.
+        Cluster pipelines cannot load scripts on the nodes that don't have them, so in
+        cluster mode the context value is None and scripts are run individually.
+        """
+        if self.cluster:
+            yield None
+            return
+
+        with self._redis.pipeline(transaction=False) as pipe:
+            yield pipe
+
+    def purge_index(self, keys: list[bytes]) -> None:
+        """Remove the given process keys, found expired, from the index sets
+
+        The keys may have been read from a replica, so the script only removes those
+        which do not exist on the primary.
+        """
+        with self.script_pipeline() as pipe:
+            for key_bytes in keys:
+                key = Key.from_bytes(key_bytes)
+                self._purge(
+                    keys=[
+                        key_bytes,
+                        self.machine_index(key.machine),
+                        self.package_index(key.machine, key.package),
+                    ],
+                    client=pipe,
+                )
+            if pipe is not None:
+                pipe.execute()
+
+
+def is_after(
+    position: tuple[float, bytes], after: dt.datetime | Cursor | None, reverse: bool
+) -> bool:
+    """Return True if the (start time, key) position comes after `after` in a listing
+
+    If reverse is True the listing is newest first.
+    """
+    if after is None:
+        return True
+
+    if isinstance(after, Cursor):
+        following = position > (after.start_time, after.key)
+        preceding = position < (after.start_time, after.key)
+    else:
+        following = position[0] > after.timestamp()
+        preceding = position[0] < after.timestamp()
+
+    return preceding if reverse else following
+
+
+def package_id(package: str) -> str:
+    """Return the id of the given package in a machine's process hash fields
+
+    This is the first 12 hex digits of the SHA1 of the package name: shorter than most
+    package names and of a fixed length.
+    """
+    return hashlib.sha1(package.encode()).hexdigest()[:12]
+
+
+class RedisHashRepository(RedisRepository):
+    """Redis backend storing each machine's processes in a single hash
+
+    Rather than a key per process, and index entries for it, each machine has a hash
+    whose fields are "<package id>:<build_id>" (see package_id()), with a second hash
+    mapping each of the machine's packages to the build ids it has fields for. This
+    keeps the per-process overhead down to a small field in a hash. Redis stores
+    hashes compactly (as a listpack) while they have no more than
+    hash-max-listpack-entries fields (128 by default), which large build farms may
+    want to raise.
+
+    Redis (prior to 7.4) cannot expire hash fields, so each value carries its own
+    expiration time. A package's expired fields are deleted when the package is added
+    again, the rest when processes are listed, and the hashes as a whole expire when
+    their machine has had no writes for the expiration period.
+    """
+
+    add_process_script = HASH_ADD_PROCESS_SCRIPT
+    update_process_script = HASH_UPDATE_PROCESS_SCRIPT
+    migrate_value_script = HASH_MIGRATE_VALUE_SCRIPT
+    purge_script = HASH_PURGE_SCRIPT
+
+    def machine_hash(self, machine: str) -> bytes:
+        """Return the redis key of the hash of processes for the given machine"""
+        return f"{self._key}.hash:{self.tag(machine)}".encode(ENCODING)
+
+    def packages_hash(self, machine: str) -> bytes:
+        """Return the redis key of the hash of build ids of the machine's packages"""
+        return f"{self._key}.packages:{self.tag(machine)}".encode(ENCODING)
+
+    def machine_key(self, machine: str) -> bytes:
+        return self.machine_hash(machine)
+
+    def hash_script_keys(self, machine: str) -> list[bytes]:
+        """Return the redis keys the add/update scripts operate on for the machine"""
+        keys = [self.machine_hash(machine), self.packages_hash(machine)]
+
+        return keys if self.cluster else [*keys, *self.shared_keys()]
+
+    @staticmethod
+    def field(process: BuildProcess) -> bytes:
+        """Return the machine hash field for the given BuildProcess"""
+        return f"{package_id(process.package)}:{process.build_id}".encode(ENCODING)
+
+    def value(self, process: BuildProcess) -> bytes:
+        """Return the hash value for the given BuildProcess"""
+        return pack_value(
+            process.build_host, process.phase, process.start_time, self.expires()
+        )
+
+    def expires(self) -> int:
+        """Return the expiration time (epoch) for values written now"""
+        return int(now()) + self.time
+
+    @staticmethod
+    def hash_to_process(
+        machine: str, package: str, build_id: str, value: bytes
+    ) -> tuple[BuildProcess, int]:
+        """Return the BuildProcess and its expiration time given the hash value"""
+        build_host, phase, start_time, [expires] = unpack_value(value)
+        process = BuildProcess(
+            build_host=build_host,
+            build_id=build_id,
+            machine=machine,
+            package=package,
+            phase=phase,
+            start_time=start_time,
+        )
+        return process, expires
 
-        Return the number of processes deleted.
+    def add_process(self, process: BuildProcess) -> None:
+        """Add the given BuildProcess to the repository
+
+        If the process already exists in the repo, RecordAlreadyExists is raised
         """
-        build_id = process.build_id
-        deleted_count = 0
-        pattern = f"{self._key}:{process.machine}:{process.package}:*".encode(ENCODING)
-        for key_bytes in self._redis.keys(pattern):
-            key = Key.from_bytes(key_bytes)
-            if key.build_id != build_id:
-                value = self._redis.get(key_bytes)
-                assert value
-                existing_process = self.redis_to_process(key_bytes, value)
-                if existing_process.phase in BuildProcess.build_phases:
-                    self._redis.delete(key_bytes)
-                    deleted_count += 1
-        return deleted_count
+        added, _ = self._add_process(
+            keys=self.hash_script_keys(process.machine),
+            args=[
+                process.package,
+                package_id(process.package),
+                process.build_id,
+                self.value(process),
+                self.time,
+                process.machine,
+                now(),
+                self.channel,
+                self.stream_maxlen,
+                *BuildProcess.build_phases,
+            ],
+        )
+
+        if not added:
+            raise RecordAlreadyExists(process)
+
+        self.written(process)
 
     def update_process(self, process: BuildProcess) -> None:
         """Update the given build process
@@ -134,34 +981,153 @@ class RedisRepository:
 
         If the build process doesn't exist in the repo, RecordNotFoundError is raised.
         """
-        key_bytes = self.key(process)
-        previous_value = self._redis.get(key_bytes)
+        status, *previous = self._update_process(
+            keys=self.hash_script_keys(process.machine),
+            args=[
+                process.package,
+                package_id(process.package),
+                process.build_id,
+                dumps(process.build_host),
+                dumps(process.phase),
+                dumps(self.expires()),
+                process.build_host,
+                process.phase,
+                self.time,
+                process.machine,
+                now(),
+                self.channel,
+                self.stream_maxlen,
+                *BuildProcess.final_phases,
+            ],
+        )
 
-        if previous_value is None:
+        if status == 0:
             raise RecordNotFoundError(process)
 
-        self.redis_to_process(key_bytes, previous_value).ensure_updateable(process)
-        new_value = (process.build_host, process.phase, loads(previous_value)[2])
-        self._redis.setex(key_bytes, self.time, dumps(new_value))
+        if status < 0:
+            previous_process, _ = self.hash_to_process(
+                process.machine, process.package, process.build_id, previous[0]
+            )
+            raise UpdateNotAllowedError(previous_process, process)
+
+        self.written(process)
 
-    def get_processes(
-        self, include_final: bool = False, machine: str | None = None
+    def get_processes(  # pylint: disable=too-many-arguments,too-many-locals
+        self,
+        include_final: bool = False,
+        machine: str | None = None,
+        *,
+        after: dt.datetime | Cursor | None = None,
+        limit: int | None = None,
+        newest_first: bool = False,
     ) -> Iterable[BuildProcess]:
         """Return the process records from the repository
 
         If include_final is True also include processes in their "final" phase. The
         default value is False.
+
+        Processes are returned in order of start_time or, if newest_first is True, in
+        reverse order. If after is given, only processes after it (in that order) are
+        returned. after is either a start time or the cursor() of the last process of
+        the previous page. If limit is given, at most that many processes are returned.
+        """
+        # Both hashes of each machine are read on the same client so that they agree
+        machines, hashes = self.from_replica(
+            lambda client: self.read_hashes(client, machine)
+        )
+        current_time = now()
+        entries: list[tuple[float, bytes, BuildProcess]] = []
+        expired: dict[str, list[tuple[str, str, str]]] = {}
+        outdated: list[tuple[bytes, bytes, bytes]] = []
+
+        for name, fields, packages in zip(machines, hashes[::2], hashes[1::2]):
+            ids = {
+                package_id(package): package
+                for package in (package.decode(ENCODING) for package in packages)
+            }
+            for field, value in fields.items():
+                pid, build_id = field.decode(ENCODING).split(":")
+
+                if (package := ids.get(pid)) is None:
+                    # Written after the packages hash was read
+                    continue
+
+                process, expires = self.hash_to_process(name, package, build_id, value)
+
+                if expires <= current_time:
+                    expired.setdefault(name, []).append((package, pid, build_id))
+                    continue
+
+                if value_version(value) < VALUE_VERSION:
+                    outdated.append((self.machine_hash(name), field, value))
+
+                position = (process.start_time.timestamp(), self.key(process))
+
+                if (include_final or not process.is_finished()) and is_after(
+                    position, after, newest_first
+                ):
+                    entries.append((*position, process))
+
+        if expired:
+            self.purge_hashes(expired, current_time)
+
+        if outdated:
+            self.migrate_hash_values(outdated)
+
+        if not after and (empty := [m for m, h in zip(machines, hashes[::2]) if not h]):
+            self.prune_machines(empty)
+
+        entries.sort(key=lambda entry: entry[:2], reverse=newest_first)
+        return [process for _, _, process in entries[:limit]]
+
+    def read_hashes(
+        self, client: "redis.Redis[bytes]", machine: str | None
+    ) -> tuple[list[str], list[dict[bytes, bytes]]]:
+        """Read the machines' hashes for get_processes() using the given client
+
+        Return the machines read and, for each, its process and packages hashes.
         """
-        processes = []
+        machines = [machine] if machine else self.machines(client)
+        hashes: list[dict[bytes, bytes]] = self.read(
+            "hgetall",
+            [
+                (key,)
+                for name in machines
+                for key in [self.machine_hash(name), self.packages_hash(name)]
+            ],
+            client,
+        )
+        return machines, hashes
 
-        for key_bytes in self._redis.keys(f"{self._key}:*".encode(ENCODING)):
-            if machine and Key.from_bytes(key_bytes).machine != machine:
-                continue
-            if value := self._redis.get(key_bytes):
-                process = self.redis_to_process(key_bytes, value)
+    def migrate_hash_values(self, items: list[tuple[bytes, bytes, bytes]]) -> None:
+        """Rewrite the given (hash, field, value)s in the current value format
 
-                if include_final or not process.is_finished():
-                    processes.append(process)
+        Values that have changed since they were read are left alone.
+        """
+        with self.script_pipeline() as pipe:
+            for machine_hash, field, value in items:
+                self._migrate_value(
+                    keys=[machine_hash],
+                    args=[field, value, self.migrated_value(value)],
+                    client=pipe,
+                )
+            if pipe is not None:
+                pipe.execute()
+
+    def purge_hashes(
+        self, expired: dict[str, list[tuple[str, str, str]]], current_time: float
+    ) -> None:
+        """Delete the given (package, package_id, build_id)s, found expired
 
-        processes.sort(key=lambda process: process.start_time)
-        return processes
+        The expiration is checked again on the primary (by the script) since it may
+        have been read from a replica.
+        """
+        with self.script_pipeline() as pipe:
+            for machine, processes in expired.items():
+                self._purge(
+                    keys=[self.machine_hash(machine), self.packages_hash(machine)],
+                    args=[int(current_time), *itertools.chain(*processes)],
+                    client=pipe,
+                )
+            if pipe is not None:
+                pipe.execute()
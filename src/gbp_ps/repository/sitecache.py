@@ -31,51 +31,162 @@
 # So this is implementing its own distributed locking and its own expiration. Not fun.
 # We'll see if it actually works. This is so much not the "simple port" from the redis
 # implementation that I thought it would be.
+#
+# Later the single "table" was split into a table per machine ("table:<machine>"), each
+# with its own lock ("lock:<machine>"), so that processes on different machines don't
+# contend with each other and a write only re-writes the one machine's table. The
+# "machines" key is the directory of machine tables. It is only written (under the
+# "lock" lock) when a machine is added or removed, so unlike the tables it has no
+# timeout. Machines whose tables have expired, or have no live processes, are removed
+# from it when the tables are purged.
+#
+# The machine tables can also be written without the lock (SITECACHE_WRITE_MODE="cas").
+# Each table is stored along with its version. A writer reads the table and version,
+# builds the new table and commits it as the next version. Django's cache API has no
+# compare-and-swap, so the commit is "claimed" by atomically adding the
+# "commit:<machine>:<version>" key: only one writer can claim a given version, the others
+# start over from the new table. Like the lock, the claim has a lease so that a writer
+# that dies before writing its table only holds up the others for so long.
+#
+# Rather than pickling a dict of BuildProcesses, the tables are stored in columns with
+# the machine, build host and phase strings interned, and msgpack'd when ormsgpack is
+# installed (see encode_table()).
 
 
 import datetime as dt
+import logging
+import random
+import threading
 import uuid
 from contextlib import contextmanager
-from dataclasses import replace
+from dataclasses import dataclass, field, replace
 from functools import cache as func_cache
-from functools import lru_cache
 from time import monotonic, sleep
-from typing import TYPE_CHECKING, Generator, Iterable, cast
+from typing import TYPE_CHECKING, Any, Callable, Generator, Iterable, cast
 
 from gbp_ps.exceptions import RecordAlreadyExists, RecordNotFoundError
 from gbp_ps.settings import Settings
 from gbp_ps.types import BuildProcess
 
+try:
+    import ormsgpack
+except ImportError:
+    ormsgpack = None  # type: ignore[assignment]
+
 if TYPE_CHECKING:
     from gentoo_build_publisher.cache import GBPSiteCache
 
 
 type ProcessTable = dict[str, BuildProcess]
+type Change = Callable[[ProcessTable], ProcessTable]
 now = dt.datetime.now
+logger = logging.getLogger(__name__)
+
+WRITE_MODES = ("lock", "cas")
+TABLE_FORMAT = 1
+
+# Bounds, in seconds, of the (jittered, exponential) backoff when waiting for the lock
+LOCK_BACKOFF_MIN = 0.001
+LOCK_BACKOFF_MAX = 0.05
+
+
+@dataclass
+class LockStats:
+    """How long the repository has waited for the table lock
+
+    In "cas" write mode, how long writers have waited to commit their tables. failures
+    are the waits that ended with the change raising an exception. wait_time and
+    max_wait are in seconds and include waits that timed out or failed.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    acquired: int = 0
+    contended: int = 0
+    timeouts: int = 0
+    failures: int = 0
+    wait_time: float = 0.0
+    max_wait: float = 0.0
+    # When (monotonic) the stats were last logged
+    logged: float | None = field(default=None, repr=False, compare=False)
+    _mutex: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def record(
+        self,
+        waited: float,
+        *,
+        contended: bool,
+        timed_out: bool = False,
+        failed: bool = False,
+    ) -> None:
+        """Record an attempt to acquire the lock"""
+        with self._mutex:
+            self.acquired += not (timed_out or failed)
+            self.contended += contended
+            self.timeouts += timed_out
+            self.failures += failed
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def log_due(self, current: float, interval: float) -> bool:
+        """Return True if the stats were last logged at least interval seconds ago
+
+        If so, current is taken as the time they are logged. The first interval starts
+        the first time this is called.
+        """
+        with self._mutex:
+            if self.logged is None:
+                self.logged = current
+
+            if current - self.logged < interval:
+                return False
+
+            self.logged = current
+
+            return True
 
 
 class SiteCacheRepository:
     """GBP site cache backend for the process table"""
 
+    # pylint: disable=too-many-public-methods
+
     def __init__(self, settings: Settings) -> None:
         self.settings = settings
         self.expiration = dt.timedelta(seconds=settings.SITECACHE_PROCESS_EXPIRATION)
+        self.lock_lease = settings.SITECACHE_LOCK_LEASE
+        self.lock_wait = settings.SITECACHE_LOCK_WAIT / 1000
+        self.lock_stats = LockStats()
+        self.lock_stats_interval = settings.SITECACHE_LOCK_STATS_INTERVAL
+        self.write_mode = settings.SITECACHE_WRITE_MODE.lower()
+
+        if self.write_mode not in WRITE_MODES:
+            raise ValueError(f"Invalid write mode: {self.write_mode!r}")
 
-        self.cache.set("table", self.cache.get("table", {}))
+        # Convert the table from before it was split by machine
+        if (table := self.cache.get("table")) is not None:
+            with self.lock():
+                self.set_table({**self.get_table(), **table})
+                self.cache.delete("table")
 
     def add_process(self, process: BuildProcess) -> None:
         """Add the given BuildProcess to the repository
 
         If the process already exists in the repo, RecordAlreadyExists is raised
         """
-        self.delete_existing_processes(process)
         key = get_key(process)
 
-        if key in self.get_table():
-            raise RecordAlreadyExists(process)
+        def change(table: ProcessTable) -> ProcessTable:
+            table = other_builds_removed(table, process)
 
-        with self.lock():
-            self.set_table({**self.get_table(), **{key: process}})
+            if key in table:
+                raise RecordAlreadyExists(process)
+
+            return {**table, key: process}
+
+        self.modify(process.machine, change)
 
     def update_process(self, process: BuildProcess) -> None:
         """Update the given build process
@@ -86,14 +197,16 @@ class SiteCacheRepository:
         """
         key = get_key(process)
 
-        if (existing := self.get_table().get(key, None)) is None:
-            raise RecordNotFoundError(process)
+        def change(table: ProcessTable) -> ProcessTable:
+            if (existing := table.get(key, None)) is None:
+                raise RecordNotFoundError(process)
 
-        existing.ensure_updateable(process)
-        new = replace(existing, phase=process.phase, build_host=process.build_host)
+            existing.ensure_updateable(process)
+            new = replace(existing, phase=process.phase, build_host=process.build_host)
 
-        with self.lock():
-            self.set_table({**self.get_table(), **{key: new}})
+            return {**table, key: new}
+
+        self.modify(process.machine, change)
 
     def get_processes(
         self, include_final: bool = False, machine: str | None = None
@@ -105,9 +218,8 @@ class SiteCacheRepository:
         """
         return [
             process
-            for process in self.ps()
-            if (not machine or process.machine == machine)
-            and (include_final or not process.is_finished())
+            for process in self.ps([machine] if machine else None)
+            if include_final or not process.is_finished()
         ]
 
     def delete_existing_processes(self, process: BuildProcess) -> None:
@@ -116,85 +228,310 @@ class SiteCacheRepository:
         By "existing" we mean processes in cache that have the same machine and package
         but different build_id.
         """
-        with self.lock():
-            self.set_table(
-                {
-                    key: existing
-                    for key, existing in self.get_table().items()
-                    if not same_proc_different_build(existing, process)
-                }
-            )
+        self.modify(process.machine, lambda table: other_builds_removed(table, process))
+
+    def ps(self, machines: Iterable[str] | None = None) -> Iterable[BuildProcess]:
+        """Return a list of all processes
+
+        If machines is given, only the processes of those machines.
+        """
+        machines = [*(self.machines() if machines is None else machines)]
+        shards = self.get_shards(machines)
 
-    def ps(self) -> Iterable[BuildProcess]:
-        """Return a list of all processes"""
         if self.cache.contains("purged"):
-            yield from self.get_table().values()
+            for shard in shards.values():
+                yield from shard.values()
             return
 
-        expired: set[str] = set()
+        # Purge before yielding anything so no lock is held while the caller has control
+        processes: list[BuildProcess] = []
+        empty: list[str] = []
 
-        with self.lock():
-            for key, process in self.get_table().items():
-                if (now(dt.UTC) - process.start_time) < self.expiration:
-                    yield process
-                else:
-                    expired.add(key)
+        for machine in machines:
+            live = self.purge(machine, shards.get(machine, {}))
+            processes.extend(live)
 
-            self.cache.set("purged", monotonic())
+            if not live:
+                empty.append(machine)
 
-            if not expired:
-                return
+        if empty:
+            self.prune_machines(empty)
+        self.cache.set("purged", monotonic())
+
+        yield from processes
+
+    def purge(self, machine: str, table: ProcessTable) -> list[BuildProcess]:
+        """Remove the machine's expired processes and return its live ones
 
-            # purge out expired keys
-            self.set_table(
-                {
+        table is the machine's table as already read. Only if it has expired processes
+        is the table modify()'d.
+        """
+        live = [process for process in table.values() if self.is_live(process)]
+
+        if len(live) < len(table):
+            self.modify(
+                machine,
+                lambda table: {
                     key: process
-                    for key, process in self.get_table().items()
-                    if key not in expired
-                }
+                    for key, process in table.items()
+                    if self.is_live(process)
+                },
             )
 
+        return live
+
+    def prune_machines(self, machines: list[str]) -> None:
+        """Remove the given machines, found to have no live processes, from the directory
+
+        This is done holding the directory lock. But write_shard() only takes the lock
+        when its machine is missing from the directory, so a writer may write its table
+        and find its machine still listed just before the directory is rewritten. The
+        tables are therefore checked again after the directory is rewritten, and
+        machines which have since been written are put back.
+        """
+        with self.lock():
+            empty = self.empty_machines(machines)
+
+            if not empty & (directory := self.machines()):
+                return
+
+            self.set_machines(directory - empty)
+
+            if written := empty - self.empty_machines([*empty]):
+                self.set_machines(self.machines() | written)
+
+    def empty_machines(self, machines: list[str]) -> set[str]:
+        """Return the given machines whose tables have no live processes"""
+        shards = self.get_shards(machines)
+
+        return {
+            machine
+            for machine in machines
+            if not any(map(self.is_live, shards.get(machine, {}).values()))
+        }
+
+    def is_live(self, process: BuildProcess) -> bool:
+        """Return True if the given process has not expired"""
+        return (now(dt.UTC) - process.start_time) < self.expiration
+
+    def modify(self, machine: str, change: Change) -> None:
+        """Replace the given machine's process table with change(table)
+
+        In "lock" write mode this is done holding the machine's lock. In "cas" write mode
+        the change is (re)applied until it can be committed on top of the version of the
+        table it was applied to. Exceptions raised by change are passed on and nothing
+        is written.
+
+        As in "lock" mode, where change is applied once the lock is acquired, an
+        exception raised by change is not a failure to commit: the wait for the claim
+        ends there and is recorded as such.
+        """
+        if self.write_mode == "lock":
+            with self.lock(machine):
+                version, table = self.read_shard(machine)
+                self.write_shard(machine, version + 1, change(table))
+            return
+
+        version, table = self.read_shard(machine)
+        new = change(table)
+        error: Exception | None = None
+
+        def commit() -> bool:
+            nonlocal version, new, error
+
+            if self._claim(machine, version + 1):
+                return True
+
+            # Another writer committed first. Apply the change to its table instead
+            version, table = self.read_shard(machine)
+            try:
+                new = change(table)
+            except Exception as change_error:  # pylint: disable=broad-exception-caught
+                error = change_error
+                return True
+
+            return False
+
+        self.wait_for(commit, self.lock_wait)
+
+        if error is not None:
+            raise error
+
+        self.write_shard(machine, version + 1, new)
+
+    def machines(self) -> set[str]:
+        """Return the set of machines that have process tables"""
+        return cast(set[str], self.cache.get("machines", set()))
+
+    def set_machines(self, machines: set[str]) -> None:
+        """Write the directory of machines that have process tables
+
+        The directory is written without a timeout as it is only rewritten when a
+        machine is added or removed. The caller should hold the directory lock.
+        """
+        # pylint: disable=import-outside-toplevel
+        from django.core.cache import cache as django_cache
+
+        django_cache.set(self.cache_key("machines"), machines, timeout=None)
+
+    def get_shard(self, machine: str) -> ProcessTable:
+        """Return the given machine's process table from cache"""
+        return self.read_shard(machine)[1]
+
+    def read_shard(self, machine: str) -> tuple[int, ProcessTable]:
+        """Return the given machine's process table, and its version, from cache"""
+        if (shard := self.cache.get(shard_key(machine))) is None:
+            return 0, {}
+
+        version, value = shard
+
+        return version, decode_table(value)
+
+    def get_shards(self, machines: Iterable[str]) -> dict[str, ProcessTable]:
+        """Return the process tables of the given machines
+
+        The tables are fetched from the cache in one go.
+        """
+        # pylint: disable=import-outside-toplevel
+        from django.core.cache import cache as django_cache
+
+        keys = {self.cache_key(shard_key(machine)): machine for machine in machines}
+        shards = django_cache.get_many(keys)
+
+        return {keys[key]: decode_table(value) for key, (_, value) in shards.items()}
+
+    def write_shard(self, machine: str, version: int, table: ProcessTable) -> None:
+        """Write the given version of the machine's process table to the cache
+
+        The caller should hold the machine's lock or have claimed the version.
+        """
+        self.cache.set(shard_key(machine), (version, encode_table(table)))
+
+        if machine not in self.machines():
+            with self.lock():
+                self.set_machines(self.machines() | {machine})
+
     def get_table(self) -> ProcessTable:
-        """Return the process table from cache"""
-        return cast(ProcessTable, self.cache.get("table"))
+        """Return the (entire) process table from cache"""
+        table: ProcessTable = {}
+
+        for shard in self.get_shards(self.machines()).values():
+            table.update(shard)
+
+        return table
 
     def set_table(self, table: ProcessTable) -> None:
-        """Set the given process table in the cache"""
-        self.cache.set("table", table)
+        """Set the given (entire) process table in the cache"""
+        shards: dict[str, ProcessTable] = {machine: {} for machine in self.machines()}
+
+        for key, process in table.items():
+            shards.setdefault(process.machine, {})[key] = process
+
+        for machine, shard in shards.items():
+            version = self.read_shard(machine)[0]
+            self.cache.set(shard_key(machine), (version + 1, encode_table(shard)))
+
+        self.set_machines({machine for machine in shards if shards[machine]})
 
     @contextmanager
-    def lock(self, timeout: float = 10.0) -> Generator[str, None, None]:
-        """Use the cache create a lock
+    def lock(
+        self, name: str | None = None, timeout: float | None = None
+    ) -> Generator[str, None, None]:
+        """Use the cache to create a lock
+
+        name is the machine whose table to lock. Without a name, lock the "machines"
+        directory. The lock is acquired by atomically adding the lock's key, so only
+        one holder can succeed. The key has a lease of settings.SITECACHE_LOCK_LEASE
+        seconds so that the lock expires should its holder die. While someone else holds
+        it, wait for up to timeout seconds (by default settings.SITECACHE_LOCK_WAIT
+        milliseconds) and then raise TimeoutError.
+        """
+        timeout = self.lock_wait if timeout is None else timeout
+        key = str(uuid.uuid4())
 
-        The lock automatically times out after settings.SITECACHE_PROCESS_EXPIRATION
+        self.wait_for(lambda: self._set_lock(key, name), timeout)
+
+        try:
+            yield key
+        finally:
+            # If our lease ran out the lock may now be someone else's
+            if self.cache.get(lock_key(name)) == key:
+                self.cache.delete(lock_key(name))
+
+    def wait_for(self, attempt: Callable[[], bool], timeout: float) -> None:
+        """Call attempt() until it returns True
+
+        Between attempts back off (jittered, exponentially). If it has not succeeded
+        after timeout seconds, raise TimeoutError. The wait, including one that ends
+        with attempt() failing to acquire the lock (raising), is recorded in lock_stats.
         """
         start = monotonic()
-        key = str(uuid.uuid4())
-        cache = self.cache
+        waited = 0.0
+        backoff = LOCK_BACKOFF_MIN
+        contended = timed_out = succeeded = False
+
+        try:
+            while not attempt():
+                contended = True
+
+                if (waited := monotonic() - start) >= timeout:
+                    timed_out = True
+                    raise TimeoutError()
+
+                sleep(min(random.uniform(0, backoff), timeout - waited))
+                backoff = min(backoff * 2, LOCK_BACKOFF_MAX)
+
+            succeeded = True
+        finally:
+            current = monotonic()
+            self.lock_stats.record(
+                current - start,
+                contended=contended,
+                timed_out=timed_out,
+                failed=not (succeeded or timed_out),
+            )
+            self.log_lock_stats(current)
 
-        while True:
-            if monotonic() - start >= timeout:
-                raise TimeoutError()
+    def log_lock_stats(self, current: float) -> None:
+        """Log the lock_stats if settings.SITECACHE_LOCK_STATS_INTERVAL has passed
 
-            if cache.contains("lock"):
-                sleep(0.1)
-                continue
+        current is the current (monotonic) time.
+        """
+        interval = self.lock_stats_interval
 
-            self._set_lock(key)
+        if interval and self.lock_stats.log_due(current, interval):
+            logger.info("Site cache lock stats: %s", self.lock_stats)
 
-            if cache.get("lock", None) == key:
-                break
+    def _set_lock(self, key: str, name: str | None = None) -> bool:
+        """Set the named lock with the given key, if it is not already set
 
-        yield key
+        Return True if it was set. A separate method so that it can be patched for
+        testing.
+        """
+        # GBPSiteCache has no add() so use the underlying Django cache
+        # pylint: disable=import-outside-toplevel
+        from django.core.cache import cache as django_cache
 
-        cache.delete("lock")
+        return django_cache.add(
+            self.cache_key(lock_key(name)), key, timeout=self.lock_lease
+        )
 
-    def _set_lock(self, key: str) -> None:
-        """Sets the lock with the given key
+    def _claim(self, machine: str, version: int) -> bool:
+        """Claim the given version of the machine's process table
 
-        A separate method so that it can be patched for testing.
+        Return True if no other writer has claimed it. A separate method so that it can
+        be patched for testing.
         """
-        self.cache.set("lock", key)
+        # pylint: disable=import-outside-toplevel
+        from django.core.cache import cache as django_cache
+
+        return django_cache.add(
+            self.cache_key(commit_key(machine, version)), True, timeout=self.lock_lease
+        )
+
+    def cache_key(self, key: str) -> str:
+        """Return the underlying Django cache key of the given gbp-ps cache key"""
+        return self.cache._get_key(key)  # pylint: disable=protected-access
 
     @property
     @func_cache  # pylint: disable=method-cache-max-size-none
@@ -210,12 +547,84 @@ class SiteCacheRepository:
         return cache
 
 
-@lru_cache
+def shard_key(machine: str) -> str:
+    """Return the cache key of the given machine's process table"""
+    return f"table:{machine}"
+
+
+def commit_key(machine: str, version: int) -> str:
+    """Return the cache key claiming the given version of the machine's table"""
+    return f"commit:{machine}:{version}"
+
+
+def lock_key(name: str | None) -> str:
+    """Return the cache key of the lock of the given name
+
+    The lock with no name is the directory ("machines") lock.
+    """
+    return f"lock:{name}" if name else "lock"
+
+
+def encode_table(table: ProcessTable) -> bytes | list[Any]:
+    """Return the given process table encoded for the cache
+
+    The table is encoded as columns: [TABLE_FORMAT, strings, machines, build_ids,
+    build_hosts, packages, phases, start_times]. The machines, build_hosts and phases
+    are indexes into strings. start_times are epoch timestamps. If ormsgpack is
+    available the columns are packed, otherwise they are left to the cache to pickle.
+    """
+    strings: dict[str, int] = {}
+    processes = table.values()
+    columns = [
+        [strings.setdefault(process.machine, len(strings)) for process in processes],
+        [process.build_id for process in processes],
+        [strings.setdefault(process.build_host, len(strings)) for process in processes],
+        [process.package for process in processes],
+        [strings.setdefault(process.phase, len(strings)) for process in processes],
+        [process.start_time.timestamp() for process in processes],
+    ]
+    value = [TABLE_FORMAT, list(strings), *columns]
+
+    return value if ormsgpack is None else ormsgpack.packb(value)
+
+
+def decode_table(value: bytes | list[Any]) -> ProcessTable:
+    """Return the process table from the given encode_table() value"""
+    data: list[Any] = (
+        ormsgpack.unpackb(value)  # pylint: disable=no-member
+        if isinstance(value, bytes)
+        else value
+    )
+    _, strings, *columns = data
+    processes = (
+        BuildProcess(
+            machine=strings[machine],
+            build_id=build_id,
+            build_host=strings[build_host],
+            package=package,
+            phase=strings[phase],
+            start_time=dt.datetime.fromtimestamp(start_time, tz=dt.UTC),
+        )
+        for machine, build_id, build_host, package, phase, start_time in zip(*columns)
+    )
+
+    return {get_key(process): process for process in processes}
+
+
 def get_key(process: BuildProcess) -> str:
     """Return process table key for the given process"""
     return f"{process.machine}:{process.build_id}:{process.package}"
 
 
+def other_builds_removed(table: ProcessTable, process: BuildProcess) -> ProcessTable:
+    """Return the table without the processes like process from other builds"""
+    return {
+        key: existing
+        for key, existing in table.items()
+        if not same_proc_different_build(existing, process)
+    }
+
+
 def same_proc_different_build(proc1: BuildProcess, proc2: BuildProcess) -> bool:
     """Return True if the two procs are the same except on different builds"""
     return (
@@ -1,25 +1,152 @@
 """Sqlite RepositoryType"""
 
 import datetime as dt
+import os
 import sqlite3
+import threading
+import uuid
 from contextlib import contextmanager
+from dataclasses import replace
 from typing import Generator, Iterable
 
-from gbp_ps.exceptions import RecordAlreadyExists, RecordNotFoundError
+from gbp_ps.exceptions import (
+    RecordAlreadyExists,
+    RecordNotFoundError,
+    UpdateNotAllowedError,
+)
 from gbp_ps.settings import Settings
 from gbp_ps.types import BuildProcess
 
+SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+type ProcessKey = tuple[str, str, str]
+MEMORY = ":memory:"
+
+# The final phases as an SQL list of literals. Queries must use literals (rather than
+# parameters) for SQLite to use the partial index over non-final processes
+FINAL_PHASES_SQL = ", ".join(
+    f"'{phase}'" for phase in sorted(BuildProcess.final_phases)
+)
+
+# Statements to upgrade the database schema. SCHEMA_UPGRADES[n] upgrades the schema
+# from version n to n + 1. The (version 0) database may be new or from before schema
+# versioning so the statements must be idempotent. The schema version is kept in the
+# database's user_version
+SCHEMA_UPGRADES: list[tuple[str, ...]] = [
+    (
+        """
+CREATE TABLE IF NOT EXISTS ebuild_process (
+    machine VARCHAR(255),
+    build_id VARCHAR(255),
+    build_host VARCHAR(255),
+    package VARCHAR(255),
+    phase VARCHAR(255),
+    start_time INTEGER
+)
+""",
+        # Unique, and used to look up a process by (machine, build_id, package)
+        """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_process
+ON ebuild_process (machine, build_id, package, build_host)
+""",
+        # Used to find processes of other builds of a package
+        """
+CREATE INDEX IF NOT EXISTS idx_machine_package_phase
+ON ebuild_process (machine, package, phase)
+""",
+        """
+CREATE INDEX IF NOT EXISTS idx_machine_start_time
+ON ebuild_process (machine, start_time)
+""",
+        """
+CREATE INDEX IF NOT EXISTS idx_start_time
+ON ebuild_process (start_time)
+""",
+        f"""
+CREATE INDEX IF NOT EXISTS idx_live_start_time
+ON ebuild_process (start_time)
+WHERE phase NOT IN ({FINAL_PHASES_SQL})
+""",
+        # Superseded by the above
+        "DROP INDEX IF EXISTS idx_unique_process",
+        "DROP INDEX IF EXISTS idx_machine",
+        "DROP INDEX IF EXISTS idx_phase",
+    ),
+    # When maintenance (see SqliteRepository.maintain()) was last run. It starts out as
+    # when the table was created so that the first maintenance is an interval later
+    (
+        """
+CREATE TABLE IF NOT EXISTS maintenance (
+    name VARCHAR(255) PRIMARY KEY,
+    last_run INTEGER
+)
+""",
+        """
+INSERT OR IGNORE INTO maintenance (name, last_run)
+VALUES ('maintain', CAST(strftime('%s', 'now') AS INTEGER))
+""",
+    ),
+]
+SCHEMA_VERSION = len(SCHEMA_UPGRADES)
+
+
+def memory_database_uri(name: str) -> str:
+    """Return the URI of the named in-memory database
+
+    Connections to the URI (in the same process) share the database, which exists as
+    long as any of them are open. The "memdb" VFS (SQLite 3.36+) is used if available
+    since, unlike shared-cache mode, it uses the normal database locking.
+    """
+    if sqlite3.sqlite_version_info >= (3, 36):
+        return f"file:/{name}?vfs=memdb"
+
+    return f"file:{name}?mode=memory&cache=shared"
+
+
+def process_key(process: BuildProcess) -> ProcessKey:
+    """Return the (machine, package, build_id) of the process
+
+    This is what identifies a process in the table.
+    """
+    return (process.machine, process.package, process.build_id)
+
+
+def is_memory_database(uri: str) -> bool:
+    """Return True if the given database URI is of an in-memory database"""
+    return "vfs=memdb" in uri or "mode=memory" in uri
+
 
 class SqliteRepository:
     """Sqlite Based Repository"""
 
-    final_phases_t = tuple(BuildProcess.final_phases)
-    filter_phases = f"phase NOT IN ({','.join(['?' for _ in final_phases_t])})"
+    # pylint: disable=too-many-instance-attributes
+
+    filter_phases = f"phase NOT IN ({FINAL_PHASES_SQL})"
     row_names = "machine, build_id, build_host, package, phase, start_time"
 
     def __init__(self, settings: Settings) -> None:
-        database: bytes | str = settings.SQLITE_DATABASE
+        database = settings.SQLITE_DATABASE
+
+        # ":memory:" would give each connection its own, empty, database. Instead use a
+        # private in-memory database that all of the repository's connections share
+        if database == MEMORY:
+            database = memory_database_uri(f"gbp-ps-{uuid.uuid4().hex}")
+
         self._database = database
+        self._uri = database.startswith("file:")
+        self.busy_timeout = settings.SQLITE_BUSY_TIMEOUT
+        self.synchronous = settings.SQLITE_SYNCHRONOUS.upper()
+        self.retention = settings.SQLITE_RETENTION
+        self.maintenance_interval = settings.SQLITE_MAINTENANCE_INTERVAL
+        self._local = threading.local()
+
+        if self.synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Invalid synchronous mode: {self.synchronous!r}")
+
+        # An in-memory database only exists while a connection to it is open. Hold one
+        # so that it lives as long as the repository
+        self._keepalive = (
+            self.connect() if self._uri and is_memory_database(database) else None
+        )
         self.init_db()
 
     def add_process(self, process: BuildProcess) -> None:
@@ -40,18 +167,23 @@ class SqliteRepository:
               AND phase in ({placeholders})
         """
         params = (process.build_id, process.machine, process.package, *build_phases)
-        with self.cursor() as cursor:
-            cursor.execute(sql, params)
-
-        sql = f"""
+        insert = f"""
             INSERT INTO ebuild_process ({self.row_names})
             VALUES (?,?,?,?,?,?)
         """
-        with self.cursor() as cursor:
+        with self.transaction() as cursor:
+            cursor.execute(sql, params)
             try:
-                cursor.execute(sql, self.process_to_row(process))
+                cursor.execute(insert, self.process_to_row(process))
             except sqlite3.IntegrityError:
-                raise RecordAlreadyExists(process) from None
+                exists = True
+            else:
+                exists = False
+
+        if exists:
+            raise RecordAlreadyExists(process)
+
+        self.maintain()
 
     def update_process(self, process: BuildProcess) -> None:
         """Update the given build process
@@ -65,23 +197,113 @@ class SqliteRepository:
             FROM ebuild_process
             WHERE machine = ? AND build_id = ? AND package = ?
         """
-        with self.cursor() as cursor:
-            result = cursor.execute(
-                sql, (process.machine, process.build_id, process.package)
-            )
-            row = result.fetchone()
-        if not row:
-            raise RecordNotFoundError(process) from None
-        previous = self.row_to_process(*row)
-        previous.ensure_updateable(process)
-        sql = """
+        update = """
             UPDATE ebuild_process
             SET phase = ?
             WHERE machine = ? AND build_id = ? AND package = ?
         """
         p = process
-        with self.cursor() as cursor:
-            cursor.execute(sql, (p.phase, p.machine, p.build_id, p.package))
+        with self.transaction() as cursor:
+            result = cursor.execute(sql, (p.machine, p.build_id, p.package))
+            row = result.fetchone()
+            if not row:
+                raise RecordNotFoundError(process) from None
+            previous = self.row_to_process(*row)
+            previous.ensure_updateable(process)
+            cursor.execute(update, (p.phase, p.machine, p.build_id, p.package))
+
+    def add_or_update_processes(self, processes: Iterable[BuildProcess]) -> None:
+        """Add or update each of the given processes, in order
+
+        This is the bulk equivalent of calling add_or_update_process() for each process
+        (and, likewise, updates that are not allowed are ignored) but it is done in a
+        single transaction. The processes are applied, in order, to a copy of the
+        affected rows and the net changes are then written using executemany().
+        """
+        processes = list(processes)
+        select = f"""
+            SELECT {self.row_names}
+            FROM ebuild_process
+            WHERE machine = ? AND package = ?
+        """
+        with self.transaction() as cursor:
+            # The affected rows: (machine, package) -> build_id -> process
+            original: dict[tuple[str, str], dict[str, BuildProcess]] = {}
+            for machine, package in {(p.machine, p.package) for p in processes}:
+                original[machine, package] = {
+                    row[1]: self.row_to_process(*row)
+                    for row in cursor.execute(select, (machine, package))
+                }
+            rows = {pair: dict(builds) for pair, builds in original.items()}
+
+            for process in processes:
+                builds = rows[process.machine, process.package]
+
+                if previous := builds.get(process.build_id):
+                    try:
+                        previous.ensure_updateable(process)
+                    except UpdateNotAllowedError:
+                        continue
+                    builds[process.build_id] = replace(previous, phase=process.phase)
+                    continue
+
+                # Remove the package's processes from other builds, as add_process does
+                for build_id, other in list(builds.items()):
+                    if other.phase in BuildProcess.build_phases:
+                        del builds[build_id]
+                builds[process.build_id] = process
+
+            self.write_changes(
+                cursor,
+                [p for builds in original.values() for p in builds.values()],
+                [p for builds in rows.values() for p in builds.values()],
+            )
+
+        self.maintain()
+
+    def write_changes(
+        self,
+        cursor: sqlite3.Cursor,
+        original: list[BuildProcess],
+        processes: list[BuildProcess],
+    ) -> None:
+        """Write the changes needed to turn the original rows into the given processes"""
+        new = {process_key(p): p for p in processes}
+        original_keys = {process_key(p) for p in original}
+        deletes: list[ProcessKey] = []
+        updates: list[tuple[str, str, str, str]] = []
+        inserts = [
+            self.process_to_row(p)
+            for p in processes
+            if process_key(p) not in original_keys
+        ]
+
+        for process in original:
+            key = process_key(process)
+            current = new.get(key)
+
+            # The process was deleted, or deleted and then added again
+            if current is None or replace(current, phase=process.phase) != process:
+                deletes.append(key)
+                if current:
+                    inserts.append(self.process_to_row(current))
+            elif current.phase != process.phase:
+                updates.append((current.phase, *key))
+
+        cursor.executemany(
+            "DELETE FROM ebuild_process"
+            " WHERE machine = ? AND package = ? AND build_id = ?",
+            deletes,
+        )
+        cursor.executemany(
+            "UPDATE ebuild_process SET phase = ?"
+            " WHERE machine = ? AND package = ? AND build_id = ?",
+            updates,
+        )
+        cursor.executemany(
+            f"INSERT INTO ebuild_process ({self.row_names}) VALUES (?,?,?,?,?,?)",
+            inserts,
+        )
 
     def get_processes(
         self, include_final: bool = False, machine: str | None = None
@@ -96,7 +318,6 @@ class SqliteRepository:
 
         if not include_final:
             wheres.append(self.filter_phases)
-            params = params + self.final_phases_t
 
         if machine:
             wheres.append("machine=?")
@@ -116,6 +337,82 @@ class SqliteRepository:
             for row in result:
                 yield self.row_to_process(*row)
 
+    def prune(self, retention: int) -> int:
+        """Delete processes that started more than retention seconds ago
+
+        This includes processes in any phase: finished ones as well as those left
+        behind by, say, a crashed emerge. Return the number of processes deleted.
+        """
+        with self.transaction() as cursor:
+            return self.delete_older_than(cursor, retention)
+
+    def vacuum(self, full: bool = False) -> None:
+        """Release the database's free pages to the filesystem
+
+        By default this is an incremental vacuum, which is quick but only does anything
+        for databases created with auto_vacuum=INCREMENTAL (see connect()). A full
+        VACUUM rebuilds the database, converting older databases as it does, but needs
+        exclusive access and room for a copy of the database.
+        """
+        with self.cursor() as cursor:
+            # incremental_vacuum frees a page per step so the result must be consumed
+            cursor.execute("VACUUM" if full else "PRAGMA incremental_vacuum").fetchall()
+
+    def maintain(self) -> int:
+        """Prune and vacuum the database if it is due
+
+        It is due if no repository (in any process) has done so in the last
+        maintenance_interval seconds. Return the number of processes pruned.
+        """
+        if not self.maintenance_interval:
+            return 0
+
+        now = int(dt.datetime.now(tz=dt.UTC).timestamp())
+
+        with self.cursor() as cursor:
+            if not self.maintenance_due(cursor, now):
+                return 0
+
+        with self.transaction() as cursor:
+            # Another process may have beaten us to it
+            if not self.maintenance_due(cursor, now):
+                return 0
+
+            cursor.execute(
+                "INSERT OR REPLACE INTO maintenance (name, last_run) VALUES (?, ?)",
+                ("maintain", now),
+            )
+            pruned = self.delete_older_than(cursor, self.retention, now)
+            cursor.execute("PRAGMA incremental_vacuum").fetchall()
+
+        return pruned
+
+    def maintenance_due(self, cursor: sqlite3.Cursor, now: int) -> bool:
+        """Return True if maintenance has not been done in the maintenance interval"""
+        cursor.execute("SELECT last_run FROM maintenance WHERE name = 'maintain'")
+        row = cursor.fetchone()
+
+        return row is None or now - row[0] >= self.maintenance_interval
+
+    @staticmethod
+    def delete_older_than(
+        cursor: sqlite3.Cursor, retention: int, now: int | None = None
+    ) -> int:
+        """Delete processes that started more than retention seconds before now
+
+        A retention of 0 deletes nothing. Return the number of processes deleted.
+        """
+        if not retention:
+            return 0
+
+        if now is None:
+            now = int(dt.datetime.now(tz=dt.UTC).timestamp())
+
+        cursor.execute(
+            "DELETE FROM ebuild_process WHERE start_time < ?", (now - retention,)
+        )
+        return cursor.rowcount
+
     @staticmethod
     def row_to_process(  # pylint: disable=too-many-arguments,too-many-positional-arguments
         machine: str,
@@ -143,41 +440,110 @@ class SqliteRepository:
         return (p.machine, p.build_id, p.build_host, p.package, p.phase, start_time)
 
     def init_db(self) -> None:
-        """Initialize the database"""
-        create_table = """
-CREATE TABLE IF NOT EXISTS ebuild_process (
-    machine VARCHAR(255),
-    build_id VARCHAR(255),
-    build_host VARCHAR(255),
-    package VARCHAR(255),
-    phase VARCHAR(255),
-    start_time INTEGER
-);
-"""
-        create_machine_idx = """
-CREATE INDEX IF NOT EXISTS idx_machine
-ON ebuild_process (machine)
-"""
-        create_phase_idx = """
-CREATE INDEX IF NOT EXISTS idx_phase
-ON ebuild_process (phase)
-"""
-        create_unique_idx = """
-CREATE UNIQUE INDEX IF NOT EXISTS idx_unique_process
-ON ebuild_process (machine, build_id, build_host, package)
-"""
+        """Initialize the database
+
+        Create the schema or, if it is from an earlier version, upgrade it.
+        """
+        with self.cursor() as cursor:
+            if self.schema_version(cursor) == SCHEMA_VERSION:
+                return
+
+        with self.transaction() as cursor:
+            # Another process may have upgraded it in the meantime
+            version = self.schema_version(cursor)
+
+            for statements in SCHEMA_UPGRADES[version:]:
+                for statement in statements:
+                    cursor.execute(statement)
+
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @staticmethod
+    def schema_version(cursor: sqlite3.Cursor) -> int:
+        """Return the database's schema version"""
+        version: int = cursor.execute("PRAGMA user_version").fetchone()[0]
+
+        return version
+
+    def data_version(self) -> int:
+        """Return the db's data version as seen by this thread's connection
+
+        The value changes whenever another connection commits a change to the database,
+        so it is a cheap way to tell whether re-querying is worthwhile.
+        """
         with self.cursor() as cursor:
-            cursor.execute(create_table)
-            cursor.execute(create_machine_idx)
-            cursor.execute(create_phase_idx)
-            cursor.execute(create_unique_idx)
+            version: int = cursor.execute("PRAGMA data_version").fetchone()[0]
+
+        return version
+
+    def connection(self) -> sqlite3.Connection:
+        """Return this thread's connection to the db
+
+        Each thread (of each process) has its own connection which is opened the first
+        time it is needed and then reused.
+        """
+        local = self._local
+
+        if getattr(local, "pid", None) != os.getpid():
+            local.connection = self.connect()
+            local.pid = os.getpid()
+
+        connection: sqlite3.Connection = local.connection
+        return connection
+
+    def connect(self) -> sqlite3.Connection:
+        """Open and return a new connection to the db
+
+        The connection is in autocommit mode. Use transaction() to group statements.
+        The database is put in WAL mode so that readers don't block the writer (and
+        vice versa) and writers wait up to settings.SQLITE_BUSY_TIMEOUT milliseconds
+        for the database lock rather than failing with "database is locked".
+        """
+        connection = sqlite3.connect(
+            self._database,
+            timeout=self.busy_timeout / 1000,
+            isolation_level=None,
+            uri=self._uri,
+        )
+        connection.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        # Only takes effect for a new database, and must come before it is put in WAL
+        # mode. Existing databases are converted by a full vacuum()
+        connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute(f"PRAGMA synchronous = {self.synchronous}")
+
+        return connection
+
+    def close(self) -> None:
+        """Close this thread's connection to the db, if open"""
+        if connection := getattr(self._local, "connection", None):
+            connection.close()
+            del self._local.connection
+            del self._local.pid
 
     @contextmanager
     def cursor(self) -> Generator[sqlite3.Cursor, None, None]:
-        """Connect to the db and return a cursor object"""
-        with sqlite3.connect(self._database) as connection:
-            cursor = connection.cursor()
+        """Return a cursor object for this thread's connection"""
+        cursor = self.connection().cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def transaction(self) -> Generator[sqlite3.Cursor, None, None]:
+        """Return a cursor object in a write transaction
+
+        The transaction takes the write lock up front (BEGIN IMMEDIATE) so that it
+        cannot fail later trying to upgrade a read lock. It is committed when the
+        context exits, or rolled back if it exits with an exception.
+        """
+        with self.cursor() as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
             try:
                 yield cursor
-            finally:
-                cursor.close()
+            except BaseException:
+                if cursor.connection.in_transaction:
+                    cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
@@ -12,14 +12,66 @@ DEFAULT_REDIS_KEY_EXPIRATION = 3600 * 24
 class Settings(BaseSettings):
     """Settings for gbp-ps"""
 
-    # pylint: disable=invalid-name
+    # pylint: disable=invalid-name,too-many-instance-attributes
     env_prefix: ClassVar = "GBP_PS_"
 
+    # Number of rows the Django repository fetches from the database at a time
+    DJANGO_FETCH_CHUNK_SIZE: int = 500
+
     REDIS_KEY: str = "gbp-ps"
     REDIS_KEY_EXPIRATION: int = DEFAULT_REDIS_KEY_EXPIRATION
     SITECACHE_PROCESS_EXPIRATION: int = DEFAULT_REDIS_KEY_EXPIRATION
     REDIS_URL: str = "redis://redis.invalid:6379/0"
+    REDIS_FETCH_BATCH_SIZE: int = 500
+
+    # Number of entries in the (opt-in) RESP3 client-side cache. 0 disables the cache
+    REDIS_CLIENT_CACHE_SIZE: int = 0
+
+    # Connect to REDIS_URL as a Redis Cluster
+    REDIS_CLUSTER: bool = False
+
+    # Replica URL(s), separated by spaces or commas, to send reads to. If
+    # REDIS_READ_MAX_LAG (seconds) is non-zero, replicas which have not heard from the
+    # primary in that long are not read from
+    REDIS_READ_URL: str = ""
+    REDIS_READ_MAX_LAG: int = 0
+
+    # Pub/sub channel to publish process changes on. Empty disables publishing
+    REDIS_CHANNEL: str = ""
+
+    # Redis Stream to log process adds/updates to, capped at (about) REDIS_STREAM_MAXLEN
+    # entries. Empty disables the log
+    REDIS_STREAM: str = ""
+    REDIS_STREAM_MAXLEN: int = 10000
+
+    # Path of the sqlite database or a "file:" URI. ":memory:" is an in-memory database
+    # that lasts as long as the repository
     SQLITE_DATABASE: str = ":memory:"
+
+    # How long (milliseconds) to wait for a locked database and the synchronous mode
+    # (OFF, NORMAL, FULL or EXTRA) to use
+    SQLITE_BUSY_TIMEOUT: int = 5000
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+
+    # Processes that started more than SQLITE_RETENTION seconds ago are pruned from the
+    # sqlite database, and its free pages released, at most every
+    # SQLITE_MAINTENANCE_INTERVAL seconds. 0 disables either
+    SQLITE_RETENTION: int = DEFAULT_REDIS_KEY_EXPIRATION
+    SQLITE_MAINTENANCE_INTERVAL: int = 3600
+
+    # The site-cache table lock's lease, in seconds, after which the lock expires should
+    # its holder die, and how long, in milliseconds, to wait for the lock
+    SITECACHE_LOCK_LEASE: int = 30
+    SITECACHE_LOCK_WAIT: int = 10000
+
+    # How site-cache writers keep from overwriting each other's changes: "lock" the
+    # machine's table or "cas" (compare-and-swap) to write it only if it is unchanged
+    SITECACHE_WRITE_MODE: str = "lock"
+
+    # How often, in seconds, to log (at INFO level) how long site-cache writers have
+    # waited for the table locks. 0 disables
+    SITECACHE_LOCK_STATS_INTERVAL: int = 300
+
     STORAGE_BACKEND: str = "django"
 
     # time inverval for the web ui to update the process table, in milliseconds
@@ -2,14 +2,13 @@
 
 import datetime as dt
 import platform
-from functools import cache, partial
+from functools import partial
 from typing import Any, Protocol
 
 from gentoo_build_publisher.signals import dispatcher
 from gentoo_build_publisher.types import Build
 
-from gbp_ps.repository import Repo, RepositoryType, add_or_update_process
-from gbp_ps.settings import Settings
+from gbp_ps.repository import add_or_update_process, get_repo
 from gbp_ps.types import BuildProcess
 
 _now = partial(dt.datetime.now, tz=dt.UTC)
@@ -39,12 +38,6 @@ def build_process(
     )
 
 
-@cache
-def repo() -> RepositoryType:
-    """Return the Repository from from the environment variable settings"""
-    return Repo(Settings.from_environ())
-
-
 def handle(phase: str) -> Handler:
     """Return a event handler for the given phase"""
 
@@ -57,7 +50,7 @@ def handle(phase: str) -> Handler:
 
 def set_process(build: Build, phase: str) -> None:
     """Add or update the given Build process in the repo"""
-    add_or_update_process(repo(), build_process(build, _NODE, phase, _now()))
+    add_or_update_process(get_repo(), build_process(build, _NODE, phase, _now()))
 
 
 def init() -> None:
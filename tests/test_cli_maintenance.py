@@ -0,0 +1,59 @@
+"""CLI unit tests for gbp-ps ps-maintenance subcommand"""
+
+# pylint: disable=missing-docstring
+import datetime as dt
+import os
+from argparse import ArgumentParser
+
+import gbp_testkit.fixtures as testkit
+from unittest_fixtures import Fixtures, given
+
+from gbp_ps.cli import maintenance
+
+from . import lib
+
+
+@given(lib.tempdb, testkit.gbpcli, testkit.environ, repo=lib.repo_fixture)
+class MaintenanceTests(lib.TestCase):
+    def test(self, fixtures: Fixtures) -> None:
+        now = dt.datetime.now(tz=dt.UTC).replace(microsecond=0)
+        old = lib.BuildProcessFactory(start_time=now - dt.timedelta(days=2))
+        new = lib.BuildProcessFactory(start_time=now)
+        fixtures.repo.add_or_update_processes([old, new])
+
+        exit_status = fixtures.gbpcli(f"gbp ps-maintenance -l {fixtures.tempdb}")
+
+        self.assertEqual(exit_status, 0)
+        self.assertEqual(
+            fixtures.console.stdout,
+            f"$ gbp ps-maintenance -l {fixtures.tempdb}\nPruned 1 process\n",
+        )
+        self.assertEqual([*fixtures.repo.get_processes(include_final=True)], [new])
+
+    def test_retention_from_environment(self, fixtures: Fixtures) -> None:
+        os.environ["GBP_PS_SQLITE_RETENTION"] = "0"
+        start_time = dt.datetime(2023, 11, 11, tzinfo=dt.UTC)
+        fixtures.repo.add_process(lib.BuildProcessFactory(start_time=start_time))
+
+        fixtures.gbpcli(f"gbp ps-maintenance -l {fixtures.tempdb}")
+
+        self.assertTrue(fixtures.console.stdout.endswith("Pruned 0 processes\n"))
+
+    def test_retention_argument(self, fixtures: Fixtures) -> None:
+        now = dt.datetime.now(tz=dt.UTC).replace(microsecond=0)
+        for minutes in [1, 10, 100]:
+            fixtures.repo.add_process(
+                lib.BuildProcessFactory(start_time=now - dt.timedelta(minutes=minutes))
+            )
+
+        fixtures.gbpcli(f"gbp ps-maintenance -l {fixtures.tempdb} -r 1200 --full")
+
+        self.assertTrue(fixtures.console.stdout.endswith("Pruned 1 process\n"))
+        self.assertEqual(len([*fixtures.repo.get_processes(include_final=True)]), 2)
+
+
+class MaintenanceParseArgsTests(lib.TestCase):
+    def test(self) -> None:
+        # Just ensure that parse_args is there and works
+        parser = ArgumentParser()
+        maintenance.parse_args(parser)
@@ -2,8 +2,10 @@
 
 # pylint: disable=missing-docstring,unused-argument
 import datetime as dt
+import os
 from argparse import ArgumentParser
 from functools import partial
+from unittest import mock
 
 import gbp_testkit.fixtures as testkit
 from gbp_testkit.helpers import LOCAL_TIMEZONE, ts
@@ -282,3 +284,57 @@ class PSGetLocalProcessesTests(lib.TestCase):
             fixtures.repo.add_process(process)
 
         self.assertEqual(len(ps.get_local_processes(fixtures.tempdb)()), 0)
+
+
+@given(lib.tempdb, testkit.environ)
+class PSLocalRepoTests(lib.TestCase):
+    def test_settings_from_environment(self, fixtures: Fixtures) -> None:
+        os.environ["GBP_PS_SQLITE_BUSY_TIMEOUT"] = "1234"
+        os.environ["GBP_PS_SQLITE_SYNCHRONOUS"] = "full"
+
+        repo = ps.local_repo(fixtures.tempdb)
+
+        self.assertEqual(repo.busy_timeout, 1234)
+        self.assertEqual(repo.synchronous, "FULL")
+
+
+@given(lib.tempdb, testkit.gbpcli, repo=lib.repo_fixture, wait=testkit.patch)
+@where(wait__target="gbp_ps.cli.ps.Watcher.wait")
+class PSLocalContinuousTests(lib.TestCase):
+    def test_rerenders_when_database_changes(self, fixtures: Fixtures) -> None:
+        process = lib.BuildProcessFactory(package="sys-apps/less-668")
+
+        def wait(_timeout: float) -> bool:
+            if fixtures.wait.call_count > 1:
+                raise KeyboardInterrupt
+            fixtures.repo.add_process(process)
+            return True
+
+        fixtures.wait.side_effect = wait
+
+        with mock.patch.object(ps, "create_table", wraps=ps.create_table) as table:
+            exit_status = fixtures.gbpcli(f"gbp ps -c -i4 -l {fixtures.tempdb}")
+
+        self.assertEqual(exit_status, 0)
+        self.assertEqual(table.call_count, 2)
+        self.assertEqual(table.call_args[0][0], [process])
+        self.assertIn("sys-apps/less-668", fixtures.console.stdout)
+        fixtures.wait.assert_called_with(4)
+
+    def test_does_not_requery_when_unchanged(self, fixtures: Fixtures) -> None:
+        fixtures.wait.side_effect = [True, False, KeyboardInterrupt]
+
+        with mock.patch.object(ps, "create_table", wraps=ps.create_table) as table:
+            exit_status = fixtures.gbpcli(f"gbp ps -c -l {fixtures.tempdb}")
+
+        self.assertEqual(exit_status, 0)
+        self.assertEqual(table.call_count, 1)
+
+    def test_elapsed_rerenders_on_timeout(self, fixtures: Fixtures) -> None:
+        fixtures.wait.side_effect = [False, False, KeyboardInterrupt]
+
+        with mock.patch.object(ps, "create_table", wraps=ps.create_table) as table:
+            exit_status = fixtures.gbpcli(f"gbp ps -c -e -l {fixtures.tempdb}")
+
+        self.assertEqual(exit_status, 0)
+        self.assertEqual(table.call_count, 3)
@@ -0,0 +1,84 @@
+# pylint: disable=missing-docstring
+from pathlib import Path
+from typing import Generator
+
+import gbp_testkit.fixtures as testkit
+from unittest_fixtures import Fixtures, fixture, given, where
+
+from gbp_ps import inotify
+from gbp_ps.repository.sqlite import SqliteRepository
+from gbp_ps.settings import Settings
+
+from . import lib
+
+
+@fixture(lib.tempdb)
+def watcher_fixture(fixtures: Fixtures) -> Generator[inotify.Watcher, None, None]:
+    Path(fixtures.tempdb).touch()
+    watcher = inotify.Watcher(fixtures.tempdb)
+    yield watcher
+    watcher.close()
+
+
+def write(path: str) -> None:
+    with open(path, "ab") as fp:
+        fp.write(b"x")
+
+
+@given(lib.tempdb, watcher=watcher_fixture)
+class WatcherTests(lib.TestCase):
+    def test_write_to_database(self, fixtures: Fixtures) -> None:
+        write(fixtures.tempdb)
+
+        self.assertTrue(fixtures.watcher.wait(1))
+
+    def test_write_to_wal(self, fixtures: Fixtures) -> None:
+        write(f"{fixtures.tempdb}-wal")
+
+        self.assertTrue(fixtures.watcher.wait(1))
+
+    def test_write_to_other_file(self, fixtures: Fixtures) -> None:
+        write(f"{fixtures.tmpdir}/other.db")
+
+        self.assertFalse(fixtures.watcher.wait(0.05))
+
+    def test_timeout(self, fixtures: Fixtures) -> None:
+        self.assertFalse(fixtures.watcher.wait(0.05))
+
+    def test_events_are_drained(self, fixtures: Fixtures) -> None:
+        write(fixtures.tempdb)
+        fixtures.watcher.wait(1)
+
+        self.assertFalse(fixtures.watcher.wait(0.05))
+
+    def test_zero_timeout_polls(self, fixtures: Fixtures) -> None:
+        write(fixtures.tempdb)
+
+        self.assertTrue(fixtures.watcher.wait(0))
+
+    def test_repository_commit(self, fixtures: Fixtures) -> None:
+        repo = SqliteRepository(Settings(SQLITE_DATABASE=fixtures.tempdb))
+        fixtures.watcher.wait(0)
+
+        repo.add_process(lib.BuildProcessFactory())
+
+        self.assertTrue(fixtures.watcher.wait(1))
+
+
+@given(lib.tempdb, inotify_watch=testkit.patch, sleep=testkit.patch)
+@where(inotify_watch__target="gbp_ps.inotify.inotify_watch")
+@where(inotify_watch__return_value=None)
+@where(sleep__target="gbp_ps.inotify.time.sleep")
+class WatcherFallbackTests(lib.TestCase):
+    def test_sleeps_and_assumes_a_change(self, fixtures: Fixtures) -> None:
+        watcher = inotify.Watcher(fixtures.tempdb)
+
+        self.assertTrue(watcher.wait(2.5))
+        fixtures.sleep.assert_called_once_with(2.5)
+
+    def test_close(self, fixtures: Fixtures) -> None:
+        watcher = inotify.Watcher(fixtures.tempdb)
+
+        watcher.close()
+
+        self.assertIsNone(watcher.fd)
@@ -2,6 +2,7 @@
 
 # pylint: disable=missing-docstring, duplicate-code
 import importlib.metadata
+import threading
 from dataclasses import replace
 from unittest import mock
 
@@ -16,7 +17,14 @@ from gbp_ps.exceptions import (
     RecordNotFoundError,
     UpdateNotAllowedError,
 )
-from gbp_ps.repository import Repo, RepositoryType, add_or_update_process, sqlite
+from gbp_ps.repository import (
+    Repo,
+    RepositoryType,
+    add_or_update_process,
+    clear_repos,
+    get_repo,
+    sqlite,
+)
 from gbp_ps.types import BuildProcess
 
 from . import lib
@@ -28,6 +36,8 @@ ENVIRON = {
     "GBP_PS_STORAGE_BACKEND": "sqlite",
 }
 REDIS_FROM_URL = "gbp_ps.repository.redis.redis.Redis.from_url"
+REDIS_CLUSTER_FROM_URL = "gbp_ps.repository.redis.redis.RedisCluster.from_url"
+REDIS_NOW = "gbp_ps.repository.redis.now"
 FAKE_REDIS = fakeredis.FakeRedis()
 FAKE_REDIS.ping()
 
@@ -35,9 +45,14 @@ FAKE_REDIS.ping()
 @fixture(lib.settings)
 def repo_fixture(fixtures: Fixtures) -> FixtureContext[RepositoryType]:
     backend = fixtures.backend
-    if backend == "redis":
+    if backend.startswith("redis"):
         FAKE_REDIS.flushall()
-        repo_patch = mock.patch(REDIS_FROM_URL, return_value=FAKE_REDIS)
+        target = (
+            REDIS_CLUSTER_FROM_URL
+            if fixtures.settings.REDIS_CLUSTER
+            else REDIS_FROM_URL
+        )
+        repo_patch = mock.patch(target, return_value=FAKE_REDIS)
     elif backend == "sitecache":
         cache_clear()
         repo_patch = mock.MagicMock()
@@ -213,3 +228,55 @@ class OtherRepositoryTests(lib.TestCase):
 
         with self.assertRaises(ValueError):
             Repo(settings)
+
+
+@given(lib.settings)
+class GetRepoTests(lib.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        clear_repos()
+        self.addCleanup(clear_repos)
+
+    def test_returns_shared_instance(self, fixtures: Fixtures) -> None:
+        settings = replace(fixtures.settings, STORAGE_BACKEND="sqlite")
+
+        repo = get_repo(settings)
+
+        self.assertTrue(isinstance(repo, sqlite.SqliteRepository))
+        self.assertIs(get_repo(settings), repo)
+        self.assertIs(get_repo(replace(settings)), repo)
+
+    def test_instance_per_settings(self, fixtures: Fixtures) -> None:
+        settings = replace(fixtures.settings, STORAGE_BACKEND="sqlite")
+        other_settings = replace(settings, SQLITE_DATABASE=":memory:")
+
+        self.assertIsNot(get_repo(settings), get_repo(other_settings))
+
+    def test_settings_default_to_environment(self, fixtures: Fixtures) -> None:
+        self.assertIs(get_repo(), get_repo(fixtures.settings))
+
+    def test_created_once_across_threads(self, fixtures: Fixtures) -> None:
+        settings = replace(fixtures.settings, STORAGE_BACKEND="sqlite")
+        repos: list[RepositoryType] = []
+
+        with mock.patch("gbp_ps.repository.Repo", side_effect=Repo) as repo_factory:
+            threads = [
+                threading.Thread(target=lambda: repos.append(get_repo(settings)))
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        repo_factory.assert_called_once_with(settings)
+        self.assertEqual(len(repos), 8)
+        self.assertEqual(len({id(repo) for repo in repos}), 1)
+
+    def test_clear_repos(self, fixtures: Fixtures) -> None:
+        settings = replace(fixtures.settings, STORAGE_BACKEND="sqlite")
+        repo = get_repo(settings)
+
+        clear_repos()
+
+        self.assertIsNot(get_repo(settings), repo)
@@ -0,0 +1,197 @@
+# pylint: disable=missing-docstring
+from contextlib import contextmanager
+from dataclasses import replace
+from typing import Any, Callable, Generator
+from unittest import mock
+
+from django.db import connection
+from unittest_fixtures import Fixtures, fixture, given
+
+from gbp_ps.django.gbp_ps.models import BuildProcess as BuildProcessModel
+from gbp_ps.exceptions import RecordNotFoundError, UpdateNotAllowedError
+from gbp_ps.repository.django import DjangoRepository
+from gbp_ps.settings import Settings
+
+from . import lib
+
+
+@fixture()
+def django_repo(_fixtures: Fixtures) -> DjangoRepository:
+    return DjangoRepository(Settings(DJANGO_FETCH_CHUNK_SIZE=2))
+
+
+@given(lib.build_process, repo=django_repo)
+class DjangoRepositoryUpdateProcessTests(lib.TestCase):
+    def test_update_is_a_single_query(self, fixtures: Fixtures) -> None:
+        repo: DjangoRepository = fixtures.repo
+        process = replace(fixtures.build_process, phase="compile")
+        repo.add_process(process)
+
+        with self.assertNumQueries(1):
+            repo.update_process(replace(process, phase="install"))
+
+        self.assertEqual([*repo.get_processes()], [replace(process, phase="install")])
+
+    def test_final_update_from_same_host(self, fixtures: Fixtures) -> None:
+        repo: DjangoRepository = fixtures.repo
+        process = replace(fixtures.build_process, phase="postinst")
+        repo.add_process(process)
+
+        with self.assertNumQueries(1):
+            repo.update_process(replace(process, phase="clean"))
+
+        self.assertEqual(
+            [*repo.get_processes(include_final=True)], [replace(process, phase="clean")]
+        )
+
+    def test_final_update_from_other_host_not_allowed(self, fixtures: Fixtures) -> None:
+        repo: DjangoRepository = fixtures.repo
+        process = replace(fixtures.build_process, phase="postinst")
+        repo.add_process(process)
+
+        with self.assertRaises(UpdateNotAllowedError):
+            repo.update_process(replace(process, build_host="badhost", phase="clean"))
+
+        self.assertEqual([*repo.get_processes()], [process])
+
+    def test_update_from_other_host(self, fixtures: Fixtures) -> None:
+        repo: DjangoRepository = fixtures.repo
+        process = replace(fixtures.build_process, phase="compile")
+        repo.add_process(process)
+        new = replace(process, build_host="newhost", phase="install")
+
+        repo.update_process(new)
+
+        self.assertEqual([*repo.get_processes()], [new])
+
+    def test_not_found(self, fixtures: Fixtures) -> None:
+        repo: DjangoRepository = fixtures.repo
+
+        with self.assertRaises(RecordNotFoundError):
+            repo.update_process(fixtures.build_process)
+
+
+@given(repo=django_repo)
+class DjangoRepositoryGetProcessesTests(lib.TestCase):
+    def test_single_query_without_models(self, fixtures: Fixtures) -> None:
+        repo: DjangoRepository = fixtures.repo
+        processes = [lib.BuildProcessFactory(phase="compile") for _ in range(5)]
+        for process in processes:
+            repo.add_process(process)
+
+        with mock.patch.object(BuildProcessModel, "__init__") as init:
+            with self.assertNumQueries(1):
+                result = [*repo.get_processes()]
+
+        init.assert_not_called()
+        self.assertEqual(
+            sorted(result, key=lambda p: p.build_id),
+            sorted(processes, key=lambda p: p.build_id),
+        )
+
+
+@given(repo=django_repo)
+class DjangoQueryPlanTests(lib.TestCase):
+    """The repository's queries use the indexes rather than scanning the table"""
+
+    def setUp(self) -> None:
+        super().setUp()
+
+        if connection.vendor not in ("sqlite", "postgresql"):
+            self.skipTest(f"No query plan checks for {connection.vendor}")
+
+    def test_add_process(self, fixtures: Fixtures) -> None:
+        repo: DjangoRepository = fixtures.repo
+        repo.add_process(lib.BuildProcessFactory(phase="compile"))
+
+        with captured() as statements:
+            repo.add_process(lib.BuildProcessFactory(phase="compile"))
+
+        self.assert_no_table_scans(statements)
+
+    def test_update_process(self, fixtures: Fixtures) -> None:
+        repo: DjangoRepository = fixtures.repo
+        process = lib.BuildProcessFactory(phase="compile")
+        repo.add_process(process)
+
+        for new in [
+            replace(process, phase="postinst"),
+            replace(process, phase="clean", build_host="badhost"),
+        ]:
+            with captured() as statements:
+                try:
+                    repo.update_process(new)
+                except UpdateNotAllowedError:
+                    pass
+
+            self.assert_no_table_scans(statements)
+
+    def test_get_processes(self, fixtures: Fixtures) -> None:
+        repo: DjangoRepository = fixtures.repo
+        repo.add_process(lib.BuildProcessFactory(phase="compile"))
+
+        for include_final in [False, True]:
+            for machine in [None, "babette"]:
+                with captured() as statements:
+                    processes = [
+                        *repo.get_processes(
+                            include_final=include_final, machine=machine
+                        )
+                    ]
+
+                self.assertEqual(len(processes), 1)
+                self.assert_no_table_scans(statements)
+
+    def test_get_processes_uses_partial_index(self, fixtures: Fixtures) -> None:
+        repo: DjangoRepository = fixtures.repo
+
+        with captured() as statements:
+            processes = [*repo.get_processes()]
+
+        self.assertEqual(processes, [])
+        self.assertIn("gbp_ps_live_start_time_idx", " ".join(explain(*statements[0])))
+
+    def assert_no_table_scans(self, statements: list[tuple[str, Any]]) -> None:
+        queries = [s for s in statements if not s[0].startswith("INSERT")]
+        self.assertTrue(queries)
+
+        for sql, params in queries:
+            for detail in explain(sql, params):
+                with self.subTest(query=sql, detail=detail):
+                    # sqlite
+                    self.assertFalse(
+                        detail.startswith("SCAN") and "INDEX" not in detail
+                    )
+                    self.assertNotIn("TEMP B-TREE", detail)
+                    # postgresql
+                    self.assertNotIn("Seq Scan", detail)
+                    self.assertFalse(detail.lstrip(" ->").startswith("Sort"))
+
+
+@contextmanager
+def captured() -> Generator[list[tuple[str, Any]], None, None]:
+    """Collect the (sql, params) of the statements executed on the connection"""
+    statements: list[tuple[str, Any]] = []
+
+    def wrapper(
+        execute: Callable[..., Any], sql: str, params: Any, many: bool, context: Any
+    ) -> Any:
+        statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        yield statements
+
+
+def explain(sql: str, params: Any) -> list[str]:
+    """Return the lines of the database's query plan for the statement"""
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            # The test tables are tiny. Make the planner show whether it *can* use an
+            # index
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute(f"EXPLAIN {sql}", params)
+            return [row[0] for row in cursor.fetchall()]
+
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        return [row[3] for row in cursor.fetchall()]
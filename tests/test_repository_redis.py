@@ -0,0 +1,1219 @@
+"""Tests for the Redis repositories"""
+
+# pylint: disable=missing-docstring, duplicate-code, too-many-lines
+import datetime as dt
+import time
+from dataclasses import replace
+from typing import Any
+from unittest import mock
+
+import fakeredis
+import redis
+from gbp_testkit.helpers import ts
+from redis.crc import key_slot
+from unittest_fixtures import FixtureContext, Fixtures, fixture, given, params, where
+
+from gbp_ps.exceptions import (
+    RecordAlreadyExists,
+    RecordNotFoundError,
+    UpdateNotAllowedError,
+)
+from gbp_ps.repository import Repo, RepositoryType
+from gbp_ps.repository import redis as redis_repo
+from gbp_ps.types import BuildProcess
+
+from . import lib
+from .test_repository import (
+    ENVIRON,
+    FAKE_REDIS,
+    REDIS_CLUSTER_FROM_URL,
+    REDIS_FROM_URL,
+    REDIS_NOW,
+    repo_fixture,
+)
+
+REPLICA_URL = "redis://replica.invalid:6379/0"
+FAKE_REPLICA = fakeredis.FakeRedis(server=fakeredis.FakeServer())
+
+
+@given(lib.build_process, repo_fixture)
+@where(environ=ENVIRON, build_process__phase="compile")
+@params(backend=["redis"])
+class RedisRepositoryIndexTests(lib.TestCase):
+    def test_get_processes_does_not_scan_keys(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+
+        with mock.patch.object(FAKE_REDIS, "keys") as keys:
+            processes = [*repo.get_processes()]
+
+        keys.assert_not_called()
+        self.assertEqual(processes, [build_process])
+
+    def test_add_process_does_not_scan_keys(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        dead_process: BuildProcess = fixtures.build_process
+        repo.add_process(dead_process)
+        new_process = replace(
+            dead_process, build_id=str(int(dead_process.build_id) + 1)
+        )
+
+        with mock.patch.object(FAKE_REDIS, "keys") as keys:
+            repo.add_process(new_process)
+
+        keys.assert_not_called()
+        self.assertEqual([*repo.get_processes()], [new_process])
+
+    def test_expired_keys_are_removed_from_index(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        FAKE_REDIS.delete(repo.key(build_process))
+
+        self.assertEqual([*repo.get_processes()], [])
+
+        machine = build_process.machine
+        self.assertEqual(FAKE_REDIS.zrange(repo.machine_index(machine), 0, -1), [])
+        self.assertEqual(
+            FAKE_REDIS.smembers(repo.package_index(machine, build_process.package)),
+            set(),
+        )
+        self.assertEqual(FAKE_REDIS.smembers(repo.machines_index()), set())
+
+    def test_index_keys_expire(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+
+        self.assertGreater(FAKE_REDIS.ttl(repo.machines_index()), 0)
+        self.assertGreater(FAKE_REDIS.ttl(repo.machine_index("babette")), 0)
+
+    def test_get_processes_with_machine_does_not_read_machines_index(
+        self, fixtures: Fixtures
+    ) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        repo.add_process(replace(build_process, machine="laika"))
+
+        with mock.patch.object(repo, "machines") as machines:
+            processes = [*repo.get_processes(machine="babette")]
+
+        self.assertEqual(processes, [build_process])
+        machines.assert_not_called()
+
+    def test_backfills_unindexed_keys(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        live: BuildProcess = fixtures.build_process
+        final = replace(live, package="sys-apps/bar-1.0", phase="clean")
+
+        # Keys written before the indexes existed
+        for process in [live, final]:
+            FAKE_REDIS.set(repo.key(process), repo.value(process), ex=repo.time)
+
+        self.assertEqual([*repo.get_processes()], [live])
+        self.assertEqual(
+            sorted([*repo.get_processes(include_final=True)], key=str),
+            sorted([live, final], key=str),
+        )
+        self.assertEqual(
+            FAKE_REDIS.smembers(repo.package_index(live.machine, live.package)),
+            {repo.key(live)},
+        )
+        self.assertTrue(FAKE_REDIS.exists(repo.indexed_key()))
+
+    def test_backfill_is_done_once(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        repo.get_processes()
+        repo.indexed = False
+
+        with mock.patch.object(FAKE_REDIS, "scan_iter") as scan_iter:
+            repo.get_processes()
+
+        scan_iter.assert_not_called()
+
+    def test_backfill_keeps_index_scores(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        key = repo.key(build_process)
+        FAKE_REDIS.zadd(repo.machine_index(build_process.machine), {key: 1.0})
+
+        repo.backfill_indexes()
+
+        self.assertEqual(
+            FAKE_REDIS.zscore(repo.machine_index(build_process.machine), key), 1.0
+        )
+
+
+@given(lib.build_process, repo_fixture)
+@where(environ=ENVIRON, build_process__phase="compile")
+@params(backend=["redis"])
+class RedisRepositoryScriptTests(lib.TestCase):
+    def test_add_process_is_one_round_trip(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        # Load the script
+        repo.add_process(replace(build_process, machine="laika"))
+
+        with mock.patch.object(
+            FAKE_REDIS, "execute_command", wraps=FAKE_REDIS.execute_command
+        ) as execute_command:
+            repo.add_process(build_process)
+
+        execute_command.assert_called_once()
+
+    def test_update_process_is_one_round_trip(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        # Load the script
+        with self.assertRaises(RecordNotFoundError):
+            repo.update_process(replace(build_process, machine="laika"))
+
+        with mock.patch.object(
+            FAKE_REDIS, "execute_command", wraps=FAKE_REDIS.execute_command
+        ) as execute_command:
+            repo.update_process(replace(build_process, phase="install"))
+
+        execute_command.assert_called_once()
+
+    def test_update_process_with_long_strings(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = replace(
+            fixtures.build_process, build_host="b" * 40, phase="compile"
+        )
+        repo.add_process(build_process)
+        updated = replace(build_process, build_host="h" * 300, phase="p" * 50)
+
+        repo.update_process(updated)
+
+        self.assertEqual([*repo.get_processes()], [updated])
+
+    def test_update_not_allowed_reports_previous_process(
+        self, fixtures: Fixtures
+    ) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        updated = replace(build_process, build_host="badhost", phase="clean")
+
+        with self.assertRaises(UpdateNotAllowedError) as context:
+            repo.update_process(updated)
+
+        self.assertEqual(context.exception.args, (build_process, updated))
+
+    def test_add_process_does_not_delete_final_processes_of_other_builds(
+        self, fixtures: Fixtures
+    ) -> None:
+        repo = fixtures.repo
+        finished: BuildProcess = replace(fixtures.build_process, phase="postrm")
+        repo.add_process(finished)
+        new_process = replace(
+            fixtures.build_process, build_id=str(int(finished.build_id) + 1)
+        )
+
+        repo.add_process(new_process)
+
+        self.assertEqual(
+            set(repo.get_processes(include_final=True)), {finished, new_process}
+        )
+
+
+@given(repo_fixture)
+@where(environ=ENVIRON)
+@params(backend=["redis"])
+class RedisRepositoryFetchTests(lib.TestCase):
+    def test_round_trips_do_not_depend_on_table_size(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        repo.batch_size = 2
+        processes = lib.BuildProcessFactory.create_batch(5, phase="compile")
+        for process in processes:
+            repo.add_process(process)
+        repo.get_processes()  # the first listing backfills the indexes
+
+        with (
+            mock.patch.object(
+                FAKE_REDIS, "execute_command", wraps=FAKE_REDIS.execute_command
+            ) as execute_command,
+            mock.patch.object(
+                redis.client.Pipeline,
+                "execute",
+                autospec=True,
+                side_effect=redis.client.Pipeline.execute,
+            ) as pipeline_execute,
+        ):
+            result = [*repo.get_processes()]
+
+        self.assertEqual(set(result), set(processes))
+        # SMEMBERS of the machines index, followed by the machine indexes, then values
+        execute_command.assert_called_once()
+        self.assertEqual(pipeline_execute.call_count, 2)
+
+    def test_mget_batches(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        repo.batch_size = 2
+        keys = [f"key{i}".encode() for i in range(5)]
+        for key in keys[:-1]:
+            FAKE_REDIS.set(key, key)
+
+        with mock.patch.object(
+            redis.client.Pipeline,
+            "mget",
+            autospec=True,
+            side_effect=redis.client.Pipeline.mget,
+        ) as mget:
+            values = repo.mget(keys)
+
+        self.assertEqual(values, [*keys[:-1], None])
+        self.assertEqual(mget.call_count, 3)
+
+
+@given(repo_fixture)
+@where(environ=ENVIRON)
+@params(backend=["redis"])
+class RedisRepositoryTimeIndexTests(lib.TestCase):
+    def add_processes(
+        self, repo: RepositoryType, count: int, **kwargs: Any
+    ) -> list[BuildProcess]:
+        processes = timed_processes(count, **kwargs)
+        for process in reversed(processes):
+            repo.add_process(process)
+
+        return processes
+
+    def test_ordered_across_machines(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        processes = timed_processes(6, phase="compile")
+        processes[1::2] = [replace(p, machine="laika") for p in processes[1::2]]
+        for process in reversed(processes):
+            repo.add_process(process)
+
+        self.assertEqual([*repo.get_processes()], processes)
+
+    def test_limit(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        processes = self.add_processes(repo, 6, phase="compile")
+
+        self.assertEqual([*repo.get_processes(limit=4)], processes[:4])
+
+    def test_after(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        processes = self.add_processes(repo, 6, phase="compile")
+
+        result = [*repo.get_processes(after=processes[2].start_time, limit=2)]
+
+        self.assertEqual(result, processes[3:5])
+
+    def test_limit_skips_final_processes(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        processes = self.add_processes(repo, 6, phase="compile")
+        for process in processes[:3]:
+            repo.update_process(replace(process, phase="clean"))
+
+        self.assertEqual([*repo.get_processes(limit=2)], processes[3:5])
+
+    def test_limit_skips_expired_processes(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        processes = self.add_processes(repo, 6, phase="compile")
+        FAKE_REDIS.delete(*[repo.key(process) for process in processes[:3]])
+
+        self.assertEqual([*repo.get_processes(limit=2)], processes[3:5])
+        self.assertEqual(FAKE_REDIS.zcard(repo.machine_index("babette")), 3)
+
+    def test_update_keeps_time_index_score(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        processes = self.add_processes(repo, 2, phase="compile")
+        later = processes[0].start_time + dt.timedelta(hours=1)
+
+        repo.update_process(replace(processes[0], phase="install", start_time=later))
+
+        result = [*repo.get_processes()]
+        self.assertEqual(result, [replace(processes[0], phase="install"), processes[1]])
+
+    def test_update_indexes_unindexed_process(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        [process] = self.add_processes(repo, 1, phase="compile")
+        FAKE_REDIS.delete(repo.machine_index(process.machine))
+
+        repo.update_process(replace(process, phase="install"))
+
+        self.assertEqual([*repo.get_processes()], [replace(process, phase="install")])
+
+
+@given(repo_fixture)
+@where(environ=ENVIRON)
+@params(backend=["redis", "redis-hash"])
+class RedisPagingTests(lib.TestCase):
+    def test_newest_first(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        processes = timed_processes(6, phase="compile")
+        for process in processes:
+            repo.add_process(process)
+
+        result = [*repo.get_processes(limit=2, newest_first=True)]
+
+        self.assertEqual(result, [processes[5], processes[4]])
+
+    def test_zero_limit(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        for process in timed_processes(3, phase="compile"):
+            repo.add_process(process)
+
+        self.assertEqual([*repo.get_processes(limit=0)], [])
+
+    def test_newest_first_after(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        processes = timed_processes(6, phase="compile")
+        for process in processes:
+            repo.add_process(process)
+
+        result = [*repo.get_processes(after=processes[3].start_time, newest_first=True)]
+
+        self.assertEqual(result, processes[2::-1])
+
+    def test_cursor_pages_through_same_start_times(self, fixtures: Fixtures) -> None:
+        for newest_first in [False, True]:
+            with self.subTest(newest_first=newest_first):
+                repo = fixtures.repo
+                start_time = ts("2025-01-01 12:00:00")
+                processes = [
+                    replace(process, start_time=start_time)
+                    for process in timed_processes(5, phase="compile")
+                ]
+                for process in processes:
+                    repo.add_process(process)
+
+                pages = list_pages(repo, limit=2, newest_first=newest_first)
+
+                self.assertEqual([len(page) for page in pages], [2, 2, 1])
+                listed = [process for page in pages for process in page]
+                self.assertEqual(
+                    listed, [*repo.get_processes(newest_first=newest_first)]
+                )
+                self.assertCountEqual(listed, processes)
+                FAKE_REDIS.flushall()
+
+
+def list_pages(repo: Any, **kwargs: Any) -> list[list[BuildProcess]]:
+    """List all of the repo's processes, a page at a time, by cursor"""
+    pages = [[*repo.get_processes(**kwargs)]]
+
+    while page := [*repo.get_processes(after=repo.cursor(pages[-1][-1]), **kwargs)]:
+        pages.append(page)
+
+    return pages
+
+
+def timed_processes(count: int, **kwargs: Any) -> list[BuildProcess]:
+    """Return count processes of different packages started a minute apart"""
+    return [
+        lib.BuildProcessFactory(
+            start_time=ts("2025-01-01 12:00:00") + dt.timedelta(minutes=i),
+            package=f"app-misc/package-{i}",
+            **kwargs,
+        )
+        for i in range(count)
+    ]
+
+
+@given(lib.build_process, repo_fixture)
+@where(environ=ENVIRON, build_process__phase="compile")
+@params(backend=["redis", "redis-hash"])
+class RedisPruneMachinesTests(lib.TestCase):
+    def test_prunes_only_empty_machines(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        FAKE_REDIS.sadd(repo.machines_index(), "lighthouse")
+
+        repo.prune_machines([build_process.machine, "lighthouse"])
+
+        self.assertEqual(repo.machines(), [build_process.machine])
+
+    def test_keeps_machine_added_to_while_listing(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        FAKE_REDIS.sadd(repo.machines_index(), build_process.machine)
+
+        def read_then_add(func: Any) -> Any:
+            result = func(FAKE_REDIS)
+            repo.add_process(build_process)
+
+            return result
+
+        with mock.patch.object(repo, "from_replica", side_effect=read_then_add):
+            self.assertEqual([*repo.get_processes()], [])
+
+        self.assertEqual(repo.machines(), [build_process.machine])
+        self.assertEqual([*repo.get_processes()], [build_process])
+
+
+@given(lib.build_process, repo_fixture)
+@where(environ=ENVIRON, build_process__phase="compile")
+@params(backend=["redis-hash"])
+class RedisHashRepositoryTests(lib.TestCase):
+    def test_processes_are_stored_in_machine_hash(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        repo.add_process(replace(build_process, package="app-misc/other-1.0"))
+
+        machine_hash = repo.machine_hash(build_process.machine)
+        packages_hash = repo.packages_hash(build_process.machine)
+        self.assertEqual(
+            set(FAKE_REDIS.keys()), {machine_hash, packages_hash, repo.machines_index()}
+        )
+        self.assertEqual(FAKE_REDIS.hlen(machine_hash), 2)
+        self.assertEqual(
+            FAKE_REDIS.hget(packages_hash, build_process.package),
+            build_process.build_id.encode(),
+        )
+        self.assertGreater(FAKE_REDIS.ttl(machine_hash), 0)
+        self.assertGreater(FAKE_REDIS.ttl(packages_hash), 0)
+
+    def test_fields_are_short(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+
+        self.assertEqual(
+            repo.field(build_process),
+            f"{redis_repo.package_id(build_process.package)}:"
+            f"{build_process.build_id}".encode(),
+        )
+        self.assertEqual(len(redis_repo.package_id(build_process.package)), 12)
+
+    def test_add_only_looks_at_the_package_fields(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        machine_hash = repo.machine_hash(build_process.machine)
+
+        with mock.patch(REDIS_NOW, return_value=time.time() - repo.time - 1):
+            repo.add_process(build_process)
+        repo.add_process(replace(build_process, package="app-misc/other-1.0"))
+
+        # The expired process of the other package is left for the listing to delete
+        self.assertEqual(FAKE_REDIS.hlen(machine_hash), 2)
+
+        repo.get_processes()
+
+        self.assertEqual(FAKE_REDIS.hlen(machine_hash), 1)
+        self.assertEqual(
+            FAKE_REDIS.hkeys(repo.packages_hash(build_process.machine)),
+            [b"app-misc/other-1.0"],
+        )
+
+    def test_new_build_deletes_the_package_from_previous_build(
+        self, fixtures: Fixtures
+    ) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        other = replace(build_process, package="app-misc/other-1.0", phase="postinst")
+        repo.add_process(build_process)
+        repo.add_process(other)
+
+        next_build = replace(build_process, build_id="next")
+        repo.add_process(next_build)
+
+        self.assertCountEqual(
+            repo.get_processes(include_final=True), [next_build, other]
+        )
+
+    def test_expired_fields_are_not_returned(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+
+        with mock.patch(REDIS_NOW, return_value=time.time() - repo.time - 1):
+            repo.add_process(build_process)
+
+        self.assertEqual([*repo.get_processes()], [])
+        self.assertEqual(FAKE_REDIS.hlen(repo.machine_hash(build_process.machine)), 0)
+
+    def test_expired_field_can_be_added_again(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+
+        with mock.patch(REDIS_NOW, return_value=time.time() - repo.time - 1):
+            repo.add_process(build_process)
+
+        repo.add_process(build_process)
+
+        self.assertEqual([*repo.get_processes()], [build_process])
+
+    def test_expired_field_cannot_be_updated(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+
+        with mock.patch(REDIS_NOW, return_value=time.time() - repo.time - 1):
+            repo.add_process(build_process)
+
+        with self.assertRaises(RecordNotFoundError):
+            repo.update_process(replace(build_process, phase="install"))
+
+    def test_update_refreshes_expiration(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        then = time.time() - 60
+
+        with mock.patch(REDIS_NOW, return_value=then):
+            repo.add_process(build_process)
+        repo.update_process(replace(build_process, phase="install"))
+
+        with mock.patch(REDIS_NOW, return_value=then + repo.time + 10):
+            processes = [*repo.get_processes()]
+
+        self.assertEqual(processes, [replace(build_process, phase="install")])
+
+
+@given(lib.build_process, repo_fixture)
+@where(environ=ENVIRON, build_process__phase="compile")
+@params(backend=["redis"])
+class RedisValueFormatTests(lib.TestCase):
+    def set_v1_value(self, repo: RepositoryType, process: BuildProcess) -> bytes:
+        key = repo.key(process)
+        v1_value = redis_repo.dumps(
+            (process.build_host, process.phase, process.start_time)
+        )
+        FAKE_REDIS.set(key, v1_value, keepttl=True)
+
+        return key
+
+    def test_writes_current_version(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+
+        value = FAKE_REDIS.get(repo.key(build_process))
+
+        self.assertEqual(redis_repo.value_version(value), redis_repo.VALUE_VERSION)
+        self.assertEqual(
+            redis_repo.loads(value),
+            [
+                2,
+                build_process.build_host,
+                build_process.phase,
+                build_process.start_time.timestamp(),
+            ],
+        )
+
+    def test_reads_and_migrates_v1_values(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        key = self.set_v1_value(repo, build_process)
+
+        self.assertEqual([*repo.get_processes()], [build_process])
+
+        value = FAKE_REDIS.get(key)
+        self.assertEqual(redis_repo.value_version(value), 2)
+        self.assertGreater(FAKE_REDIS.ttl(key), 0)
+        self.assertEqual([*repo.get_processes()], [build_process])
+
+    def test_updates_v1_values(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        self.set_v1_value(repo, build_process)
+        updated = replace(build_process, build_host="gbp", phase="install")
+
+        repo.update_process(updated)
+
+        self.assertEqual([*repo.get_processes()], [updated])
+
+    def test_migration_does_not_clobber_changed_values(
+        self, fixtures: Fixtures
+    ) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        key = self.set_v1_value(repo, build_process)
+        v1_value = FAKE_REDIS.get(key)
+        repo.update_process(replace(build_process, phase="install"))
+        current = FAKE_REDIS.get(key)
+
+        repo.migrate_values([(key, v1_value)])
+
+        self.assertEqual(FAKE_REDIS.get(key), current)
+
+
+@given(lib.build_process, repo_fixture)
+@where(environ=ENVIRON, build_process__phase="compile")
+@params(backend=["redis-hash"])
+class RedisHashValueFormatTests(lib.TestCase):
+    def test_reads_and_migrates_v1_values(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        machine_hash = repo.machine_hash(build_process.machine)
+        field = repo.field(build_process)
+        expires = repo.expires()
+        v1_value = redis_repo.dumps(
+            (
+                build_process.build_host,
+                build_process.phase,
+                build_process.start_time,
+                expires,
+            )
+        )
+        FAKE_REDIS.hset(machine_hash, field, v1_value)
+
+        self.assertEqual([*repo.get_processes()], [build_process])
+
+        value = FAKE_REDIS.hget(machine_hash, field)
+        self.assertEqual(redis_repo.value_version(value), 2)
+        self.assertEqual(redis_repo.loads(value)[-1], expires)
+
+        updated = replace(build_process, phase="install")
+        repo.update_process(updated)
+        self.assertEqual([*repo.get_processes()], [updated])
+
+
+@given(lib.build_process, repo_fixture)
+@where(environ={**ENVIRON, "GBP_PS_REDIS_CLIENT_CACHE_SIZE": "100"})
+@where(build_process__phase="compile")
+@params(backend=["redis", "redis-hash"])
+class RedisClientCacheTests(lib.TestCase):
+    def test_connects_with_client_cache(self, fixtures: Fixtures) -> None:
+        settings = replace(fixtures.settings, STORAGE_BACKEND=fixtures.backend)
+
+        with mock.patch(REDIS_FROM_URL) as from_url:
+            Repo(settings)
+
+        from_url.assert_called_once_with(
+            settings.REDIS_URL, protocol=3, cache_config=mock.ANY
+        )
+        cache_config = from_url.call_args.kwargs["cache_config"]
+        self.assertEqual(cache_config.get_max_size(), 100)
+
+    def test_reads_are_not_pipelined(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        repo.get_processes()  # the first listing backfills the indexes
+
+        with mock.patch.object(FAKE_REDIS, "pipeline") as pipeline:
+            processes = [*repo.get_processes()]
+
+        pipeline.assert_not_called()
+        self.assertEqual(processes, [build_process])
+
+
+@given(lib.build_process, repo_fixture)
+@where(environ={**ENVIRON, "GBP_PS_REDIS_CLUSTER": "1"})
+@where(build_process__phase="compile")
+@params(backend=["redis", "redis-hash"])
+class RedisClusterTests(lib.TestCase):
+    def test_add_update_and_list(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        other = lib.BuildProcessFactory(machine="other", phase="compile")
+        repo.add_process(build_process)
+        repo.add_process(other)
+        updated = replace(build_process, phase="postinst")
+        repo.update_process(updated)
+
+        self.assertEqual(set(repo.get_processes()), {updated, other})
+        self.assertEqual(
+            [*repo.get_processes(machine=build_process.machine)], [updated]
+        )
+
+    def test_adds_machine_to_machines_index(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+
+        self.assertEqual(repo.machines(), [build_process.machine])
+        self.assertGreater(FAKE_REDIS.ttl(repo.machines_index()), 0)
+
+    def test_prunes_only_empty_machines(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        FAKE_REDIS.sadd(repo.machines_index(), "lighthouse")
+
+        repo.prune_machines([build_process.machine, "lighthouse"])
+
+        self.assertEqual(repo.machines(), [build_process.machine])
+
+    def test_machine_keys_are_in_one_slot(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+
+        keys = [
+            key
+            for key in FAKE_REDIS.keys(f"{fixtures.settings.REDIS_KEY}*")
+            if key != repo.machines_index()
+        ]
+        self.assertTrue(keys)
+        self.assertEqual(len({key_slot(key) for key in keys}), 1)
+
+    def test_appends_to_stream(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        repo.stream = "gbp-ps-test.log"
+        build_process: BuildProcess = fixtures.build_process
+
+        with mock.patch.object(
+            redis.client.Pipeline,
+            "xadd",
+            autospec=True,
+            side_effect=redis.client.Pipeline.xadd,
+        ) as xadd:
+            repo.add_process(build_process)
+
+        self.assertEqual(FAKE_REDIS.xlen("gbp-ps-test.log"), 1)
+        self.assertEqual(xadd.call_args.kwargs["maxlen"], 10000)
+        self.assertTrue(xadd.call_args.kwargs["approximate"])
+
+    def test_connects_to_cluster(self, fixtures: Fixtures) -> None:
+        settings = replace(fixtures.settings, STORAGE_BACKEND=fixtures.backend)
+
+        with (
+            mock.patch(REDIS_CLUSTER_FROM_URL) as cluster_from_url,
+            mock.patch(REDIS_FROM_URL) as from_url,
+        ):
+            Repo(settings)
+
+        cluster_from_url.assert_called_once_with(settings.REDIS_URL)
+        from_url.assert_not_called()
+
+
+@given(repo_fixture)
+@where(environ={**ENVIRON, "GBP_PS_REDIS_CLUSTER": "1"})
+@params(backend=["redis"])
+class RedisClusterKeyTests(lib.TestCase):
+    def test_process_key_has_hash_tag(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        process = lib.BuildProcessFactory(machine="babette", package="sys-apps/foo")
+
+        key_bytes = repo.key(process)
+
+        self.assertEqual(
+            key_bytes,
+            f"gbp-ps-test:{{babette}}:sys-apps/foo:{process.build_id}".encode(),
+        )
+        key = redis_repo.Key.from_bytes(key_bytes)
+        self.assertEqual(key.machine, "babette")
+        self.assertEqual(bytes(key), key_bytes)
+
+    def test_script_keys_exclude_machines_index(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        process = lib.BuildProcessFactory()
+
+        keys = repo.script_keys(process)
+
+        self.assertNotIn(repo.machines_index(), keys)
+        self.assertEqual(len({key_slot(key) for key in keys}), 1)
+
+    def test_mget_batches_do_not_cross_slots(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        repo.batch_size = 3
+        keys = [
+            *[repo.key(lib.BuildProcessFactory(machine="babette")) for _ in range(4)],
+            *[
+                repo.key(lib.BuildProcessFactory(machine="lighthouse"))
+                for _ in range(2)
+            ],
+        ]
+
+        with mock.patch.object(
+            redis.client.Pipeline,
+            "mget",
+            autospec=True,
+            side_effect=redis.client.Pipeline.mget,
+        ) as mget:
+            values = repo.mget(keys)
+
+        self.assertEqual(values, [None] * 6)
+        batches = [call.args[1] for call in mget.call_args_list]
+        self.assertEqual([len(batch) for batch in batches], [3, 1, 2])
+        for batch in batches:
+            self.assertEqual(len({key_slot(key) for key in batch}), 1)
+
+
+@given(lib.build_process, repo_fixture)
+@where(environ={**ENVIRON, "GBP_PS_REDIS_CHANNEL": "gbp-ps-test"})
+@where(build_process__phase="compile", build_process__machine="babette")
+@where(build_process__package="sys-apps/foo-1.0", build_process__build_id="100")
+@where(build_process__build_host="jenkins")
+@params(backend=["redis", "redis-hash"])
+class RedisPublishTests(lib.TestCase):
+    def test_publishes_add_and_update(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        pubsub = subscribe("gbp-ps-test")
+
+        repo.add_process(build_process)
+        repo.update_process(replace(build_process, phase="postinst"))
+
+        self.assertEqual(
+            messages(pubsub),
+            [
+                "add babette sys-apps/foo-1.0 100 jenkins compile",
+                "update babette sys-apps/foo-1.0 100 jenkins postinst",
+            ],
+        )
+
+    def test_publishes_stale_build_deletions(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        pubsub = subscribe("gbp-ps-test")
+
+        repo.add_process(replace(build_process, build_id="101"))
+
+        self.assertEqual(
+            messages(pubsub),
+            [
+                "delete babette sys-apps/foo-1.0 100",
+                "add babette sys-apps/foo-1.0 101 jenkins compile",
+            ],
+        )
+
+    def test_does_not_publish_rejected_changes(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        pubsub = subscribe("gbp-ps-test")
+
+        with self.assertRaises(RecordAlreadyExists):
+            repo.add_process(build_process)
+
+        with self.assertRaises(UpdateNotAllowedError):
+            repo.update_process(
+                replace(build_process, build_host="other", phase="clean")
+            )
+
+        self.assertEqual(messages(pubsub), [])
+
+    def test_does_not_publish_without_channel(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        repo.channel = ""
+        pubsub = FAKE_REDIS.pubsub()
+        pubsub.psubscribe("gbp-ps*")
+        pubsub.get_message()
+
+        repo.add_process(fixtures.build_process)
+
+        self.assertEqual(messages(pubsub), [])
+
+
+@given(lib.build_process, repo_fixture)
+@where(environ={**ENVIRON, "GBP_PS_REDIS_STREAM": "gbp-ps-test.log"})
+@where(build_process__phase="compile", build_process__machine="babette")
+@where(build_process__package="sys-apps/foo-1.0", build_process__build_id="100")
+@where(build_process__build_host="jenkins")
+@params(backend=["redis", "redis-hash"])
+class RedisStreamTests(lib.TestCase):
+    def test_logs_adds_and_updates(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+
+        with mock.patch(REDIS_NOW, return_value=1700000000.5):
+            repo.add_process(build_process)
+            repo.update_process(replace(build_process, phase="postinst"))
+
+        entries = [fields for _, fields in FAKE_REDIS.xrange("gbp-ps-test.log")]
+        expected = {
+            b"machine": b"babette",
+            b"build_id": b"100",
+            b"package": b"sys-apps/foo-1.0",
+            b"build_host": b"jenkins",
+            b"timestamp": b"1700000000.5",
+        }
+        self.assertEqual(
+            entries,
+            [{**expected, b"phase": b"compile"}, {**expected, b"phase": b"postinst"}],
+        )
+
+    def test_does_not_log_rejected_changes(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+
+        with self.assertRaises(RecordAlreadyExists):
+            repo.add_process(build_process)
+
+        with self.assertRaises(UpdateNotAllowedError):
+            repo.update_process(
+                replace(build_process, build_host="other", phase="clean")
+            )
+
+        self.assertEqual(FAKE_REDIS.xlen("gbp-ps-test.log"), 1)
+
+    def test_stream_is_capped(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        script = repo._add_process  # pylint: disable=protected-access
+
+        with mock.patch.object(repo, "_add_process", wraps=script) as add_process:
+            repo.add_process(fixtures.build_process)
+
+        self.assertIn(b"gbp-ps-test.log", add_process.call_args.kwargs["keys"])
+        self.assertIn(10000, add_process.call_args.kwargs["args"])
+
+    def test_stream_entry_is_written_by_the_script(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+
+        with mock.patch.object(FAKE_REDIS, "pipeline") as pipeline:
+            repo.add_process(fixtures.build_process)
+
+        pipeline.assert_not_called()
+        self.assertEqual(FAKE_REDIS.xlen("gbp-ps-test.log"), 1)
+
+    def test_no_stream(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        repo.stream = ""
+
+        repo.add_process(fixtures.build_process)
+
+        self.assertFalse(FAKE_REDIS.exists("gbp-ps-test.log"))
+
+
+def subscribe(channel: str) -> Any:
+    pubsub = FAKE_REDIS.pubsub()
+    pubsub.subscribe(channel)
+    pubsub.get_message()  # the subscribe confirmation
+
+    return pubsub
+
+
+def messages(pubsub: Any) -> list[str]:
+    received = []
+    while message := pubsub.get_message():
+        received.append(message["data"].decode())
+
+    return received
+
+
+@fixture(lib.settings)
+def replica_repo_fixture(fixtures: Fixtures) -> FixtureContext[RepositoryType]:
+    FAKE_REDIS.flushall()
+    FAKE_REPLICA.flushall()
+    clients = {fixtures.settings.REDIS_URL: FAKE_REDIS, REPLICA_URL: FAKE_REPLICA}
+    settings = replace(
+        fixtures.settings, STORAGE_BACKEND=fixtures.backend, REDIS_READ_URL=REPLICA_URL
+    )
+
+    with mock.patch(REDIS_FROM_URL, side_effect=lambda url, **_: clients[url]):
+        yield Repo(settings)
+
+
+def add_to_replica(settings: Any, backend: str, *processes: BuildProcess) -> None:
+    settings = replace(settings, STORAGE_BACKEND=backend, REDIS_URL=REPLICA_URL)
+
+    with mock.patch(REDIS_FROM_URL, return_value=FAKE_REPLICA):
+        repo = Repo(settings)
+
+    for process in processes:
+        repo.add_process(process)
+
+
+@given(lib.build_process, repo=replica_repo_fixture)
+@where(environ=ENVIRON, build_process__phase="compile")
+@params(backend=["redis", "redis-hash"])
+class RedisReplicaTests(lib.TestCase):
+    def test_reads_from_replica(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        on_primary = lib.BuildProcessFactory(phase="compile")
+        on_replica: BuildProcess = fixtures.build_process
+        repo.add_process(on_primary)
+        add_to_replica(fixtures.settings, fixtures.backend, on_replica)
+
+        self.assertEqual([*repo.get_processes()], [on_replica])
+
+    def test_falls_back_to_primary_when_replica_unavailable(
+        self, fixtures: Fixtures
+    ) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+
+        with mock.patch.object(
+            FAKE_REPLICA, "smembers", side_effect=redis.ConnectionError
+        ) as smembers:
+            self.assertEqual([*repo.get_processes()], [build_process])
+            self.assertEqual([*repo.get_processes()], [build_process])
+
+        # The failed replica is skipped for a while
+        smembers.assert_called_once()
+
+    def test_lagging_replica(self, fixtures: Fixtures) -> None:
+        repo = replace_max_lag(fixtures.repo, 10)
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        info = {"master_link_status": "up", "master_last_io_seconds_ago": 11}
+
+        with mock.patch.object(FAKE_REPLICA, "info", return_value=info):
+            processes = [*repo.get_processes()]
+
+        self.assertEqual(processes, [build_process])
+
+    def test_replica_within_max_lag(self, fixtures: Fixtures) -> None:
+        repo = replace_max_lag(fixtures.repo, 10)
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        info = {"master_link_status": "up", "master_last_io_seconds_ago": 1}
+
+        with mock.patch.object(FAKE_REPLICA, "info", return_value=info):
+            processes = [*repo.get_processes()]
+
+        self.assertEqual(processes, [])
+
+    def test_replica_link_down(self, fixtures: Fixtures) -> None:
+        repo = replace_max_lag(fixtures.repo, 10)
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        info = {"master_link_status": "down", "master_last_io_seconds_ago": -1}
+
+        with mock.patch.object(FAKE_REPLICA, "info", return_value=info):
+            processes = [*repo.get_processes()]
+
+        self.assertEqual(processes, [build_process])
+
+    def test_does_not_prune_machines_existing_on_primary(
+        self, fixtures: Fixtures
+    ) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        # The replica has yet to receive the machine's processes
+        FAKE_REPLICA.sadd(repo.machines_index(), build_process.machine)
+
+        self.assertEqual([*repo.get_processes()], [])
+        self.assertEqual(
+            FAKE_REDIS.smembers(repo.machines_index()), {build_process.machine.encode()}
+        )
+
+    def test_poll_falls_back_to_primary_as_a_whole(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        add_to_replica(
+            fixtures.settings,
+            fixtures.backend,
+            replace(build_process, machine="lighthouse"),
+        )
+
+        # The machines are read from the replica before it fails
+        with mock.patch.object(
+            FAKE_REPLICA, "pipeline", side_effect=redis.ConnectionError
+        ):
+            processes = [*repo.get_processes()]
+
+        self.assertEqual(processes, [build_process])
+
+
+@given(lib.build_process, repo=replica_repo_fixture)
+@where(environ=ENVIRON, build_process__phase="compile")
+@params(backend=["redis"])
+class RedisReplicaPurgeTests(lib.TestCase):
+    def test_does_not_purge_keys_existing_on_primary(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+        key = repo.key(build_process)
+        machine_index = repo.machine_index(build_process.machine)
+        # The replica has the index entries but has yet to receive the key
+        FAKE_REPLICA.sadd(repo.machines_index(), build_process.machine)
+        FAKE_REPLICA.zadd(machine_index, {key: 0})
+
+        self.assertEqual([*repo.get_processes()], [])
+        self.assertEqual(FAKE_REDIS.zrange(machine_index, 0, -1), [key])
+
+    def test_purges_keys_missing_on_primary(self, fixtures: Fixtures) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        key = repo.key(build_process)
+        machine_index = repo.machine_index(build_process.machine)
+        for client in [FAKE_REDIS, FAKE_REPLICA]:
+            client.sadd(repo.machines_index(), build_process.machine)
+            client.zadd(machine_index, {key: 0})
+
+        self.assertEqual([*repo.get_processes()], [])
+        self.assertEqual(FAKE_REDIS.zrange(machine_index, 0, -1), [])
+
+
+@given(lib.build_process, repo=replica_repo_fixture)
+@where(environ=ENVIRON, build_process__phase="compile")
+@params(backend=["redis-hash"])
+class RedisHashReplicaPurgeTests(lib.TestCase):
+    def test_does_not_purge_fields_refreshed_on_primary(
+        self, fixtures: Fixtures
+    ) -> None:
+        repo = fixtures.repo
+        build_process: BuildProcess = fixtures.build_process
+        repo.add_process(build_process)
+
+        # The replica has yet to receive the refreshed process
+        with mock.patch(REDIS_NOW, return_value=time.time() - repo.time - 1):
+            add_to_replica(fixtures.settings, fixtures.backend, build_process)
+
+        self.assertEqual([*repo.get_processes()], [])
+        self.assertEqual(FAKE_REDIS.hlen(repo.machine_hash(build_process.machine)), 1)
+
+
+def replace_max_lag(repo: Any, max_lag: int) -> Any:
+    repo.replicas.max_lag = max_lag
+
+    return repo
+
+
+@given(lib.settings)
+@where(environ=ENVIRON)
+class ReplicasFromSettingsTests(lib.TestCase):
+    def test_from_settings(self, fixtures: Fixtures) -> None:
+        settings = replace(
+            fixtures.settings,
+            REDIS_READ_URL="redis://replica1.invalid, redis://replica2.invalid",
+            REDIS_READ_MAX_LAG=5,
+        )
+
+        with mock.patch(REDIS_FROM_URL) as from_url:
+            replicas = redis_repo.Replicas.from_settings(settings)
+
+        self.assertEqual(len(replicas), 2)
+        self.assertEqual(replicas.max_lag, 5)
+        self.assertEqual(
+            from_url.call_args_list,
+            [
+                mock.call("redis://replica1.invalid"),
+                mock.call("redis://replica2.invalid"),
+            ],
+        )
+
+    def test_no_replicas_in_cluster_mode(self, fixtures: Fixtures) -> None:
+        settings = replace(
+            fixtures.settings,
+            REDIS_READ_URL="redis://replica1.invalid",
+            REDIS_CLUSTER=True,
+        )
+
+        self.assertEqual(len(redis_repo.Replicas.from_settings(settings)), 0)
+
+
+class ReplicasTests(lib.TestCase):
+    def test_replicas_are_used_in_turn(self) -> None:
+        clients: list[Any] = [mock.Mock(), mock.Mock()]
+        replicas = redis_repo.Replicas([redis_repo.Replica(c) for c in clients])
+
+        self.assertEqual(next(iter(replicas)), clients[0])
+        self.assertEqual(next(iter(replicas)), clients[1])
+        self.assertEqual(next(iter(replicas)), clients[0])
+
+        replicas.failed(clients[1])
+
+        self.assertEqual([*replicas], [clients[0]])
+        self.assertEqual([*replicas], [clients[0]])
+
+
+@given(lib.settings)
+@where(environ=ENVIRON)
+class RedisConnectTests(lib.TestCase):
+    def test_without_client_cache(self, fixtures: Fixtures) -> None:
+        settings = replace(fixtures.settings, STORAGE_BACKEND="redis")
+
+        with mock.patch(REDIS_FROM_URL) as from_url:
+            Repo(settings)
+
+        from_url.assert_called_once_with(settings.REDIS_URL)
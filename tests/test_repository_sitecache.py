@@ -1,4 +1,4 @@
-# pylint: disable=missing-docstring
+# pylint: disable=missing-docstring,unused-argument
 import threading
 import time
 from dataclasses import replace
@@ -8,8 +8,14 @@ from gbp_testkit import fixtures as testkit
 from gentoo_build_publisher.cache import clear as cache_clear
 from unittest_fixtures import Fixtures, fixture, given, where
 
+from gbp_ps.exceptions import RecordAlreadyExists, RecordNotFoundError
 from gbp_ps.repository import Repo
-from gbp_ps.repository.sitecache import SiteCacheRepository, get_key
+from gbp_ps.repository.sitecache import (
+    SiteCacheRepository,
+    decode_table,
+    encode_table,
+    get_key,
+)
 from gbp_ps.settings import Settings
 from gbp_ps.types import BuildProcess
 
@@ -26,6 +32,7 @@ def table_fixture(_: Fixtures, count: int = 7) -> dict[str, BuildProcess]:
 
 @given(monotonic=testkit.patch)
 @where(monotonic__target="gbp_ps.repository.sitecache.monotonic")
+@where(monotonic__return_value=100.0)
 @given(sleep=testkit.patch)
 @where(sleep__target="gbp_ps.repository.sitecache.sleep")
 @given(cache_clear=lambda _: cache_clear())
@@ -63,42 +70,160 @@ class SiteCacheLockTests(lib.TestCase):
     def test_set_but_not_my_key(self, fixtures: Fixtures) -> None:
         repo: SiteCacheRepository = fixtures.repo
         orig_set_lock = repo._set_lock  # pylint: disable=protected-access
-        monotonic = fixtures.monotonic
-        monotonic.return_value = 100.0
-
-        def hijack_lock(_: str) -> None:
-            repo.cache.set("lock", "otherkey")
-
-        try:
-            with mock.patch.object(repo, "_set_lock") as set_lock:
-                set_lock.side_effect = hijack_lock
+        fixtures.monotonic.return_value = 100.0
+        attempts: list[str] = []
+
+        def set_lock(key: str, name: str | None = None) -> bool:
+            attempts.append(key)
+            if len(attempts) == 1:
+                # Someone else gets there first
+                repo.cache.set("lock", "otherkey")
+            else:
+                # ...and releases it
+                repo.cache.delete("lock")
 
-                locked = threading.Event()
-                release = threading.Event()
-                thread = threading.Thread(
-                    target=lock_in_thread, args=(repo, locked, release)
-                )
-                thread.start()
+            return orig_set_lock(key, name)
 
-                time.sleep(0.5)
-                self.assertEqual(repo.cache.get("lock"), "otherkey")
+        with mock.patch.object(repo, "_set_lock", side_effect=set_lock):
+            with repo.lock() as key:
+                self.assertEqual(repo.cache.get("lock"), key)
 
-                set_lock.side_effect = orig_set_lock
-                repo.cache.delete("lock")
-                locked.wait(timeout=5)
-                self.assertNotEqual(repo.cache.get("lock"), "otherkey")
-        finally:
-            release.set()
+        self.assertEqual(attempts, [key, key])
 
     def test_timeout(self, fixtures: Fixtures) -> None:
         repo: SiteCacheRepository = fixtures.repo
+        repo.cache.set("lock", "mykey")
         monotonic = fixtures.monotonic
-        monotonic.side_effect = 100.0, 120.0
+        monotonic.side_effect = 100.0, 120.0, 120.0
 
         with self.assertRaises(TimeoutError):
             with repo.lock():
                 pass
 
+        self.assertEqual(repo.lock_stats.timeouts, 1)
+        self.assertEqual(repo.lock_stats.acquired, 0)
+        self.assertEqual(repo.lock_stats.wait_time, 20.0)
+
+    def test_default_timeout_from_settings(self, fixtures: Fixtures) -> None:
+        repo = Repo(Settings(STORAGE_BACKEND="sitecache", SITECACHE_LOCK_WAIT=2500))
+        repo.cache.set("lock", "mykey")
+        fixtures.monotonic.side_effect = 100.0, 102.0, 102.5, 102.5
+
+        with self.assertRaises(TimeoutError):
+            with repo.lock():
+                pass
+
+        self.assertEqual(fixtures.sleep.call_count, 1)
+
+    def test_held_lock_is_not_replaced(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        repo.cache.set("lock", "mykey")
+
+        # pylint: disable=protected-access
+        self.assertFalse(repo._set_lock("otherkey", None))
+        self.assertEqual(repo.cache.get("lock"), "mykey")
+
+    def test_backoff(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        repo.cache.set("lock", "mykey")
+        fixtures.monotonic.side_effect = [100.0] * 10 + [200.0, 200.0]
+
+        with mock.patch("gbp_ps.repository.sitecache.random.uniform") as uniform:
+            uniform.side_effect = lambda _low, high: high
+            with self.assertRaises(TimeoutError):
+                with repo.lock(timeout=50.0):
+                    pass
+
+        sleeps = [call.args[0] for call in fixtures.sleep.call_args_list]
+        self.assertEqual(
+            sleeps, [0.001, 0.002, 0.004, 0.008, 0.016, 0.032, 0.05, 0.05, 0.05]
+        )
+
+    def test_wait_is_recorded(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        fixtures.monotonic.side_effect = 100.0, 100.5, 100.75, 200.0, 200.0
+
+        with mock.patch.object(repo, "_set_lock") as set_lock:
+            set_lock.side_effect = [False, True]
+            with repo.lock():
+                pass
+
+        with repo.lock():
+            pass
+
+        stats = repo.lock_stats
+        self.assertEqual((stats.acquired, stats.contended, stats.timeouts), (2, 1, 0))
+        self.assertEqual(stats.wait_time, 0.75)
+        self.assertEqual(stats.max_wait, 0.75)
+
+    def test_recorded_wait_is_the_total_wait(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        clock = [100.0]
+        fixtures.monotonic.side_effect = lambda: clock[0]
+
+        fixtures.sleep.side_effect = lambda seconds: clock.__setitem__(
+            0, clock[0] + seconds
+        )
+        attempts = iter([False, False, True])
+
+        def attempt(_key: str, _name: str | None = None) -> bool:
+            # Each attempt takes 0.1 seconds
+            clock[0] += 0.1
+            return next(attempts)
+
+        with mock.patch.object(repo, "_set_lock", side_effect=attempt):
+            with mock.patch(
+                "gbp_ps.repository.sitecache.random.uniform", return_value=0.5
+            ):
+                with repo.lock(timeout=10.0):
+                    pass
+
+        # Three attempts and two sleeps
+        self.assertAlmostEqual(repo.lock_stats.wait_time, 1.3)
+
+    def test_stats_are_logged(self, fixtures: Fixtures) -> None:
+        repo = Repo(
+            Settings(STORAGE_BACKEND="sitecache", SITECACHE_LOCK_STATS_INTERVAL=60)
+        )
+        fixtures.monotonic.side_effect = 100.0, 100.0, 150.0, 150.0, 170.0, 170.0
+
+        with self.assertLogs("gbp_ps.repository.sitecache", "INFO") as logs:
+            for _ in range(3):
+                with repo.lock():
+                    pass
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("acquired=3", logs.output[0])
+
+    def test_stats_logging_disabled(self, fixtures: Fixtures) -> None:
+        repo = Repo(
+            Settings(STORAGE_BACKEND="sitecache", SITECACHE_LOCK_STATS_INTERVAL=0)
+        )
+        fixtures.monotonic.side_effect = 100.0, 100.0, 1000.0, 1000.0
+
+        with self.assertNoLogs("gbp_ps.repository.sitecache"):
+            for _ in range(2):
+                with repo.lock():
+                    pass
+
+    def test_released_on_exception(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+
+        with self.assertRaises(RuntimeError):
+            with repo.lock():
+                raise RuntimeError()
+
+        self.assertFalse(repo.cache.contains("lock"))
+
+    def test_does_not_release_someone_elses_lock(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+
+        with repo.lock():
+            # Our lease expired and someone else took the lock
+            repo.cache.set("lock", "otherkey")
+
+        self.assertEqual(repo.cache.get("lock"), "otherkey")
+
 
 @given(cache_clear=lambda _: cache_clear())
 @given(repo=lambda _: Repo(Settings(STORAGE_BACKEND="sitecache")))
@@ -191,3 +316,372 @@ def lock_in_thread(
     with repo.lock():
         locked.set()
         release.wait(timeout=5)
+
+
+@given(cache_clear=lambda _: cache_clear())
+@given(repo=lambda _: Repo(Settings(STORAGE_BACKEND="sitecache")))
+class SiteCacheShardTests(lib.TestCase):
+    def test_tables_per_machine(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        p1 = lib.BuildProcessFactory(machine="babette")
+        p2 = lib.BuildProcessFactory(machine="lighthouse")
+
+        repo.add_process(p1)
+        repo.add_process(p2)
+
+        self.assertEqual(repo.machines(), {"babette", "lighthouse"})
+        self.assertEqual(repo.read_shard("babette"), (1, {get_key(p1): p1}))
+        self.assertEqual(repo.read_shard("lighthouse"), (1, {get_key(p2): p2}))
+
+    def test_write_only_sets_the_machines_table(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        process = lib.BuildProcessFactory(machine="babette", phase="compile")
+        repo.add_process(process)
+        repo.add_process(lib.BuildProcessFactory(machine="lighthouse"))
+
+        with mock.patch.object(repo.cache, "set", wraps=repo.cache.set) as cache_set:
+            repo.update_process(replace(process, phase="install"))
+
+        self.assertEqual(
+            [call.args[0] for call in cache_set.call_args_list], ["table:babette"]
+        )
+
+    def test_machine_locks_are_independent(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        process = lib.BuildProcessFactory(machine="lighthouse", phase="compile")
+
+        with repo.lock("babette"):
+            repo.add_process(process)
+            repo.update_process(replace(process, phase="install"))
+
+            with self.assertRaises(TimeoutError):
+                with repo.lock("babette", timeout=0.01):
+                    pass
+
+        self.assertEqual([*repo.get_processes()], [replace(process, phase="install")])
+
+    def test_get_processes_for_machine_reads_only_its_table(
+        self, fixtures: Fixtures
+    ) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        process = lib.BuildProcessFactory(machine="babette")
+        repo.add_process(process)
+        repo.add_process(lib.BuildProcessFactory(machine="lighthouse"))
+
+        with mock.patch.object(repo.cache, "get", wraps=repo.cache.get) as cache_get:
+            processes = [*repo.get_processes(machine="babette")]
+
+        self.assertEqual(processes, [process])
+        keys = {call.args[0] for call in cache_get.call_args_list}
+        self.assertNotIn("table:lighthouse", keys)
+        self.assertNotIn("machines", keys)
+
+    def test_add_process_is_one_transaction(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        process = lib.BuildProcessFactory(machine="babette", phase="compile")
+        repo.add_process(lib.BuildProcessFactory(machine="babette", package="a/b-1"))
+        repo.add_process(replace(process, build_id="1"))
+
+        with (
+            mock.patch.object(repo, "lock", wraps=repo.lock) as lock,
+            mock.patch.object(repo.cache, "get", wraps=repo.cache.get) as cache_get,
+            mock.patch.object(repo.cache, "set", wraps=repo.cache.set) as cache_set,
+        ):
+            repo.add_process(replace(process, build_id="2"))
+
+        lock.assert_called_once_with("babette")
+        reads = [
+            call for call in cache_get.call_args_list if call.args[0] == "table:babette"
+        ]
+        self.assertEqual(len(reads), 1)
+        self.assertEqual(len(cache_set.call_args_list), 1)
+        self.assertEqual(len(repo.get_shard("babette")), 2)
+
+    def test_ps_does_not_hold_lock_while_yielding(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        live = lib.BuildProcessFactory(machine="babette")
+        expired = lib.BuildProcessFactory(machine="babette")
+        expired = replace(expired, start_time=expired.start_time - repo.expiration)
+        repo.set_table({get_key(live): live, get_key(expired): expired})
+
+        processes = iter(repo.ps())
+
+        self.assertEqual(next(processes), live)
+        self.assertFalse(repo.cache.contains("lock:babette"))
+        self.assertEqual(repo.get_shard("babette"), {get_key(live): live})
+
+    def test_machines_outlive_the_table_timeout(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        p1 = lib.BuildProcessFactory(machine="babette")
+        p2 = lib.BuildProcessFactory(machine="babette")
+        timeout = repo.settings.SITECACHE_PROCESS_EXPIRATION
+        start = time.time()
+        repo.add_process(p1)
+
+        # The machine's table is rewritten, but not the directory
+        with mock.patch("time.time", return_value=start + timeout - 10):
+            repo.add_process(p2)
+
+        with mock.patch("time.time", return_value=start + timeout + 10):
+            processes = [*repo.get_processes()]
+
+        self.assertCountEqual(processes, [p1, p2])
+
+    def test_purge_prunes_machines(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        timeout = repo.settings.SITECACHE_PROCESS_EXPIRATION
+        start = time.time()
+        repo.add_process(lib.BuildProcessFactory(machine="babette"))
+        repo.add_process(lib.BuildProcessFactory(machine="lighthouse"))
+        expired = lib.BuildProcessFactory(machine="gentoo")
+        expired = replace(expired, start_time=expired.start_time - repo.expiration)
+
+        # babette's table expires. lighthouse's is rewritten, as is gentoo's but with
+        # only an expired process
+        with mock.patch("time.time", return_value=start + timeout - 10):
+            repo.add_process(lib.BuildProcessFactory(machine="lighthouse"))
+            repo.add_process(expired)
+
+        with mock.patch("time.time", return_value=start + timeout + 10):
+            processes = [*repo.get_processes()]
+            machines = repo.machines()
+
+        self.assertEqual(len(processes), 2)
+        self.assertEqual(machines, {"lighthouse"})
+
+    def test_prune_keeps_machines_written_meanwhile(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        process = lib.BuildProcessFactory(machine="babette")
+        repo.set_machines({"babette"})
+        set_machines = repo.set_machines
+
+        def write_first(machines: set[str]) -> None:
+            if not repo.get_shard("babette"):
+                # babette is written while still in the directory being rewritten
+                repo.add_process(process)
+            set_machines(machines)
+
+        with mock.patch.object(repo, "set_machines", side_effect=write_first):
+            repo.prune_machines(["babette"])
+
+        self.assertEqual(repo.machines(), {"babette"})
+        self.assertEqual([*repo.get_processes()], [process])
+
+    def test_set_table(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        repo.add_process(lib.BuildProcessFactory(machine="lighthouse"))
+        process = lib.BuildProcessFactory(machine="babette")
+
+        repo.set_table({get_key(process): process})
+
+        self.assertEqual(repo.machines(), {"babette"})
+        self.assertEqual(repo.get_table(), {get_key(process): process})
+        self.assertEqual(repo.read_shard("lighthouse"), (2, {}))
+
+    def test_converts_unsharded_table(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        p1 = lib.BuildProcessFactory(machine="babette")
+        p2 = lib.BuildProcessFactory(machine="lighthouse")
+        repo.cache.set("table", {get_key(p1): p1, get_key(p2): p2})
+
+        repo = SiteCacheRepository(repo.settings)
+
+        self.assertFalse(repo.cache.contains("table"))
+        self.assertEqual(repo.machines(), {"babette", "lighthouse"})
+        self.assertEqual(repo.get_table(), {get_key(p1): p1, get_key(p2): p2})
+
+
+@given(cache_clear=lambda _: cache_clear())
+@given(
+    repo=lambda _: Repo(
+        Settings(STORAGE_BACKEND="sitecache", SITECACHE_WRITE_MODE="cas")
+    )
+)
+@given(sleep=testkit.patch)
+@where(sleep__target="gbp_ps.repository.sitecache.sleep")
+class SiteCacheCASTests(lib.TestCase):
+    def test_add_and_update(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        process = lib.BuildProcessFactory(phase="compile")
+
+        repo.add_process(process)
+        repo.update_process(replace(process, phase="install"))
+
+        self.assertEqual([*repo.get_processes()], [replace(process, phase="install")])
+        self.assertEqual(repo.read_shard(process.machine)[0], 2)
+
+    def test_does_not_lock(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        process = lib.BuildProcessFactory(machine="babette", phase="compile")
+        repo.add_process(process)
+
+        with repo.lock("babette"):
+            repo.update_process(replace(process, phase="install"))
+
+        self.assertEqual([*repo.get_processes()], [replace(process, phase="install")])
+
+    def test_conflict_reapplies_change_to_new_table(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        p1 = lib.BuildProcessFactory(machine="babette")
+        p2 = lib.BuildProcessFactory(machine="babette")
+        claim = repo._claim  # pylint: disable=protected-access
+        attempts: list[int] = []
+
+        def other_writer_first(machine: str, version: int) -> bool:
+            if not attempts:
+                # Another writer claims and writes this version before we can
+                claim(machine, version)
+                repo.write_shard(machine, version, {get_key(p2): p2})
+            attempts.append(version)
+
+            return claim(machine, version)
+
+        with mock.patch.object(repo, "_claim", side_effect=other_writer_first):
+            repo.add_process(p1)
+
+        self.assertEqual(attempts, [1, 2])
+        self.assertEqual(repo.get_shard("babette"), {get_key(p1): p1, get_key(p2): p2})
+        self.assertEqual(repo.read_shard("babette")[0], 2)
+        self.assertEqual(repo.lock_stats.contended, 1)
+
+    def test_claimed_version_is_not_committed(self, fixtures: Fixtures) -> None:
+        settings = replace(fixtures.repo.settings, SITECACHE_LOCK_WAIT=10)
+        repo = SiteCacheRepository(settings)
+        p1 = lib.BuildProcessFactory(machine="babette")
+        repo._claim("babette", 1)  # pylint: disable=protected-access
+
+        with self.assertRaises(TimeoutError):
+            repo.add_process(p1)
+
+        self.assertEqual(repo.get_shard("babette"), {})
+        self.assertEqual(repo.lock_stats.timeouts, 1)
+
+    def test_failed_change_writes_nothing(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        process = lib.BuildProcessFactory(machine="babette")
+        repo.add_process(process)
+
+        with self.assertRaises(RecordAlreadyExists):
+            repo.add_process(process)
+        with self.assertRaises(RecordNotFoundError):
+            repo.update_process(lib.BuildProcessFactory(machine="babette"))
+
+        self.assertEqual(repo.read_shard("babette"), (1, {get_key(process): process}))
+
+    def test_failed_change_is_not_a_lock_failure(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        process = lib.BuildProcessFactory(machine="babette")
+        repo.add_process(process)
+
+        with self.assertRaises(RecordAlreadyExists):
+            repo.add_process(process)
+        with self.assertRaises(RecordNotFoundError):
+            repo.update_process(lib.BuildProcessFactory(machine="babette"))
+
+        self.assertEqual(repo.lock_stats.failures, 0)
+        self.assertEqual(repo.lock_stats.timeouts, 0)
+
+    def test_reapplied_change_that_fails(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        process = lib.BuildProcessFactory(machine="babette")
+        claim = repo._claim  # pylint: disable=protected-access
+
+        def other_writer_first(machine: str, version: int) -> bool:
+            # Another writer adds the same process first
+            claim(machine, version)
+            repo.write_shard(machine, version, {get_key(process): process})
+
+            return claim(machine, version)
+
+        with mock.patch.object(repo, "_claim", side_effect=other_writer_first):
+            with self.assertRaises(RecordAlreadyExists):
+                repo.add_process(process)
+
+        self.assertEqual(repo.read_shard("babette"), (1, {get_key(process): process}))
+        self.assertEqual(repo.lock_stats.failures, 0)
+
+    def test_failed_claim_is_recorded(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+
+        with mock.patch.object(repo, "_claim", side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                repo.add_process(lib.BuildProcessFactory(machine="babette"))
+
+        self.assertEqual(repo.lock_stats.failures, 1)
+
+    def test_ps_purges_without_locking(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        live = lib.BuildProcessFactory(machine="babette")
+        expired = lib.BuildProcessFactory(machine="babette")
+        expired = replace(expired, start_time=expired.start_time - repo.expiration)
+        repo.set_table({get_key(live): live, get_key(expired): expired})
+
+        with mock.patch.object(repo, "lock") as lock:
+            processes = [*repo.ps()]
+
+        self.assertEqual(processes, [live])
+        self.assertEqual(repo.get_shard("babette"), {get_key(live): live})
+        lock.assert_not_called()
+
+    def test_concurrent_writers(self, fixtures: Fixtures) -> None:
+        repo: SiteCacheRepository = fixtures.repo
+        processes = [
+            lib.BuildProcessFactory(machine="babette", package=f"app-misc/foo-{i}")
+            for i in range(16)
+        ]
+        repo.add_process(processes[0])
+        threads = [
+            threading.Thread(target=repo.add_process, args=(process,))
+            for process in processes[1:]
+        ]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(set(repo.get_processes()), set(processes))
+        self.assertEqual(repo.read_shard("babette")[0], 16)
+
+    def test_invalid_write_mode(self, fixtures: Fixtures) -> None:
+        settings = replace(fixtures.repo.settings, SITECACHE_WRITE_MODE="optimistic")
+
+        with self.assertRaises(ValueError):
+            SiteCacheRepository(settings)
+
+
+@given(table_fixture)
+class TableEncodingTests(lib.TestCase):
+    def test_round_trip(self, fixtures: Fixtures) -> None:
+        table = fixtures.table
+
+        value = encode_table(table)
+
+        self.assertIsInstance(value, bytes)
+        self.assertEqual(decode_table(value), table)
+
+    def test_strings_are_interned(self, fixtures: Fixtures) -> None:
+        table = {
+            get_key(process): process
+            for process in lib.BuildProcessFactory.create_batch(
+                20, machine="babette", build_host="builder", phase="compile"
+            )
+        }
+
+        value = encode_table(table)
+
+        self.assertEqual(value.count(b"babette"), 1)
+        self.assertEqual(value.count(b"builder"), 1)
+        self.assertEqual(value.count(b"compile"), 1)
+
+    def test_without_ormsgpack(self, fixtures: Fixtures) -> None:
+        table = fixtures.table
+
+        with mock.patch("gbp_ps.repository.sitecache.ormsgpack", None):
+            value = encode_table(table)
+
+        self.assertIsInstance(value, list)
+        self.assertEqual(decode_table(value), table)
+
+    def test_empty_table(self, fixtures: Fixtures) -> None:
+        self.assertEqual(decode_table(encode_table({})), {})
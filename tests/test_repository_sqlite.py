@@ -0,0 +1,561 @@
+# pylint: disable=missing-docstring
+import datetime as dt
+import multiprocessing
+import random
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dataclasses import replace
+from typing import Generator
+from unittest import mock
+
+from unittest_fixtures import Fixtures, given
+
+from gbp_ps.repository import add_or_update_process
+from gbp_ps.repository.sqlite import (
+    SCHEMA_VERSION,
+    SqliteRepository,
+    memory_database_uri,
+)
+from gbp_ps.settings import Settings
+from gbp_ps.types import BuildProcess
+
+from . import lib
+
+WRITERS = 16
+PROCESSES_PER_WRITER = 25
+
+
+@given(lib.tempdb, repo=lib.repo_fixture)
+class SqliteConnectionTests(lib.TestCase):
+    def test_connection_is_reused(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+        build_process = lib.BuildProcessFactory(phase="compile")
+
+        with mock.patch.object(sqlite3, "connect", wraps=sqlite3.connect) as connect:
+            repo.add_process(build_process)
+            repo.update_process(build_process)
+            processes = [*repo.get_processes()]
+
+        self.assertEqual(processes, [build_process])
+        connect.assert_not_called()
+
+    def test_connection_per_thread(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+        connections: list[sqlite3.Connection] = []
+        thread = threading.Thread(target=lambda: connections.append(repo.connection()))
+        thread.start()
+        thread.join()
+
+        self.assertIsNot(connections[0], repo.connection())
+        self.assertIs(repo.connection(), repo.connection())
+
+    def test_close(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+        connection = repo.connection()
+
+        repo.close()
+
+        self.assertIsNot(repo.connection(), connection)
+
+    def test_pragmas(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+
+        with repo.cursor() as cursor:
+            journal_mode = cursor.execute("PRAGMA journal_mode").fetchone()[0]
+            busy_timeout = cursor.execute("PRAGMA busy_timeout").fetchone()[0]
+            synchronous = cursor.execute("PRAGMA synchronous").fetchone()[0]
+
+        self.assertEqual(journal_mode, "wal")
+        self.assertEqual(busy_timeout, 5000)
+        self.assertEqual(synchronous, 1)  # NORMAL
+
+    def test_invalid_synchronous_mode(self, fixtures: Fixtures) -> None:
+        settings = Settings(SQLITE_DATABASE=fixtures.tempdb, SQLITE_SYNCHRONOUS="bogus")
+
+        with self.assertRaises(ValueError):
+            SqliteRepository(settings)
+
+    def test_failed_update_is_rolled_back(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+        build_process = lib.BuildProcessFactory(phase="compile")
+
+        with self.assertRaises(RuntimeError):
+            with repo.transaction() as cursor:
+                cursor.execute(
+                    f"INSERT INTO ebuild_process ({repo.row_names}) VALUES (?,?,?,?,?,?)",
+                    repo.process_to_row(build_process),
+                )
+                raise RuntimeError()
+
+        self.assertEqual([*repo.get_processes()], [])
+        self.assertFalse(repo.connection().in_transaction)
+
+    def test_data_version_changes_on_other_connections_commit(
+        self, fixtures: Fixtures
+    ) -> None:
+        repo: SqliteRepository = fixtures.repo
+        other = SqliteRepository(Settings(SQLITE_DATABASE=fixtures.tempdb))
+        version = repo.data_version()
+
+        self.assertEqual(repo.data_version(), version)
+
+        other.add_process(lib.BuildProcessFactory())
+
+        self.assertNotEqual(repo.data_version(), version)
+
+
+@given(lib.tempdb)
+class SqliteConcurrentWritersTests(lib.TestCase):
+    def test_concurrent_writer_processes(self, fixtures: Fixtures) -> None:
+        database = fixtures.tempdb
+        SqliteRepository(Settings(SQLITE_DATABASE=database))
+        context = multiprocessing.get_context("fork")
+
+        with context.Pool(WRITERS) as pool:
+            errors = pool.starmap(
+                write_processes, [(database, f"machine{i}") for i in range(WRITERS)]
+            )
+
+        self.assertEqual(errors, [None] * WRITERS)
+        repo = SqliteRepository(Settings(SQLITE_DATABASE=database))
+        processes = [*repo.get_processes(include_final=True)]
+        self.assertEqual(len(processes), WRITERS * PROCESSES_PER_WRITER)
+        self.assertTrue(all(process.phase == "postinst" for process in processes))
+
+
+def write_processes(database: str, machine: str) -> str | None:
+    """Add, then update, processes in the database like concurrent emerge jobs would
+
+    Return the error, if any, as a string
+    """
+    return write_to_repo(SqliteRepository(Settings(SQLITE_DATABASE=database)), machine)
+
+
+def write_to_repo(repo: SqliteRepository, machine: str) -> str | None:
+    start_time = dt.datetime.now(tz=dt.UTC).replace(microsecond=0)
+
+    try:
+        for i in range(PROCESSES_PER_WRITER):
+            process = BuildProcess(
+                machine=machine,
+                build_id="1",
+                build_host="builder",
+                package=f"app-misc/package-{i}",
+                phase="compile",
+                start_time=start_time,
+            )
+            add_or_update_process(repo, process)
+            add_or_update_process(repo, replace(process, phase="postinst"))
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        return repr(error)
+
+    return None
+
+
+class SqliteMemoryDatabaseTests(lib.TestCase):
+    def test_database_is_shared_by_connections(self) -> None:
+        repo = SqliteRepository(Settings(SQLITE_DATABASE=":memory:"))
+        build_process = lib.BuildProcessFactory(phase="compile")
+        repo.add_process(build_process)
+        processes: list[BuildProcess] = []
+
+        thread = threading.Thread(target=lambda: processes.extend(repo.get_processes()))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(processes, [build_process])
+
+    def test_database_outlives_connections(self) -> None:
+        repo = SqliteRepository(Settings(SQLITE_DATABASE=":memory:"))
+        build_process = lib.BuildProcessFactory(phase="compile")
+        repo.add_process(build_process)
+
+        repo.close()
+
+        self.assertEqual([*repo.get_processes()], [build_process])
+
+    def test_repositories_have_their_own_database(self) -> None:
+        repo = SqliteRepository(Settings(SQLITE_DATABASE=":memory:"))
+        other = SqliteRepository(Settings(SQLITE_DATABASE=":memory:"))
+        repo.add_process(lib.BuildProcessFactory(phase="compile"))
+
+        self.assertEqual([*other.get_processes()], [])
+
+    def test_named_database_is_shared_by_repositories(self) -> None:
+        uri = memory_database_uri("test_named_database_is_shared_by_repositories")
+        repo = SqliteRepository(Settings(SQLITE_DATABASE=uri))
+        other = SqliteRepository(Settings(SQLITE_DATABASE=uri))
+        build_process = lib.BuildProcessFactory(phase="compile")
+        repo.add_process(build_process)
+
+        self.assertEqual([*other.get_processes()], [build_process])
+
+    def test_concurrent_writer_threads(self) -> None:
+        repo = SqliteRepository(Settings(SQLITE_DATABASE=":memory:"))
+        errors: list[str | None] = []
+
+        def write(machine: str) -> None:
+            errors.append(write_to_repo(repo, machine))
+
+        threads = [
+            threading.Thread(target=write, args=(f"machine{i}",))
+            for i in range(WRITERS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [None] * WRITERS)
+        processes = [*repo.get_processes(include_final=True)]
+        self.assertEqual(len(processes), WRITERS * PROCESSES_PER_WRITER)
+
+
+@given(lib.tempdb, repo=lib.repo_fixture)
+class SqliteBulkWriteTests(lib.TestCase):
+    def test_same_as_add_or_update_process(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+        other = SqliteRepository(Settings(SQLITE_DATABASE=":memory:"))
+        existing = random_processes(random.Random(1), 50)
+        processes = random_processes(random.Random(2), 500)
+
+        for process in existing:
+            add_or_update_process(repo, process)
+            add_or_update_process(other, process)
+
+        for process in processes:
+            add_or_update_process(repo, process)
+        other.add_or_update_processes(iter(processes))
+
+        self.assertEqual(
+            set(other.get_processes(include_final=True)),
+            set(repo.get_processes(include_final=True)),
+        )
+
+    def test_single_transaction(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+        processes = random_processes(random.Random(3), 100)
+
+        with traced(repo) as statements:
+            repo.add_or_update_processes(processes)
+
+        self.assertEqual(statements.count("BEGIN IMMEDIATE"), 1)
+        self.assertEqual(statements.count("COMMIT"), 1)
+
+    def test_update_not_allowed(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+        build_process = lib.BuildProcessFactory(phase="compile", build_host="builder")
+        finalized = replace(build_process, build_host="other", phase="clean")
+
+        repo.add_or_update_processes([build_process, finalized])
+
+        self.assertEqual([*repo.get_processes(include_final=True)], [build_process])
+
+    def test_empty(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+
+        repo.add_or_update_processes([])
+
+        self.assertEqual([*repo.get_processes(include_final=True)], [])
+
+
+def random_processes(rand: random.Random, count: int) -> list[BuildProcess]:
+    phases = [*BuildProcess.build_phases, *sorted(BuildProcess.final_phases)]
+    start_time = dt.datetime(2025, 1, 1, tzinfo=dt.UTC)
+
+    return [
+        BuildProcess(
+            machine=rand.choice(["babette", "lighthouse"]),
+            build_id=rand.choice(["1", "2", "3"]),
+            build_host=rand.choice(["builder", "jenkins"]),
+            package=rand.choice(lib.PACKAGES),
+            phase=rand.choice(phases),
+            start_time=start_time + dt.timedelta(seconds=rand.randrange(100)),
+        )
+        for _ in range(count)
+    ]
+
+
+@given(lib.tempdb, repo=lib.repo_fixture)
+class SqliteMaintenanceTests(lib.TestCase):
+    def test_prune(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+        now = dt.datetime.now(tz=dt.UTC).replace(microsecond=0)
+        old = [
+            lib.BuildProcessFactory(phase=phase, start_time=now - dt.timedelta(days=2))
+            for phase in ["compile", "clean", "postrm"]
+        ]
+        new = lib.BuildProcessFactory(phase="compile", start_time=now)
+        repo.add_or_update_processes([*old, new])
+
+        pruned = repo.prune(86400)
+
+        self.assertEqual(pruned, 3)
+        self.assertEqual([*repo.get_processes(include_final=True)], [new])
+
+    def test_prune_0_prunes_nothing(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+        start_time = dt.datetime(2023, 11, 11, tzinfo=dt.UTC)
+        repo.add_process(lib.BuildProcessFactory(start_time=start_time))
+
+        self.assertEqual(repo.prune(0), 0)
+        self.assertEqual(len([*repo.get_processes(include_final=True)]), 1)
+
+    def test_not_due_on_new_database(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+        start_time = dt.datetime(2023, 11, 11, tzinfo=dt.UTC)
+        repo.add_process(lib.BuildProcessFactory(start_time=start_time))
+
+        self.assertEqual(repo.maintain(), 0)
+        self.assertEqual(len([*repo.get_processes(include_final=True)]), 1)
+
+    def test_add_process_maintains_when_due(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+        start_time = dt.datetime(2023, 11, 11, tzinfo=dt.UTC)
+        stale = lib.BuildProcessFactory(start_time=start_time)
+        repo.add_process(stale)
+        set_last_maintenance(repo, 0)
+
+        process = lib.BuildProcessFactory()
+        repo.add_process(process)
+
+        self.assertEqual([*repo.get_processes(include_final=True)], [process])
+        self.assertGreater(last_maintenance(repo), 0)
+
+    def test_maintain_runs_once_per_interval(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+        set_last_maintenance(repo, 0)
+        repo.maintain()
+        last_run = last_maintenance(repo)
+        set_last_maintenance(repo, last_run - repo.maintenance_interval + 60)
+        start_time = dt.datetime(2023, 11, 11, tzinfo=dt.UTC)
+        repo.add_process(lib.BuildProcessFactory(start_time=start_time))
+
+        self.assertEqual(repo.maintain(), 0)
+        self.assertEqual(len([*repo.get_processes(include_final=True)]), 1)
+
+    def test_maintenance_interval_0_disables(self, fixtures: Fixtures) -> None:
+        repo = SqliteRepository(
+            Settings(SQLITE_DATABASE=fixtures.tempdb, SQLITE_MAINTENANCE_INTERVAL=0)
+        )
+        set_last_maintenance(repo, 0)
+        start_time = dt.datetime(2023, 11, 11, tzinfo=dt.UTC)
+        repo.add_process(lib.BuildProcessFactory(start_time=start_time))
+
+        self.assertEqual(repo.maintain(), 0)
+        self.assertEqual(last_maintenance(repo), 0)
+
+    def test_new_database_is_incrementally_vacuumed(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+        add_and_prune(repo)
+
+        self.assertEqual(pragma(repo, "auto_vacuum"), 2)  # INCREMENTAL
+        self.assertGreater(pragma(repo, "freelist_count"), 0)
+
+        repo.vacuum()
+
+        self.assertEqual(pragma(repo, "freelist_count"), 0)
+
+    def test_full_vacuum_converts_old_database(self, fixtures: Fixtures) -> None:
+        database = f"{fixtures.tmpdir}/old.db"
+        connection = sqlite3.connect(database)
+        for statement in OLD_SCHEMA:
+            connection.execute(statement)
+        connection.close()
+        repo = SqliteRepository(Settings(SQLITE_DATABASE=database))
+        add_and_prune(repo)
+        self.assertEqual(pragma(repo, "auto_vacuum"), 0)
+
+        repo.vacuum(full=True)
+
+        self.assertEqual(pragma(repo, "auto_vacuum"), 2)
+        self.assertEqual(pragma(repo, "freelist_count"), 0)
+
+
+def set_last_maintenance(repo: SqliteRepository, last_run: int) -> None:
+    with repo.cursor() as cursor:
+        cursor.execute("UPDATE maintenance SET last_run = ?", (last_run,))
+
+
+def last_maintenance(repo: SqliteRepository) -> int:
+    with repo.cursor() as cursor:
+        last_run: int = cursor.execute("SELECT last_run FROM maintenance").fetchone()[0]
+
+    return last_run
+
+
+def pragma(repo: SqliteRepository, name: str) -> int:
+    with repo.cursor() as cursor:
+        value: int = cursor.execute(f"PRAGMA {name}").fetchone()[0]
+
+    return value
+
+
+def add_and_prune(repo: SqliteRepository) -> None:
+    """Fill some pages with (old) processes and then prune them"""
+    start_time = dt.datetime(2023, 11, 11, tzinfo=dt.UTC)
+    repo.add_or_update_processes(
+        lib.BuildProcessFactory(start_time=start_time, package=f"app-misc/pkg-{i}")
+        for i in range(1000)
+    )
+    repo.prune(86400)
+
+
+# The schema before versioning
+OLD_SCHEMA = (
+    """
+    CREATE TABLE ebuild_process (
+        machine VARCHAR(255),
+        build_id VARCHAR(255),
+        build_host VARCHAR(255),
+        package VARCHAR(255),
+        phase VARCHAR(255),
+        start_time INTEGER
+    )
+    """,
+    "CREATE INDEX idx_machine ON ebuild_process (machine)",
+    "CREATE INDEX idx_phase ON ebuild_process (phase)",
+    """
+    CREATE UNIQUE INDEX idx_unique_process
+    ON ebuild_process (machine, build_id, build_host, package)
+    """,
+)
+
+
+@given(lib.tempdb)
+class SqliteSchemaTests(lib.TestCase):
+    def test_new_database(self, fixtures: Fixtures) -> None:
+        repo = SqliteRepository(Settings(SQLITE_DATABASE=fixtures.tempdb))
+
+        with repo.cursor() as cursor:
+            self.assertEqual(repo.schema_version(cursor), SCHEMA_VERSION)
+        self.assertEqual(
+            indexes(repo),
+            {
+                "idx_live_start_time",
+                "idx_machine_package_phase",
+                "idx_machine_start_time",
+                "idx_process",
+                "idx_start_time",
+            },
+        )
+
+    def test_upgrade(self, fixtures: Fixtures) -> None:
+        connection = sqlite3.connect(fixtures.tempdb)
+        for statement in OLD_SCHEMA:
+            connection.execute(statement)
+        build_process = lib.BuildProcessFactory(phase="compile")
+        connection.execute(
+            "INSERT INTO ebuild_process VALUES (?,?,?,?,?,?)",
+            SqliteRepository.process_to_row(build_process),
+        )
+        connection.commit()
+        connection.close()
+
+        repo = SqliteRepository(Settings(SQLITE_DATABASE=fixtures.tempdb))
+
+        with repo.cursor() as cursor:
+            self.assertEqual(repo.schema_version(cursor), SCHEMA_VERSION)
+        self.assertNotIn("idx_unique_process", indexes(repo))
+        self.assertIn("idx_process", indexes(repo))
+        self.assertEqual([*repo.get_processes()], [build_process])
+
+    def test_upgrade_is_idempotent(self, fixtures: Fixtures) -> None:
+        repo = SqliteRepository(Settings(SQLITE_DATABASE=fixtures.tempdb))
+        with repo.cursor() as cursor:
+            cursor.execute("PRAGMA user_version = 0")
+
+        repo.init_db()
+
+        with repo.cursor() as cursor:
+            self.assertEqual(repo.schema_version(cursor), SCHEMA_VERSION)
+
+    def test_current_schema_is_not_upgraded(self, fixtures: Fixtures) -> None:
+        repo = SqliteRepository(Settings(SQLITE_DATABASE=fixtures.tempdb))
+        statements: list[str] = []
+        repo.connection().set_trace_callback(statements.append)
+
+        repo.init_db()
+
+        self.assertEqual(statements, ["PRAGMA user_version"])
+
+
+@given(repo=lib.repo_fixture)
+class SqliteQueryPlanTests(lib.TestCase):
+    """The repository's queries use indexes rather than scanning the table"""
+
+    def test_add_process(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+        build_process = lib.BuildProcessFactory(phase="compile")
+
+        with traced(repo) as statements:
+            repo.add_process(build_process)
+
+        self.assert_no_table_scans(repo, statements)
+
+    def test_update_process(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+        build_process = lib.BuildProcessFactory(phase="compile")
+        repo.add_process(build_process)
+
+        with traced(repo) as statements:
+            repo.update_process(replace(build_process, phase="postinst"))
+
+        self.assert_no_table_scans(repo, statements)
+
+    def test_get_processes(self, fixtures: Fixtures) -> None:
+        repo: SqliteRepository = fixtures.repo
+        repo.add_process(lib.BuildProcessFactory(phase="compile"))
+
+        for include_final in [False, True]:
+            for machine in [None, "babette"]:
+                with traced(repo) as statements:
+                    processes = [
+                        *repo.get_processes(
+                            include_final=include_final, machine=machine
+                        )
+                    ]
+
+                self.assertEqual(len(processes), 1)
+                self.assert_no_table_scans(repo, statements)
+
+    def assert_no_table_scans(
+        self, repo: SqliteRepository, statements: list[str]
+    ) -> None:
+        queries = [s for s in statements if re.match(r"\s*(SELECT|UPDATE|DELETE)", s)]
+        self.assertTrue(queries)
+
+        for query in queries:
+            with repo.cursor() as cursor:
+                plan = [row[3] for row in cursor.execute(f"EXPLAIN QUERY PLAN {query}")]
+
+            for detail in plan:
+                with self.subTest(query=query, detail=detail):
+                    self.assertFalse(
+                        detail.startswith("SCAN") and "INDEX" not in detail
+                    )
+                    self.assertNotIn("TEMP B-TREE", detail)
+
+
+@contextmanager
+def traced(repo: SqliteRepository) -> Generator[list[str], None, None]:
+    """Collect the statements executed by the repo's connection"""
+    statements: list[str] = []
+    connection = repo.connection()
+    connection.set_trace_callback(statements.append)
+
+    try:
+        yield statements
+    finally:
+        connection.set_trace_callback(None)
+
+
+def indexes(repo: SqliteRepository) -> set[str]:
+    with repo.cursor() as cursor:
+        rows = cursor.execute(
+            "SELECT name FROM sqlite_master"
+            " WHERE type = 'index' AND tbl_name = 'ebuild_process'"
+        )
+        return {name for (name,) in rows}